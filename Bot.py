@@ -2,11 +2,37 @@ from pyrogram import Client,filters
 from unittest import result         
 from pyrogram.types import ChatPermissions
 from pyrogram.types import InlineKeyboardButton, InlineKeyboardMarkup , ReplyKeyboardMarkup
-import MetaTrader5 as mt5
 import pandas as pd
 from datetime import datetime
 import time
 import sqlite3
+import asyncio
+import atexit
+import io
+import os
+import threading
+from journal import TradeJournal
+from bars import TimeframeSet, TIMEFRAME_SECONDS
+from ticks import TickStream
+from snapshot import save_snapshot, load_snapshot
+from exposure import ExposureLedger
+from signals import stack_windows, batch_evaluate, htf_confirms
+from patterns import bar_patterns, BULL_ENGULFING, BEAR_ENGULFING
+from orders import OrderGuard
+from recorder import broker_from_env
+from connection import BrokerConnection, BrokerUnavailable
+from subscriptions import SubscriptionRegistry, Notifier, EVENTS
+from charts import ChartRenderer
+
+# Shared services, created by setup() in the bot process only (see the bottom of the file):
+# the chart workers import this module too and must not open the broker, journal or databases.
+mt5 = None
+journal = None
+ledger = None
+order_guard = None
+subscriptions = None
+notifier = None
+charts = None
 
 
 # Initialize the Pyrogram client
@@ -59,7 +85,7 @@ START_MESSAGE = "Please select an action"
 START_MESSAGE_BUTTONS = [
     [InlineKeyboardButton("AutoTrade", callback_data="autotrade"),
      InlineKeyboardButton("Generate Signal", callback_data="generatesignal")],
-    [InlineKeyboardButton("Candlestick chart", url='http://192.168.8.116:8080')]
+    [InlineKeyboardButton("Candlestick chart", callback_data="chart")]
 ]
 
 REPLY_MESSAGE = "Choose your currency pair"
@@ -83,11 +109,8 @@ def start_command_handler(client, message):
 
 # Function to get exposure
 def get_exposure(symbol):
-    position = mt5.positions_get(symbol=symbol)
-    if position:
-        pos_df = pd.DataFrame(position, columns=position[0]._asdict().keys())
-        exposure = pos_df['volume'].sum()
-        return exposure
+    ledger.refresh(mt5.positions_get, max_age=30)
+    return ledger.symbol_gross_lots(symbol)
 
 # Function to look for trading signals
 def signal(symbol, timeframe, sma_period):
@@ -105,733 +128,1153 @@ def signal(symbol, timeframe, sma_period):
 
     return last_close, sma, direction
 
-mt5.initialize()
+# Reply when a handler needs the broker and the session is down
+BROKER_UNAVAILABLE = "The broker is unavailable right now, please try again in a minute."
+
+# Chats that pressed Generate Signal and have not picked a currency pair yet
+awaiting_pair = set()
 
 # Alfris action when the user selects "Generate Signal"
 @bot.on_callback_query(filters.regex("generatesignal"))
 def generatesignal_callback_handler(client, callback_query):
     chat_id = callback_query.message.chat.id
+    awaiting_pair.add(chat_id)
 
     text = REPLY_MESSAGE
     reply_markup = ReplyKeyboardMarkup(Currency_Pair_Buttons, one_time_keyboard=True, resize_keyboard=True)
     client.send_message(chat_id, text=text, reply_markup=reply_markup)
 
-    # Nested handler for currency pair selection
-    @client.on_message(filters.text & filters.private)
-    def handle_currency_pair(client, message):
-        global SYMBOL
-        
-        # Assign the selected currency pair to SYMBOL
-        SYMBOL = message.text.upper()  # Convert to uppercase to ensure consistency
-        
-        # Notify the user about the selected currency pair
-        client.send_message(chat_id, f"Selected currency pair: {SYMBOL}")
-
-        # Proceed with generating the signal using the selected currency pair
-        VOLUME = 1.0
-        TIMEFRAME = mt5.TIMEFRAME_M1
-        SMA_PERIOD = 10
-        DEVIATION = 20
-
-        # Calculate exposure, signal, and other necessary data using the selected currency pair (SYMBOL)
-        exposure = get_exposure(SYMBOL)
-        last_close, sma, direction = signal(SYMBOL, TIMEFRAME, SMA_PERIOD)
-
-        # Format the message with each piece of information on a new line
-        message_text = f"Time: {datetime.now()}\n" \
-                       f"Current Trades: {exposure}\n" \
-                       f"Last Close: {last_close}\n" \
-                       f"Simple Moving Average: {sma}\n" \
-                       f"Signal: {direction}"
+# Currency pair selection, only for chats waiting on it (each chat keeps its own pair)
+@bot.on_message(filters.text & filters.private & ~filters.regex(r'^/')
+                & filters.create(lambda _, __, message: message.chat.id in awaiting_pair))
+def handle_currency_pair(client, message):
+    chat_id = message.chat.id
+    awaiting_pair.discard(chat_id)
+    symbol = message.text.upper()  # Convert to uppercase to ensure consistency
+
+    # Notify the user about the selected currency pair
+    client.send_message(chat_id, f"Selected currency pair: {symbol}")
+
+    # Proceed with generating the signal using the selected currency pair
+    VOLUME = 1.0
+    TIMEFRAME = mt5.TIMEFRAME_M1
+    SMA_PERIOD = 10
+    DEVIATION = 20
+
+    # Calculate exposure, signal, and other necessary data using the selected currency pair
+    try:
+        exposure = get_exposure(symbol)
+        last_close, sma, direction = signal(symbol, TIMEFRAME, SMA_PERIOD)
+    except BrokerUnavailable:
+        client.send_message(chat_id, BROKER_UNAVAILABLE)
+        return
+
+    # Format the message with each piece of information on a new line
+    message_text = f"Time: {datetime.now()}\n" \
+                   f"Current Trades: {exposure}\n" \
+                   f"Last Close: {last_close}\n" \
+                   f"Simple Moving Average: {sma}\n" \
+                   f"Signal: {direction}"
+
+    # Send the message to the user
+    client.send_message(chat_id, message_text)
+
+
+# ~~~~~~~ TRADING ENGINE ~~~~~~~~
+# One Alfris per account owns the scan loop; every chat that presses AutoTrade
+# subscribes to it and receives the events for the symbols it follows.
+
+class Alfris:
+    def __init__(self):
+        # self.login = 
+        # self.password = ''
+        # self.server = ''
+        # mt5.login(self.login, self.password, self.server)
+        self.SYMBOL = 'CADJPY'
+        self.Atr_Perc_tp = 1.5 
+        self.Atr_Perc_sl = 2.2 
+        self.TIMEFRAME_15M = mt5.TIMEFRAME_M15
+        self.TIMEFRAME_5M = mt5.TIMEFRAME_M5
+        self.TIMEFRAME_1H = mt5.TIMEFRAME_H1
+        self.VOLUME = 0.01
+        self.MAGIC = 2022
+        self.Comment = 'Alfris'
+        self.sec_to_shift = 14400 # depend of the local time, check the timestamp of mt5 and in your machine to match.
+        self.symbol_list = ['AUDUSD', 'CHFJPY', 'EURUSD', 'GBPUSD', 'USDCAD', 'USDCHF',
+                            'USDJPY', 'EURCAD', 'GBPJPY', 'AUDCHF', 'AUDCAD', 'AUDJPY',
+                            'EURGBP', 'EURAUD', 'EURJPY', 'EURCHF', 'EURNZD', 'AUDNZD',
+                            'GBPCHF', 'USDSGD', 'CADCHF', 'CADJPY', 'GBPAUD', 'GBPCAD',
+                            'GBPNZD', 'NZDCAD', 'NZDCHF', 'NZDUSD', 'NZDJPY'] # 29
+        self.MAX_SYMBOL_LOTS = self.VOLUME # exposure limits checked before every entry: one position per symbol
+        self.MAX_TOTAL_LOTS = self.VOLUME * len(self.symbol_list)
+        self.points = {} # symbol point size, used by the journal for slippage in points
+        self.frames = {} # symbol -> M5 bars with M15/M30/H1/H4 resampled locally (no extra broker fetch)
+        self.MTF_CONFIRM = False # switch to True to require the higher timeframe candle to agree with the signal
+        self.MTF_TIMEFRAME = 'H1'
+        self.TICK_MODE = False # switch to True to build bars from ticks and evaluate as soon as a bar closes
+        self.TICK_INTERVAL = 0.25 # seconds between tick polls
+        self.SPREAD_FACTOR = 3.0 # remove stop losses while the spread is this many times its normal level
+        self.ticks = None
+        self.stops_removed = set()
+        self.BATCH_SCAN = False # switch to True to evaluate all symbols in one vectorized pass per cycle
+        self.batch_reverse = {}
+        self.batch_levels = {} # symbol -> ATR levels from the batch pass, used by the entry of the same cycle
+        self.SNAPSHOT_PATH = 'alfris_snapshot.bin'
+        self.SNAPSHOT_EVERY = 300 # seconds between periodic snapshots
+        self.state = {} # symbol -> last evaluated bar, signal and liquidity
+        self.next_snapshot = time.monotonic() + self.SNAPSHOT_EVERY
+        self.stopping = threading.Event() # set by stop(), also wakes the loop from its sleep
+        self.stopping.set()
+        self.thread = None
+        self.start_lock = threading.Lock()
+        ledger.max_symbol_lots = self.MAX_SYMBOL_LOTS
+        ledger.max_total_lots = self.MAX_TOTAL_LOTS
+        self.restore_snapshot()
+        atexit.register(self.close)
+
+
+    ''' H I S T O R I C A L   D A T A '''
+
+    # REFRESH THE BAR BUFFER (on)
+    def refresh_bars(self, number_of_candles=400):
+        # Bars of self.SYMBOL with the forming bar last, also kept in self.frames for the higher
+        # timeframes, the patterns and the snapshot. From the tick stream in tick mode, otherwise
+        # only the bars since the last one held once the buffer is warm.
+        frames = self.frames.get(self.SYMBOL)
+        if self.ticks is not None and self.SYMBOL in self.ticks.symbols:
+            # bars built locally from the tick stream, last row is the forming bar
+            rates = self.ticks.bars(self.SYMBOL)[-number_of_candles:]
+            frames = self.frames.setdefault(self.SYMBOL, TimeframeSet('M5'))
+            if frames.buffer.last_time is not None:
+                # only the rows from the last one held on (that one may have been the forming bar)
+                frames.update(rates[rates['time'] >= frames.buffer.last_time])
+            else:
+                frames.update(rates)
+            return rates
+
+        looknow = int(datetime.utcnow().timestamp())
+        if frames is not None and len(frames.buffer) >= number_of_candles:
+            # only the bars since the last one held (restored from the snapshot or fetched before)
+            gap = mt5.copy_rates_range(self.SYMBOL,self.TIMEFRAME_5M, frames.buffer.last_time, looknow + self.sec_to_shift)
+            if gap is not None and len(gap) > 0:
+                frames.update(gap)
+                return frames.buffer.tail(number_of_candles)
+
+        # Get data from now to back by the numbers of candles
+        lookback = (looknow - (number_of_candles * 5)*60) # in sec
+        rates = mt5.copy_rates_range(self.SYMBOL,self.TIMEFRAME_5M, lookback + self.sec_to_shift, looknow + self.sec_to_shift)
+        if rates is not None and len(rates) > 0:
+            self.frames.setdefault(self.SYMBOL, TimeframeSet('M5')).update(rates)
+        return rates
+
+    # GET DATA (on)
+    def Historical(self):
+        rates = self.refresh_bars()
+        df = pd.DataFrame(rates)
+
+        # Create dataframe
+        df = df.drop(['spread','real_volume'],axis=1) 
+        df = df[['time','open','high','low','close','tick_volume']]
+        df['time']=pd.to_datetime(df['time'], unit='s')
+        df.reset_index()
+        df = df.dropna()
+
+        # pd.set_option('display.max_columns', None)
+        # print(df.tail(30))
+        return df
+
+
+    # HIGHER TIMEFRAME BARS RESAMPLED FROM M5 (on)
+    def Higher_Timeframe(self, SYMBOL, timeframe):
+        # 'M15', 'M30', 'H1' or 'H4', built from the bars Historical() already fetched
+        if SYMBOL not in self.frames:
+            self.SYMBOL = SYMBOL
+            self.Historical()
+        return self.frames[SYMBOL].frame(timeframe)
 
-        # Send the message to the user
-        client.send_message(chat_id, message_text)
 
+    ''' C A N D L E   P A T T E R N '''
 
-# Alfris action when the user selects "AutoTrade"
-@bot.on_callback_query(filters.regex("autotrade"))
-def autotrade_callback_handler(client, callback_query):
+    # PATTERN BITMASK FOR EVERY BAR (on)
+    def Candle_Patterns(self, SYMBOL):
+        # On the bars held since the last Historical() call, fetching only if there are none
+        if SYMBOL not in self.frames:
+            self.SYMBOL = SYMBOL
+            self.Historical()
+        return bar_patterns(self.frames[SYMBOL].buffer.bars)
+
+    # BULLISH ENGULFING (off)
+    def Bull_Eng(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        # the last closed candle engulfs the one before it
+        Bullish_Engulfing = bool(self.Candle_Patterns(SYMBOL)[-2] & BULL_ENGULFING)
+        
+        return Bullish_Engulfing
     
+    # BEARISH ENGULFING (off)
+    def Bear_Eng(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        Bearish_Engulfing = bool(self.Candle_Patterns(SYMBOL)[-2] & BEAR_ENGULFING)
+
+        return Bearish_Engulfing
+
+
+    ''' I N D I C A T O R S '''
+
+    # Avarage True Range (on)
+    def ATR(self):
+        df = self.Historical()
+        # ATR
+        prev_close = df.close.shift(1)
+        true_range_1 = df.high - df.low
+        true_range_2 = abs(df.high - prev_close)
+        true_range_3 = abs(prev_close - df.low)
+        tr = pd.DataFrame({'Tr_1':true_range_1, 'Tr_2':true_range_2, 'Tr_3':true_range_3}).max(axis=1)
+        df['ATR'] = tr.rolling(window=6).mean()
+
+        # Take Profit and Stop Loss for Long position
+        SL_buy = df['close'].iloc[-2] - (df['ATR'].iloc[-2] * self.Atr_Perc_sl)
+        TP_buy = df['close'].iloc[-2] + (df['ATR'].iloc[-2] * self.Atr_Perc_tp)
+
+        # Take Profit and Stop Loss for Short position
+        TP_sell = df['close'].iloc[-2] - (df['ATR'].iloc[-2] * self.Atr_Perc_tp)
+        SL_sell = df['close'].iloc[-2] + (df['ATR'].iloc[-2] * self.Atr_Perc_sl)
+
+        return ([TP_buy, SL_buy, TP_sell, SL_sell])
+
+    # Relatve Strenght Index (on)
+    def RSI(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        df = self.Historical()
+        # CALCULATE RSI
+        alpha = 1.0 / 14
+        gains = df.close.diff()
+        wins = pd.Series([x if x >= 0 else 0.0 for x in gains], name='wins')
+        losses = pd.Series([x * -1 if x < 0 else 0.0 for x in gains], name='losses')
+        wins_rma = wins.ewm(min_periods=14, alpha=alpha).mean()
+        losses_rma = losses.ewm(min_periods=14, alpha=alpha).mean()
+        rs = wins_rma / losses_rma
+        rs = wins_rma / losses_rma
+        df['RSI'] = 100.0 - (100.0 / (1.0 + rs))
+
+        # Return what needed
+        RSI_mean_1 = df['RSI'].iloc[-2:-1].mean()
+        RSI_mean_2 = df['RSI'].iloc[-3:-2].mean()
+        RSI_mean_3 = df['RSI'].iloc[-4:-2].mean()
+
+        return ([RSI_mean_1, RSI_mean_2, RSI_mean_3])
     
-    chat_id = callback_query.message.chat.id
-    text = "AutoTrade started. Press /close to stop."
-    buttons = [
-        [InlineKeyboardButton("Generate Signal", callback_data="generatesignal"),
-         InlineKeyboardButton("Candlestick chart", url='http://192.168.8.116:8080')]
-    ]
-    reply_markup = InlineKeyboardMarkup(buttons)
-    client.send_message(chat_id, text=text, reply_markup=reply_markup)
-
-    class Alfris:
-        def __init__(self):
-            mt5.initialize()
-            # self.login = 
-            # self.password = ''
-            # self.server = ''
-            # mt5.login(self.login, self.password, self.server)
-            self.SYMBOL = 'CADJPY'
-            self.Atr_Perc_tp = 1.5 
-            self.Atr_Perc_sl = 2.2 
-            self.TIMEFRAME_15M = mt5.TIMEFRAME_M15
-            self.TIMEFRAME_5M = mt5.TIMEFRAME_M5
-            self.TIMEFRAME_1H = mt5.TIMEFRAME_H1
-            self.VOLUME = 0.01
-            self.MAGIC = 2022
-            self.Comment = 'Alfris'
-            self.sec_to_shift = 14400 # depend of the local time, check the timestamp of mt5 and in your machine to match.
-            self.symbol_list = ['AUDUSD', 'CHFJPY', 'EURUSD', 'GBPUSD', 'USDCAD', 'USDCHF',
-                                'USDJPY', 'EURCAD', 'GBPJPY', 'AUDCHF', 'AUDCAD', 'AUDJPY',
-                                'EURGBP', 'EURAUD', 'EURJPY', 'EURCHF', 'EURNZD', 'AUDNZD',
-                                'GBPCHF', 'USDSGD', 'CADCHF', 'CADJPY', 'GBPAUD', 'GBPCAD',
-                                'GBPNZD', 'NZDCAD', 'NZDCHF', 'NZDUSD', 'NZDJPY'] # 29
-
-
-        ''' H I S T O R I C A L   D A T A '''
-
-        # GET DATA (on)
-        def Historical(self):
-            # Get data from now to back by the numbers of candles
-            number_of_candles = 400
-            looknow = int(datetime.utcnow().timestamp())
-            lookback = (looknow - (number_of_candles * 5)*60) # in sec
-            df = pd.DataFrame(mt5.copy_rates_range(self.SYMBOL,self.TIMEFRAME_5M, lookback + self.sec_to_shift, looknow + self.sec_to_shift))
-
-            # Create dataframe
-            df = df.drop(['spread','real_volume'],axis=1) 
-            df = df[['time','open','high','low','close','tick_volume']]
-            df['time']=pd.to_datetime(df['time'], unit='s')
-            df.reset_index()
-            df = df.dropna()
-
-            # pd.set_option('display.max_columns', None)
-            # print(df.tail(30))
-            return df
-
-
-        ''' C A N D L E   P A T T E R N '''
-
-        # BULLISH ENGULFING (off)
-        def Bull_Eng(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            df = self.Historical()
-            Bullish_Engulfing = df['close'].iloc[-2] > df['open'].iloc[-3] and df['open'].iloc[-2] <= df['close'].iloc[-3] and (0.8 * 0.9) > 0.8 and \
-                                df['close'].iloc[-3] < df['open'].iloc[-3] and df['close'].iloc[-2] > df['open'].iloc[-2] and df['high'].iloc[-2] > df['high'].iloc[-3]
-            
-            return Bullish_Engulfing
+    # SUPPLY & DEMAND using VOLUME (off)
+    def Supply_Demand_by_volume(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        df = self.Historical()
+        # Create a new column 'range' by subtracting the 'low' column from the 'high' column.
+        df["range"] = df["high"] - df["low"]
+        # Create a new column 'vwap' by taking the cumulative sum of the product of the 'close' and 'tick_volume' columns divided by the cumulative sum of the 'tick_volume' column.
+        df["vwap"] = (df["close"] * df["tick_volume"]).cumsum() / df["tick_volume"].cumsum()
         
-        # BEARISH ENGULFING (off)
-        def Bear_Eng(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            df = self.Historical()
-            Bearish_Engulfing = df['close'].iloc[-2] < df['open'].iloc[-3] and df['open'].iloc[-2] >= df['close'].iloc[-3] and (0.8 * 0.9) < 0.8 and \
-                                df['close'].iloc[-3] > df['open'].iloc[-3] and df['close'].iloc[-2] < df['open'].iloc[-2] and df['low'].iloc[-2] < df['low'].iloc[-3]       
+        # Roll them in other to understand the footprints left by the traders and so the supply and demand zones.
+        df['RollRange'] = df["range"].rolling(window=50).mean()
+        df["RollVwap"] = df["vwap"].rolling(window=50).mean()
+
+        # is supply if last closed candle:
+        Supply = df['range'].iloc[-2] < df['RollRange'].iloc[-2] and df['vwap'].iloc[-2] > df['RollVwap'].iloc[-2]
+        # is demand if last closed candle:
+        Demand = df['range'].iloc[-2] < df['RollRange'].iloc[-2] and df['vwap'].iloc[-2] < df['RollVwap'].iloc[-2]
+
+        # check supply and demand zones not by only the last candle but by zones
+        supply_len_50 = df[(df["range"] < df["range"].rolling(window=50).mean()) & (df["vwap"] > df["vwap"].rolling(window=50).mean())]
+        demand_len_50 = df[(df["range"] < df["range"].rolling(window=50).mean()) & (df["vwap"] < df["vwap"].rolling(window=50).mean())]
+
+        # return the length of the zones, of one is grater than teh other, is that zone.
+        # ex: 
+        # 'Buy' if len(supply_len_50) > len(demand_len_50) else 'Sell' if len(demand_len_50) > len(supply_len_50)
+        return len(supply_len_50), len(demand_len_50)
+
+    # SUPPLY & DEMAND using HIGHS and LOWS (on)
+    def Supply_Demand_by_candles(self, SYMBOL, Window):
+        self.SYMBOL = SYMBOL
+        df = self.Historical()
+        # Get the Higher High and the Lower Low 
+        df["high_rolling_max"] = df["high"].rolling(window=Window).max()
+        df["low_rolling_min"] = df["low"].rolling(window=Window).min()
+        # Create a column to store the supply and demand zones
+        df["supply_demand"] = None
+        
+        # Loop and define wheather is a Supply or Demand zone
+        for i, row in df.iterrows():
+            if row["high"] >= row["high_rolling_max"]:
+                df.loc[i, "supply_demand"] = "Supply"
+            elif row["low"] <= row["low_rolling_min"]:
+                df.loc[i, "supply_demand"] = "Demand"
+        
+        return df
+
+    # LIQUIDITY POOL (on)
+    def Liquidity_pool(self):
+        df = self.Historical()
+
+        df['Liquidity'] = (df['close'] * df['tick_volume']) / df['tick_volume'].rolling(window=30).sum()
+        # Get teh liquidity of teh last closed candle
+        Liquidity_last = df['Liquidity'].iloc[-2]
+        # Get the max liquidity of the last 26 cnandles
+        Liquidity_max_26_period = df['Liquidity'].iloc[-26:].max()
+        # Get the max liquidity of the last 50 cnandles
+        Liquidity_max_50_period = df['Liquidity'].iloc[-50:].max()
+        # Get the max liquidity of the last 80 cnandles
+        Liquidity_max_80_period = df['Liquidity'].iloc[-80:].max()
+        # Get the full row of the df where the liquidity is max
+        max_liquidity_row = df.loc[df['Liquidity'].iloc[-20:].idxmax()]
+        # Get the close and then the open of the above line
+        Liquidity_Row = max_liquidity_row['close']
+        Liquidity_Row_open = max_liquidity_row['open']
+
+        # Check if where the candle with large liquidity is a bull or bear
+        Liquidity_direction_bull = Liquidity_Row > Liquidity_Row_open
+        Liquidity_direction_bear = Liquidity_Row < Liquidity_Row_open
+
+        # Return just what needed for this strategy
+        return Liquidity_Row
+
+
+    ''' P O S I T I O N   M A N A G E R '''
+
+    # SEND ORDER AND JOURNAL REQUEST, RESPONSE AND LATENCY (on)
+    def send_order(self, kind, request):
+        symbol = request.get('symbol')
+        if symbol not in self.points:
+            info = mt5.symbol_info(symbol)
+            self.points[symbol] = info.point if info else None
+
+        # quote the deal can fill at (ask for buys, bid for sells), the slippage is measured from it
+        quote = None
+        if request.get('action') == mt5.TRADE_ACTION_DEAL:
+            tick = mt5.symbol_info_tick(symbol)
+            if tick is not None:
+                quote = tick.ask if request.get('type') == mt5.ORDER_TYPE_BUY else tick.bid
+
+        sent_at = time.time()
+        start = time.perf_counter()
+        response = mt5.order_send(request)
+        latency_ms = (time.perf_counter() - start) * 1000
+
+        error = None if response is not None else str(mt5.last_error())
+        journal.log_order(kind, request, response, sent_at, latency_ms, point=self.points[symbol], error=error, quote=quote)
+        ledger.apply_result(request, response)
+        return response
+
+    # SUBMIT AN ENTRY ONCE PER SIGNAL (on)
+    def submit_open(self, request, s_l):
+        # Keyed by symbol, side and the signal candle; skipped while the symbol is locked by another
+        # submit or a filled order is not yet visible in positions_get
+        bar_time = self.state.get(self.SYMBOL, {}).get('bar_time')
+
+        def send(comment):
+            request['comment'] = comment
+            return self.send_order('open', request)
+
+        response, reason = order_guard.submit(self.SYMBOL, s_l, bar_time, send, mt5.positions_get, mt5.orders_get)
+        if reason is not None:
+            journal.log_error('submit_open', self.SYMBOL, reason)
+            print(f'{self.SYMBOL} not opened: {reason}')
+        return response
+
+    # OPEN MARKET POSITION (on)
+    def open_market_position(self, s_l, Volume):
+        # sell 1 == ask
+        # buy 0 == bid
+
+        if self.BATCH_SCAN and self.SYMBOL in self.batch_levels:
+            # computed on the window that gave the signal, no need to fetch it again
+            TP_Buy, SL_Buy, TP_Sell, SL_Sell = self.batch_levels[self.SYMBOL]
+        else:
+            TP_Buy, SL_Buy, TP_Sell, SL_Sell = self.ATR()
+
+        # Pre-trade exposure limits
+        tick = mt5.symbol_info_tick(self.SYMBOL)
+        reason = ledger.check(self.SYMBOL, s_l, Volume, tick.ask if s_l == 1 else tick.bid)
+        if reason is not None:
+            journal.log_error('exposure_limit', self.SYMBOL, reason)
+            print(f'{self.SYMBOL} not opened: {reason}')
+            return None
+
+        if (s_l == 1):
+            request = {
+                "action": mt5.TRADE_ACTION_DEAL,
+                "symbol": self.SYMBOL,
+                "volume": Volume, # FLOAT
+                "type": mt5.ORDER_TYPE_BUY,
+                "price": tick.bid,
+                "sl": SL_Buy, # FLOAT
+                "tp": TP_Buy, # FLOAT
+                "deviation": 20, # INTERGER
+                "magic": self.MAGIC,
+                "comment": self.Comment,
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_IOC,}
 
-            return Bearish_Engulfing
+            response = self.submit_open(request, s_l)
+            return response
 
+        if (s_l == -1):
+            request = {
+                "action": mt5.TRADE_ACTION_DEAL,
+                "symbol": self.SYMBOL,
+                "volume": Volume, # FLOAT
+                "type": mt5.ORDER_TYPE_SELL,
+                "price": tick.ask,
+                "sl": SL_Sell, # FLOAT
+                "tp": TP_Sell, # FLOAT
+                "deviation": 20, # INTERGER
+                "magic": self.MAGIC,
+                "comment": self.Comment,
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_IOC,}
 
-        ''' I N D I C A T O R S '''
+            response = self.submit_open(request, s_l)
+            return response
 
-        # Avarage True Range (on)
-        def ATR(self):
-            df = self.Historical()
-            # ATR
-            prev_close = df.close.shift(1)
-            true_range_1 = df.high - df.low
-            true_range_2 = abs(df.high - prev_close)
-            true_range_3 = abs(prev_close - df.low)
-            tr = pd.DataFrame({'Tr_1':true_range_1, 'Tr_2':true_range_2, 'Tr_3':true_range_3}).max(axis=1)
-            df['ATR'] = tr.rolling(window=6).mean()
+    # OPEN LIMIT POSITION (off)
+    def open_limit_position(self, s_l):
+        # sell 1 == ask
+        # buy 0 == bid
 
-            # Take Profit and Stop Loss for Long position
-            SL_buy = df['close'].iloc[-2] - (df['ATR'].iloc[-2] * self.Atr_Perc_sl)
-            TP_buy = df['close'].iloc[-2] + (df['ATR'].iloc[-2] * self.Atr_Perc_tp)
+        TP_Buy = self.MINUTE()[8] #.astype(float)
+        SL_Buy = self.MINUTE()[9] #.astype(float)
+        TP_Sell = self.MINUTE()[10] #.astype(float)
+        SL_Sell = self.MINUTE()[11] #.astype(float)
 
-            # Take Profit and Stop Loss for Short position
-            TP_sell = df['close'].iloc[-2] - (df['ATR'].iloc[-2] * self.Atr_Perc_tp)
-            SL_sell = df['close'].iloc[-2] + (df['ATR'].iloc[-2] * self.Atr_Perc_sl)
+        if (s_l == 1):
+            request = {
+                "action": mt5.TRADE_ACTION_PENDING,
+                "symbol": self.SYMBOL,
+                "volume": self.VOLUME, # FLOAT
+                "type": mt5.ORDER_TYPE_BUY_LIMIT,
+                "price": mt5.symbol_info_tick(self.SYMBOL).ask - 10 * point,
+                "sl": SL_Buy, # FLOAT
+                "tp": TP_Buy, # FLOAT
+                "deviation": 20, # INTERGER
+                "magic": self.MAGIC, # INTERGER
+                "comment": self.Comment,
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_RETURN}
 
-            return ([TP_buy, SL_buy, TP_sell, SL_sell])
+            response = self.send_order('pending', request)
+            return response
 
-        # Relatve Strenght Index (on)
-        def RSI(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            df = self.Historical()
-            # CALCULATE RSI
-            alpha = 1.0 / 14
-            gains = df.close.diff()
-            wins = pd.Series([x if x >= 0 else 0.0 for x in gains], name='wins')
-            losses = pd.Series([x * -1 if x < 0 else 0.0 for x in gains], name='losses')
-            wins_rma = wins.ewm(min_periods=14, alpha=alpha).mean()
-            losses_rma = losses.ewm(min_periods=14, alpha=alpha).mean()
-            rs = wins_rma / losses_rma
-            rs = wins_rma / losses_rma
-            df['RSI'] = 100.0 - (100.0 / (1.0 + rs))
-
-            # Return what needed
-            RSI_mean_1 = df['RSI'].iloc[-2:-1].mean()
-            RSI_mean_2 = df['RSI'].iloc[-3:-2].mean()
-            RSI_mean_3 = df['RSI'].iloc[-4:-2].mean()
-
-            return ([RSI_mean_1, RSI_mean_2, RSI_mean_3])
-        
-        # SUPPLY & DEMAND using VOLUME (off)
-        def Supply_Demand_by_volume(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            df = self.Historical()
-            # Create a new column 'range' by subtracting the 'low' column from the 'high' column.
-            df["range"] = df["high"] - df["low"]
-            # Create a new column 'vwap' by taking the cumulative sum of the product of the 'close' and 'tick_volume' columns divided by the cumulative sum of the 'tick_volume' column.
-            df["vwap"] = (df["close"] * df["tick_volume"]).cumsum() / df["tick_volume"].cumsum()
-            
-            # Roll them in other to understand the footprints left by the traders and so the supply and demand zones.
-            df['RollRange'] = df["range"].rolling(window=50).mean()
-            df["RollVwap"] = df["vwap"].rolling(window=50).mean()
-
-            # is supply if last closed candle:
-            Supply = df['range'].iloc[-2] < df['RollRange'].iloc[-2] and df['vwap'].iloc[-2] > df['RollVwap'].iloc[-2]
-            # is demand if last closed candle:
-            Demand = df['range'].iloc[-2] < df['RollRange'].iloc[-2] and df['vwap'].iloc[-2] < df['RollVwap'].iloc[-2]
-
-            # check supply and demand zones not by only the last candle but by zones
-            supply_len_50 = df[(df["range"] < df["range"].rolling(window=50).mean()) & (df["vwap"] > df["vwap"].rolling(window=50).mean())]
-            demand_len_50 = df[(df["range"] < df["range"].rolling(window=50).mean()) & (df["vwap"] < df["vwap"].rolling(window=50).mean())]
-
-            # return the length of the zones, of one is grater than teh other, is that zone.
-            # ex: 
-            # 'Buy' if len(supply_len_50) > len(demand_len_50) else 'Sell' if len(demand_len_50) > len(supply_len_50)
-            return len(supply_len_50), len(demand_len_50)
-
-        # SUPPLY & DEMAND using HIGHS and LOWS (on)
-        def Supply_Demand_by_candles(self, SYMBOL, Window):
-            self.SYMBOL = SYMBOL
-            df = self.Historical()
-            # Get the Higher High and the Lower Low 
-            df["high_rolling_max"] = df["high"].rolling(window=Window).max()
-            df["low_rolling_min"] = df["low"].rolling(window=Window).min()
-            # Create a column to store the supply and demand zones
-            df["supply_demand"] = None
-            
-            # Loop and define wheather is a Supply or Demand zone
-            for i, row in df.iterrows():
-                if row["high"] >= row["high_rolling_max"]:
-                    df.loc[i, "supply_demand"] = "Supply"
-                elif row["low"] <= row["low_rolling_min"]:
-                    df.loc[i, "supply_demand"] = "Demand"
-            
-            return df
-
-        # LIQUIDITY POOL (on)
-        def Liquidity_pool(self):
-            df = self.Historical()
-
-            df['Liquidity'] = (df['close'] * df['tick_volume']) / df['tick_volume'].rolling(window=30).sum()
-            # Get teh liquidity of teh last closed candle
-            Liquidity_last = df['Liquidity'].iloc[-2]
-            # Get the max liquidity of the last 26 cnandles
-            Liquidity_max_26_period = df['Liquidity'].iloc[-26:].max()
-            # Get the max liquidity of the last 50 cnandles
-            Liquidity_max_50_period = df['Liquidity'].iloc[-50:].max()
-            # Get the max liquidity of the last 80 cnandles
-            Liquidity_max_80_period = df['Liquidity'].iloc[-80:].max()
-            # Get the full row of the df where the liquidity is max
-            max_liquidity_row = df.loc[df['Liquidity'].iloc[-20:].idxmax()]
-            # Get the close and then the open of the above line
-            Liquidity_Row = max_liquidity_row['close']
-            Liquidity_Row_open = max_liquidity_row['open']
-
-            # Check if where the candle with large liquidity is a bull or bear
-            Liquidity_direction_bull = Liquidity_Row > Liquidity_Row_open
-            Liquidity_direction_bear = Liquidity_Row < Liquidity_Row_open
-
-            # Return just what needed for this strategy
-            return Liquidity_Row
-
-
-        ''' P O S I T I O N   M A N A G E R '''
-
-        # OPEN MARKET POSITION (on)
-        def open_market_position(self, s_l, Volume):
-            # sell 1 == ask
-            # buy 0 == bid
-
-            TP_Buy = self.ATR()[0] #.astype(float)
-            SL_Buy = self.ATR()[1] #.astype(float)
-            TP_Sell = self.ATR()[2] #.astype(float)
-            SL_Sell = self.ATR()[3] #.astype(float)
-
-            if (s_l == 1):
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": self.SYMBOL,
-                    "volume": Volume, # FLOAT
-                    "type": mt5.ORDER_TYPE_BUY,
-                    "price": mt5.symbol_info_tick(self.SYMBOL).bid,
-                    "sl": SL_Buy, # FLOAT
-                    "tp": TP_Buy, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC,
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,}
-
-                response = mt5.order_send(request)
-                return response
-
-            if (s_l == -1):
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": self.SYMBOL,
-                    "volume": Volume, # FLOAT
-                    "type": mt5.ORDER_TYPE_SELL,
-                    "price": mt5.symbol_info_tick(self.SYMBOL).ask,
-                    "sl": SL_Sell, # FLOAT
-                    "tp": TP_Sell, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC,
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,}
-
-                response = mt5.order_send(request)
-                return response
-
-        # OPEN LIMIT POSITION (off)
-        def open_limit_position(self, s_l):
-            # sell 1 == ask
-            # buy 0 == bid
-
-            TP_Buy = self.MINUTE()[8] #.astype(float)
-            SL_Buy = self.MINUTE()[9] #.astype(float)
-            TP_Sell = self.MINUTE()[10] #.astype(float)
-            SL_Sell = self.MINUTE()[11] #.astype(float)
-
-            if (s_l == 1):
-                request = {
-                    "action": mt5.TRADE_ACTION_PENDING,
-                    "symbol": self.SYMBOL,
-                    "volume": self.VOLUME, # FLOAT
-                    "type": mt5.ORDER_TYPE_BUY_LIMIT,
-                    "price": mt5.symbol_info_tick(self.SYMBOL).ask - 10 * point,
-                    "sl": SL_Buy, # FLOAT
-                    "tp": TP_Buy, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC, # INTERGER
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_RETURN}
-
-                response = mt5.order_send(request)
-                return response
-
-            if (s_l == -1):
-                request = {
-                    "action": mt5.TRADE_ACTION_PENDING,
-                    "symbol": self.SYMBOL,
-                    "volume": self.VOLUME, # FLOAT
-                    "type": mt5.ORDER_TYPE_SELL_LIMIT,
-                    "price": mt5.symbol_info_tick(self.SYMBOL).bid + 10 * point,
-                    "sl": SL_Sell, # FLOAT
-                    "tp": TP_Sell, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC, # INTERGER
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_RETURN}
-
-                response = mt5.order_send(request)
-                return response
-
-        # CLOSE MARKET POSITION (on)
-        def close_position(self, s_l):
-            # mt5.positions_get()[0][0]
-            
-            if (s_l == 1):
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": self.SYMBOL,
-                    "volume": self.VOLUME, # FLOAT
-                    "type": mt5.ORDER_TYPE_BUY,
-                    "position": mt5.positions_get(symbol=self.SYMBOL)[0][0],
-                    "price": mt5.symbol_info_tick(self.SYMBOL).bid,
-                    "sl": 0.0, # FLOAT
-                    "tp": 0.0, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC,
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,}
-
-                response = mt5.order_send(request)
-                return response
-
-            if (s_l == -1):
-                request = {
-                    "action": mt5.TRADE_ACTION_DEAL,
-                    "symbol": self.SYMBOL,
-                    "volume": self.VOLUME, # FLOAT
-                    "type": mt5.ORDER_TYPE_SELL,
-                    "position": mt5.positions_get(symbol=self.SYMBOL)[0][0],
-                    "price": mt5.symbol_info_tick(self.SYMBOL).ask,
-                    "sl": 0.0, # FLOAT
-                    "tp": 0.0, # FLOAT
-                    "deviation": 20, # INTERGER
-                    "magic": self.MAGIC,
-                    "comment": self.Comment,
-                    "type_time": mt5.ORDER_TIME_GTC,
-                    "type_filling": mt5.ORDER_FILLING_IOC,}
-
-                response = mt5.order_send(request)
-                # print(response)
-                return response
-
-        # CLOSE ALL POSITIONS (on)
-        def close_all_positions(self, SYMBOL, pos):
-            self.SYMBOL = SYMBOL
+        if (s_l == -1):
             request = {
-                "action": mt5.TRADE_ACTION_DEAL,
-                "position": pos.ticket,
+                "action": mt5.TRADE_ACTION_PENDING,
                 "symbol": self.SYMBOL,
-                "volume": pos.volume, # FLOAT
-                "type": mt5.ORDER_TYPE_BUY if pos.type == 1 else mt5.ORDER_TYPE_SELL,
-                "price": mt5.symbol_info_tick(self.SYMBOL).ask if pos.type == 1 else mt5.symbol_info_tick(self.SYMBOL).bid,
+                "volume": self.VOLUME, # FLOAT
+                "type": mt5.ORDER_TYPE_SELL_LIMIT,
+                "price": mt5.symbol_info_tick(self.SYMBOL).bid + 10 * point,
+                "sl": SL_Sell, # FLOAT
+                "tp": TP_Sell, # FLOAT
                 "deviation": 20, # INTERGER
                 "magic": self.MAGIC, # INTERGER
                 "comment": self.Comment,
                 "type_time": mt5.ORDER_TIME_GTC,
-                "type_filling": mt5.ORDER_FILLING_IOC,}
-            
-            # To close all positions for all symbols, run the following outside this function:
-            # for SYMBOL in self.symbol_list:
-            #     Opened = mt5.positions_get(symbol = SYMBOL)
-            #     for pos in Opened:
-            #         self.close_all_positions(SYMBOL, pos)
+                "type_filling": mt5.ORDER_FILLING_RETURN}
 
-            response = mt5.order_send(request)
+            response = self.send_order('pending', request)
             return response
 
-        # CLOSE ALL LIMIT POSITON PENDING (off)
-        def close_all_pendings(self, pos):
+    # CLOSE MARKET POSITION (on)
+    def close_position(self, s_l):
+        # mt5.positions_get()[0][0]
+        
+        if (s_l == 1):
             request = {
-                "action": mt5.TRADE_ACTION_REMOVE,
-                "order": pos.ticket if pos != () else None,
+                "action": mt5.TRADE_ACTION_DEAL,
                 "symbol": self.SYMBOL,
+                "volume": self.VOLUME, # FLOAT
+                "type": mt5.ORDER_TYPE_BUY,
+                "position": mt5.positions_get(symbol=self.SYMBOL)[0][0],
+                "price": mt5.symbol_info_tick(self.SYMBOL).bid,
+                "sl": 0.0, # FLOAT
+                "tp": 0.0, # FLOAT
+                "deviation": 20, # INTERGER
+                "magic": self.MAGIC,
+                "comment": self.Comment,
+                "type_time": mt5.ORDER_TIME_GTC,
                 "type_filling": mt5.ORDER_FILLING_IOC,}
-            
-            # To close all pending positions for all symbols, run the following outside this function:
-            # for SYMBOL in self.symbol_list:
-            #     Pending = Pending = mt5.orders_get(symbol= SYMBOL)
-            #     for pos in Pending:
-            #         self.close_all_positions(SYMBOL, pos)
 
-            response = mt5.order_send(request)
+            response = self.send_order('close', request)
             return response
-        
-        # GET POSITION CURRENTLY OPEN (on)
-        def get_opened_positions(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-
-            if len(mt5.positions_get(symbol = self.SYMBOL)) == 0:
-                return ''
 
-            # 0 == buy, 1 == sell
-            elif len(mt5.positions_get(symbol = self.SYMBOL)) > 0:
-                positions = pd.DataFrame(mt5.positions_get(symbol = self.SYMBOL)[0])
-                side = positions[0][5] # type, buy or sell, 0 or 1
-                entryprice = positions[0][10]
-                profit = positions[0][15]
-                ticket_ID = positions[0][0] # ID positon
-                    
-                if side == 0:
-                    pos = 1
-                    return [pos,profit,entryprice, ticket_ID]
+        if (s_l == -1):
+            request = {
+                "action": mt5.TRADE_ACTION_DEAL,
+                "symbol": self.SYMBOL,
+                "volume": self.VOLUME, # FLOAT
+                "type": mt5.ORDER_TYPE_SELL,
+                "position": mt5.positions_get(symbol=self.SYMBOL)[0][0],
+                "price": mt5.symbol_info_tick(self.SYMBOL).ask,
+                "sl": 0.0, # FLOAT
+                "tp": 0.0, # FLOAT
+                "deviation": 20, # INTERGER
+                "magic": self.MAGIC,
+                "comment": self.Comment,
+                "type_time": mt5.ORDER_TIME_GTC,
+                "type_filling": mt5.ORDER_FILLING_IOC,}
 
-                elif side == 1:
-                    pos = -1
+            response = self.send_order('close', request)
+            # print(response)
+            return response
 
-                    return ([pos, side, profit, entryprice, ticket_ID])
+    # CLOSE ALL POSITIONS (on)
+    def close_all_positions(self, SYMBOL, pos):
+        self.SYMBOL = SYMBOL
+        request = {
+            "action": mt5.TRADE_ACTION_DEAL,
+            "position": pos.ticket,
+            "symbol": self.SYMBOL,
+            "volume": pos.volume, # FLOAT
+            "type": mt5.ORDER_TYPE_BUY if pos.type == 1 else mt5.ORDER_TYPE_SELL,
+            "price": mt5.symbol_info_tick(self.SYMBOL).ask if pos.type == 1 else mt5.symbol_info_tick(self.SYMBOL).bid,
+            "deviation": 20, # INTERGER
+            "magic": self.MAGIC, # INTERGER
+            "comment": self.Comment,
+            "type_time": mt5.ORDER_TIME_GTC,
+            "type_filling": mt5.ORDER_FILLING_IOC,}
+        
+        # To close all positions for all symbols, run the following outside this function:
+        # for SYMBOL in self.symbol_list:
+        #     Opened = mt5.positions_get(symbol = SYMBOL)
+        #     for pos in Opened:
+        #         self.close_all_positions(SYMBOL, pos)
+
+        response = self.send_order('close_all', request)
+        return response
+
+    # CLOSE ALL LIMIT POSITON PENDING (off)
+    def close_all_pendings(self, pos):
+        request = {
+            "action": mt5.TRADE_ACTION_REMOVE,
+            "order": pos.ticket if pos != () else None,
+            "symbol": self.SYMBOL,
+            "type_filling": mt5.ORDER_FILLING_IOC,}
+        
+        # To close all pending positions for all symbols, run the following outside this function:
+        # for SYMBOL in self.symbol_list:
+        #     Pending = Pending = mt5.orders_get(symbol= SYMBOL)
+        #     for pos in Pending:
+        #         self.close_all_positions(SYMBOL, pos)
+
+        response = self.send_order('remove_pending', request)
+        return response
+    
+    # GET POSITION CURRENTLY OPEN (on)
+    def get_opened_positions(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+
+        if len(mt5.positions_get(symbol = self.SYMBOL)) == 0:
+            return ''
+
+        # 0 == buy, 1 == sell
+        elif len(mt5.positions_get(symbol = self.SYMBOL)) > 0:
+            positions = pd.DataFrame(mt5.positions_get(symbol = self.SYMBOL)[0])
+            side = positions[0][5] # type, buy or sell, 0 or 1
+            entryprice = positions[0][10]
+            profit = positions[0][15]
+            ticket_ID = positions[0][0] # ID positon
                 
-                else:
-                    return 'NONE'
-            else:
-                return 'NONE'
-
-        # GET BID AND ASK LAST CANDLE (off)
-        def get_SYMBOL_price_last(self):
-            prices = mt5.symbol_info_tick(self.SYMBOL)._asdict()
-            df = pd.DataFrame([prices], index=[0])
-            bid = df.at[0,'bid']
-            ask = df.at[0,'ask']
-            return [bid, ask]
+            if side == 0:
+                pos = 1
+                return [pos,profit,entryprice, ticket_ID]
 
+            elif side == 1:
+                pos = -1
 
-        ''' C H E C K   S I G N A L S '''
-
-        # CHECK SIGNAL TO OPEN POSITION (on)
-        def check_signal(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            SIGNAL = 0
+                return ([pos, side, profit, entryprice, ticket_ID])
             
-            df = self.Historical()
-
-            Supply_Demand_20 = self.Supply_Demand_by_candles(SYMBOL, 20)
-            Supply_Demand_50 = self.Supply_Demand_by_candles(SYMBOL, 50)
-            Liquidity = self.Liquidity_pool()
+            else:
+                return 'NONE'
+        else:
+            return 'NONE'
 
-            Close = df['close'] # any
-            Open = df['open'] # any
+    # GET BID AND ASK LAST CANDLE (off)
+    def get_SYMBOL_price_last(self):
+        prices = mt5.symbol_info_tick(self.SYMBOL)._asdict()
+        df = pd.DataFrame([prices], index=[0])
+        bid = df.at[0,'bid']
+        ask = df.at[0,'ask']
+        return [bid, ask]
 
-            # Define th edirection of the last closed candle
-            BULL_2 = Close.iloc[-2] > Open.iloc[-2]
-            BEAR_2 = Close.iloc[-2] < Open.iloc[-2]
 
-            # It opnes the position a little bit far from where the signal has bee cathed
-            point = mt5.symbol_info(self.SYMBOL).point 
-            margin_buy = Close.iloc[-2] - 10 * point
-            margin_sell =  Close.iloc[-2] + 10 * point
+    ''' C H E C K   S I G N A L S '''
 
-            # L O N G 
-            if Supply_Demand_50['supply_demand'].iloc[-3] == 'Demand' and Supply_Demand_20['supply_demand'].iloc[-3] == 'Demand':
-                if BULL_2 == True and Supply_Demand_20['supply_demand'].iloc[-2] != 'Demand' and Liquidity == Close.iloc[-3]:
-                    SIGNAL = 1
+    # CHECK SIGNAL TO OPEN POSITION (on)
+    def check_signal(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        SIGNAL = 0
+        start = time.perf_counter()
+        
+        df = self.Historical()
 
-            # S H O R T
-            elif Supply_Demand_50['supply_demand'].iloc[-3] == 'Supply' and Supply_Demand_20['supply_demand'].iloc[-3] == 'Supply':
-                if BEAR_2 == True and Supply_Demand_20['supply_demand'].iloc[-2] != 'Supply' and Liquidity == Close.iloc[-3]:
-                    SIGNAL = -1
+        Supply_Demand_20 = self.Supply_Demand_by_candles(SYMBOL, 20)
+        Supply_Demand_50 = self.Supply_Demand_by_candles(SYMBOL, 50)
+        Liquidity = self.Liquidity_pool()
 
-            return SIGNAL
+        Close = df['close'] # any
+        Open = df['open'] # any
 
-        # CHECK A PARTIAL SIGNAL AND CLOSE THE POSITION IF True (on)
-        def check_reverse_signal(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            SIGNAL = 0
+        # Define th edirection of the last closed candle
+        BULL_2 = Close.iloc[-2] > Open.iloc[-2]
+        BEAR_2 = Close.iloc[-2] < Open.iloc[-2]
 
-            Supply_Demand_50 = self.Supply_Demand_by_candles(SYMBOL, 50)
-            Supply_Demand_20 = self.Supply_Demand_by_candles(SYMBOL, 20)
+        # It opnes the position a little bit far from where the signal has bee cathed
+        point = mt5.symbol_info(self.SYMBOL).point 
+        margin_buy = Close.iloc[-2] - 10 * point
+        margin_sell =  Close.iloc[-2] + 10 * point
 
-            # L O N G 
-            if Supply_Demand_50['supply_demand'].iloc[-2] == 'Demand' and Supply_Demand_20['supply_demand'].iloc[-2] == 'Demand':
-                # print(f'BUY reverse {SYMBOL}')
+        # L O N G 
+        if Supply_Demand_50['supply_demand'].iloc[-3] == 'Demand' and Supply_Demand_20['supply_demand'].iloc[-3] == 'Demand':
+            if BULL_2 == True and Supply_Demand_20['supply_demand'].iloc[-2] != 'Demand' and Liquidity == Close.iloc[-3]:
                 SIGNAL = 1
 
-            # S H O R T
-            elif Supply_Demand_50['supply_demand'].iloc[-2] == 'Supply' and Supply_Demand_20['supply_demand'].iloc[-2] == 'Supply':
-                # print(f'SELL reverse {SYMBOL}')
+        # S H O R T
+        elif Supply_Demand_50['supply_demand'].iloc[-3] == 'Supply' and Supply_Demand_20['supply_demand'].iloc[-3] == 'Supply':
+            if BEAR_2 == True and Supply_Demand_20['supply_demand'].iloc[-2] != 'Supply' and Liquidity == Close.iloc[-3]:
                 SIGNAL = -1
 
-            return SIGNAL
+        # M U L T I   T I M E F R A M E   C O N F I R M A T I O N
+        if self.MTF_CONFIRM and SIGNAL != 0 and not htf_confirms(SIGNAL, self.Higher_Timeframe(SYMBOL, self.MTF_TIMEFRAME)):
+            SIGNAL = 0
 
+        self.state[SYMBOL] = {'bar_time': str(df['time'].iloc[-2]), 'signal': SIGNAL, 'liquidity': float(Liquidity)}
+
+        journal.log_signal(SYMBOL, SIGNAL, bar_time=df['time'].iloc[-2], close=Close.iloc[-2],
+                           eval_ms=(time.perf_counter() - start) * 1000, liquidity=Liquidity,
+                           sd_20=Supply_Demand_20['supply_demand'].iloc[-3], sd_50=Supply_Demand_50['supply_demand'].iloc[-3])
+        return SIGNAL
+
+    # CHECK SIGNAL AND REVERSE SIGNAL OF ALL SYMBOLS IN ONE PASS (on)
+    def batch_check_signals(self, symbols):
+        # Same rules as check_signal / check_reverse_signal, multi timeframe confirmation
+        # included, on a symbols x bars x fields array of the windows check_signal would see
+        windows = {}
+        for S in symbols:
+            self.SYMBOL = S
+            rates = self.refresh_bars() # numpy only: the missing bars once warm, no DataFrame per symbol
+            if rates is not None and len(rates) > 0:
+                windows[S] = rates
+        batch = batch_evaluate(stack_windows(windows, symbols, 400), tp=self.Atr_Perc_tp, sl=self.Atr_Perc_sl)
+
+        signals = {}
+        for S, SIGNAL, levels in zip(symbols, batch['signal'].tolist(), batch['levels'].tolist()):
+            if self.MTF_CONFIRM and SIGNAL != 0 and not htf_confirms(SIGNAL, self.frames[S].bars(self.MTF_TIMEFRAME)):
+                SIGNAL = 0
+            signals[S] = SIGNAL
+            self.batch_levels[S] = levels
+            bar_time = str(pd.to_datetime(windows[S]['time'][-2], unit='s')) if S in windows and len(windows[S]) > 1 else None
+            self.state[S] = {'bar_time': bar_time, 'signal': SIGNAL}
+            journal.log_signal(S, SIGNAL, batch=True)
+        self.batch_reverse = dict(zip(symbols, batch['reverse'].tolist())) # reused by main_close in the same cycle
+        return signals, self.batch_reverse
+
+    # CHECK A PARTIAL SIGNAL AND CLOSE THE POSITION IF True (on)
+    def check_reverse_signal(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        SIGNAL = 0
+
+        Supply_Demand_50 = self.Supply_Demand_by_candles(SYMBOL, 50)
+        Supply_Demand_20 = self.Supply_Demand_by_candles(SYMBOL, 20)
+
+        # L O N G 
+        if Supply_Demand_50['supply_demand'].iloc[-2] == 'Demand' and Supply_Demand_20['supply_demand'].iloc[-2] == 'Demand':
+            # print(f'BUY reverse {SYMBOL}')
+            SIGNAL = 1
+
+        # S H O R T
+        elif Supply_Demand_50['supply_demand'].iloc[-2] == 'Supply' and Supply_Demand_20['supply_demand'].iloc[-2] == 'Supply':
+            # print(f'SELL reverse {SYMBOL}')
+            SIGNAL = -1
+
+        return SIGNAL
+
+
+    ''' P R O F I T   &   S T O P   L O S S E S '''
+
+    # CHECK THE CURRENT PROFIT (off)
+    def Profit_F(self, SYMBOL):
+        self.SYMBOL = SYMBOL
+        Openedd = mt5.positions_get(symbol = self.SYMBOL)
+        tot_profit = 0
+        Positions_Opened = [ pos for pos in Openedd ]
+        for pos in Positions_Opened:
+            tot_profit += pos.profit
+        return round(tot_profit, 2)
+
+    # REMOVE ALL STOP LOSS (on)
+    def remove_sl(self, SYMBOL, pos):
+        self.SYMBOL = SYMBOL
+        Openedd = mt5.positions_get(symbol = SYMBOL) or ()
+        responses = []
+        for pos in Openedd:
+            # print(pos.ticket)
+            request = {
+                "action": mt5.TRADE_ACTION_SLTP,
+                "symbol": self.SYMBOL,
+                "position": pos.ticket,
+                "sl": 0.0 if pos.sl > 0.0 or pos.sl != "" else None,
+                "tp": pos.tp}
+
+            responses.append(self.send_order('remove_sl', request))
+        return responses
+
+    # ADD ALL STOP LOSS (on)
+    def add_sl(self, SYMBOL, pos):
+        # the ATR levels must come from this symbol's bars, so select it first
+        self.SYMBOL = SYMBOL
+        Openedd = mt5.positions_get(symbol = SYMBOL) or ()
+        if len(Openedd) == 0:
+            return []
+        TP_Buy, SL_Buy, TP_Sell, SL_Sell = self.ATR()
+        responses = []
+        for pos in Openedd:
+            # print(pos.ticket)
+            request = {
+                "action": mt5.TRADE_ACTION_SLTP,
+                "symbol": self.SYMBOL,
+                "position": pos.ticket,
+                "sl": SL_Sell if pos.type == 1 else SL_Buy,
+                "tp": pos.tp}
+
+            responses.append(self.send_order('add_sl', request))
+        return responses
+
+
+    ''' S N A P S H O T '''
+
+    # Parameters the stored bars and state depend on; a change invalidates the snapshot
+    def snapshot_params(self):
+        return {'timeframe': self.TIMEFRAME_5M, 'Atr_Perc_tp': self.Atr_Perc_tp, 'Atr_Perc_sl': self.Atr_Perc_sl,
+                'atr_window': 6, 'sd_windows': [20, 50], 'liquidity_window': 30}
+
+    # SAVE BAR BUFFERS AND INDICATOR STATE (on)
+    def save_snapshot(self):
+        buffers = {S: frames.buffer.bars for S, frames in self.frames.items() if len(frames.buffer)}
+        if buffers:
+            try:
+                save_snapshot(self.SNAPSHOT_PATH, buffers, self.state, 300, self.snapshot_params())
+            except OSError as e:
+                journal.log_error('save_snapshot', None, e)
+                print(f'Could not save snapshot: {e}')
+
+    # RESTORE BAR BUFFERS AND INDICATOR STATE (on)
+    def restore_snapshot(self):
+        restored = load_snapshot(self.SNAPSHOT_PATH, 300, self.snapshot_params())
+        if restored is None:
+            return
+        buffers, self.state = restored
+        for S, bars in buffers.items():
+            self.frames[S] = TimeframeSet('M5')
+            self.frames[S].update(bars)
+        print(f'Restored {len(buffers)} symbols from {self.SNAPSHOT_PATH}')
+
+    # SEED THE TICK STREAM WITH BAR HISTORY (on)
+    def seed_ticks(self):
+        # Symbols restored from the snapshot only fetch the bars since the last one stored,
+        # the others the full window
+        looknow = int(datetime.utcnow().timestamp())
+        ticks = TickStream(mt5, self.symbol_list)
+        for S in self.symbol_list:
+            frames = self.frames.get(S)
+            if frames is not None and len(frames.buffer):
+                gap = mt5.copy_rates_range(S, self.TIMEFRAME_5M, frames.buffer.last_time, looknow + self.sec_to_shift)
+                if gap is not None and len(gap) > 0:
+                    frames.update(gap)
+                ticks.seed(S, frames.buffer.bars)
+            else:
+                ticks.seed(S, mt5.copy_rates_from_pos(S, self.TIMEFRAME_5M, 0, 400))
+        return ticks
+
+    # PERIODIC SNAPSHOT (on)
+    def maybe_snapshot(self):
+        if time.monotonic() >= self.next_snapshot:
+            self.next_snapshot = time.monotonic() + self.SNAPSHOT_EVERY
+            self.save_snapshot()
+
+
+    ''' E X E C U T I O N '''
+
+    # BUY or SELL (on)
+    def main(self, step, symbols=None):
+        ledger.refresh(mt5.positions_get, max_age=30)
+        if self.BATCH_SCAN:
+            batch_signal, batch_reverse = self.batch_check_signals(list(symbols or self.symbol_list))
+
+        for SYMBOL in (symbols or self.symbol_list):
+            # ------- close all ------- #
+            CLOSE_ALL = False # switch to True for execute
+            if CLOSE_ALL == True:
+                Opened = mt5.positions_get(symbol = SYMBOL)
+                for pos in Opened:
+                    self.close_all_positions(SYMBOL, pos)
+            # ------- close all ------- #
+
+            POSITIONS = self.get_opened_positions(SYMBOL)
+            Openedd = mt5.positions_get(symbol = SYMBOL)
+            Pendingg = mt5.orders_get(symbol= SYMBOL)
 
-        ''' P R O F I T   &   S T O P   L O S S E S '''
+            Tot_Profit = self.Profit_F(SYMBOL)
+            Tot_Len = len(Pendingg) + len(Openedd)
+            signal_reverse = batch_reverse[SYMBOL] if self.BATCH_SCAN else self.check_reverse_signal(SYMBOL)
+            signal = batch_signal[SYMBOL] if self.BATCH_SCAN else self.check_signal(SYMBOL)
 
-        # CHECK THE CURRENT PROFIT (off)
-        def Profit_F(self, SYMBOL):
-            self.SYMBOL = SYMBOL
-            Openedd = mt5.positions_get(symbol = self.SYMBOL)
-            tot_profit = 0
-            Positions_Opened = [ pos for pos in Openedd ]
-            for pos in Positions_Opened:
-                tot_profit += pos.profit
-            return round(tot_profit, 2)
-
-        # REMOVE ALL STOP LOSS (on)
-        def remove_sl(self, SYMBOL, pos):
-            self.SYMBOL = SYMBOL
-            Openedd = mt5.positions_get(symbol = SYMBOL)
-            Positions_Opened = [ pos for pos in Openedd ]
-            for pos in Openedd:
-                # print(pos.ticket)
-                request = {
-                    "action": mt5.TRADE_ACTION_SLTP,
-                    "symbol": self.SYMBOL,
-                    "position": pos.ticket,
-                    "sl": 0.0 if pos.sl > 0.0 or pos.sl != "" else None,
-                    "tp": pos.tp}
-
-                response = mt5.order_send(request)
-                return response
-
-        # ADD ALL STOP LOSS (on)
-        def add_sl(self, SYMBOL, pos):
-            SL_Buy = self.ATR()[1] #.astype(float)
-            SL_Sell = self.ATR()[3] #.astype(float)
-            self.SYMBOL = SYMBOL
-            Openedd = mt5.positions_get(symbol = SYMBOL)
-            Positions_Opened = [ pos for pos in Openedd ]
-            for pos in Openedd:
-                # print(pos.ticket)
-                request = {
-                    "action": mt5.TRADE_ACTION_SLTP,
-                    "symbol": self.SYMBOL,
-                    "position": pos.ticket,
-                    "sl": SL_Sell if pos.type == 1 else SL_Buy,
-                    "tp": pos.tp}
-
-                response = mt5.order_send(request)
-                return response
-
-
-        ''' E X E C U T I O N '''
-
-        # BUY or SELL (on)
-        def main(self, step):
-
-            for SYMBOL in self.symbol_list:
-                # ------- close all ------- #
-                CLOSE_ALL = False # switch to True for execute
-                if CLOSE_ALL == True:
-                    Opened = mt5.positions_get(symbol = SYMBOL)
-                    for pos in Opened:
-                        self.close_all_positions(SYMBOL, pos)
-                # ------- close all ------- #
-
-                POSITIONS = self.get_opened_positions(SYMBOL)
-                Openedd = mt5.positions_get(symbol = SYMBOL)
-                Pendingg = mt5.orders_get(symbol= SYMBOL)
-
-                Tot_Profit = self.Profit_F(SYMBOL)
-                Tot_Len = len(Pendingg) + len(Openedd)
-                signal_reverse = self.check_reverse_signal(SYMBOL)
-                signal = self.check_signal(SYMBOL)
-
-                if CLOSE_ALL == False:
-                    # LOOKING FOR PATTERN
-                    if POSITIONS == '' and len(Openedd) < 1:
-                        try:
-                            if signal == 1:
-                                self.open_market_position(1, self.VOLUME)
-                                client.send_message(chat_id, f'1L1 - Long Opened {SYMBOL}')
+            if CLOSE_ALL == False:
+                # LOOKING FOR PATTERN
+                if POSITIONS == '' and len(Openedd) < 1 and order_guard.can_enter(SYMBOL, mt5.positions_get, mt5.orders_get):
+                    try:
+                        if signal == 1:
+                            if self.open_market_position(1, self.VOLUME) is not None:
+                                notifier.publish('open', f'1L1 - Long Opened {SYMBOL}', SYMBOL)
                                 print(f'1L1 - Long Opened {SYMBOL}')
-                            
-                            elif signal == -1:
-                                self.open_market_position(-1, self.VOLUME)
-                                client.send_message(chat_id, f'1S1 - Short Opened {SYMBOL}')
-                                print(f'1S1 - Short Opened {SYMBOL}')
-                        except:
-                            client.send_message(chat_id, f'Could not open nuew pos')
-                            print('Could not open nuew pos')
                         
-        # CLOSE POSITION (on)
-        def main_close(self):
-            for SYMBOL in self.symbol_list:
-                POSITIONS = self.get_opened_positions(SYMBOL)
+                        elif signal == -1:
+                            if self.open_market_position(-1, self.VOLUME) is not None:
+                                notifier.publish('open', f'1S1 - Short Opened {SYMBOL}', SYMBOL)
+                                print(f'1S1 - Short Opened {SYMBOL}')
+                    except Exception as e:
+                        journal.log_error('main', SYMBOL, e)
+                        notifier.publish('error', f'Could not open nuew pos {SYMBOL}', SYMBOL)
+                        print(f'Could not open nuew pos: {e}')
+                    
+    # CLOSE POSITION (on)
+    def main_close(self, symbols=None):
+        for SYMBOL in (symbols or self.symbol_list):
+            POSITIONS = self.get_opened_positions(SYMBOL)
+            if self.BATCH_SCAN and SYMBOL in self.batch_reverse:
+                signal_reverse = self.batch_reverse[SYMBOL]
+            else:
                 signal_reverse = self.check_reverse_signal(SYMBOL)
 
-                if POSITIONS != '':
+            if POSITIONS != '':
+                try:
+                    
+                    if POSITIONS[0] == 1: # if side is Buy
+                        if signal_reverse == -1:
+                            self.close_position(-1)
+                            notifier.publish('close', f'3L2 - Close Long {SYMBOL} due reverse Signal', SYMBOL)
+                            print(f'3L2 - Close Long {SYMBOL} due reverse Signal')
+                    
+                    elif POSITIONS[0] == -1: # if side id Sell
+                        if signal_reverse == 1:
+                            self.close_position(1) 
+                            #Bot Reply
+                            notifier.publish('close', f'3L2 - Close Short {SYMBOL} due reverse Signal', SYMBOL)
+                            print(f'3L2 - Close Short {SYMBOL} due reverse Signal')
+
+                except Exception as e:
+                    journal.log_error('main_close', SYMBOL, e)
+                    #Bot reply
+                    notifier.publish('error', f'Could not close a poaition {SYMBOL}', SYMBOL)
+                    print(f'Could not close a poaition {SYMBOL}: {e}')
+
+    # EXECUTE MAIN - BUY or SELL (on)
+    def execution_main(self):
+        import datetime
+
+        # The broker cause massive spread during the closing and open time of the market and
+        # this more often burn all the stop losses of the position if using timeframe of 10min or less.
+        # To avoid this, just before the market close, stop searching for signals and remove all the stop losses.
+        # After about 1 hour from the open when the spread came to normal re-add the stop losses and start searching for signal.
+
+        if self.TICK_MODE:
+            return self.execution_ticks()
+
+        current_time = datetime.datetime.now().time()
+
+        # remove all stop loss 
+        if current_time > datetime.time(21, 35) and current_time <= datetime.time(22, 0):
+            for S in self.symbol_list:
+                self.remove_sl(S, None)
+
+        # add all stop loss
+        elif current_time > datetime.time(23, 11) and current_time <= datetime.time(23, 5):
+            for S in self.symbol_list:
+                self.add_sl(S, None)
+
+        # execute
+        else:
+            counterr = 1
+            # Bot Reply
+            notifier.publish('status', f'Looking for pattern in {self.symbol_list}...')
+            print(f'Looking for pattern in {self.symbol_list}...')
+            while not self.stopping.is_set():
+                # stop executing until:
+                if current_time > datetime.time(21, 40) or current_time <= datetime.time(23, 12):
                     try:
+                        self.main(counterr), self.main_close()
+                        counterr = counterr + 1
+                        if counterr > 5:
+                            counterr = 1
+                        self.maybe_snapshot()
+                        self.stopping.wait(28)
+
+                    except BrokerUnavailable as e:
+                        # the connection reconnects on its own, wait for it instead of ending the loop
+                        print(f'Broker unavailable, waiting: {e}')
+                        self.stopping.wait(5)
                         
-                        if POSITIONS[0] == 1: # if side is Buy
-                            if signal_reverse == -1:
-                                self.close_position(-1)
-                                client.send_message(chat_id, f'3L2 - Close Long {SYMBOL} due reverse Signal') 
-                                print(f'3L2 - Close Long {SYMBOL} due reverse Signal')
-                        
-                        elif POSITIONS[0] == -1: # if side id Sell
-                            if signal_reverse == 1:
-                                self.close_position(1) 
-                                #Bot Reply
-                                client.send_message(chat_id, f'3L2 - Close Short {SYMBOL} due reverse Signal')
-                                print(f'3L2 - Close Short {SYMBOL} due reverse Signal')
-
-                    except:
-                        #Bot reply
-                        client.send_message(chat_id, f'Could not close a poaition {SYMBOL}')
-                        print(f'Could not close a poaition {SYMBOL}')
-
-        # EXECUTE MAIN - BUY or SELL (on)
-        def execution_main(self):
-            import datetime
-
-            # The broker cause massive spread during the closing and open time of the market and
-            # this more often burn all the stop losses of the position if using timeframe of 10min or less.
-            # To avoid this, just before the market close, stop searching for signals and remove all the stop losses.
-            # After about 1 hour from the open when the spread came to normal re-add the stop losses and start searching for signal.
-
-            current_time = datetime.datetime.now().time()
-
-            # remove all stop loss 
-            if current_time > datetime.time(21, 35) and current_time <= datetime.time(22, 0):
-                for S in self.symbol_list:
-                    for pos in S:
-                        self.remove_sl(S, pos)
-
-            # add all stop loss
-            elif current_time > datetime.time(23, 11) and current_time <= datetime.time(23, 5):
-                for S in self.symbol_list:
-                    for pos in S:
-                        self.add_sl(S, pos)
-
-            # execute
-            else:
-                counterr = 1
-                # Bot Reply
-                client.send_message(chat_id, f'Looking for pattern in {self.symbol_list}...')
-                print(f'Looking for pattern in {self.symbol_list}...')
-                while True:
-                    # stop executing until:
-                    if current_time > datetime.time(21, 40) or current_time <= datetime.time(23, 12):
-                        try:
-                            self.main(counterr), self.main_close()
-                            counterr = counterr + 1
-                            if counterr > 5:
-                                counterr = 1
-                            time.sleep(28)
-                            
-                        except KeyboardInterrupt:
-                            client.send_message(chat_id, f"KeyboardInterrupt. Stopping.")
-                            print('\n\KeyboardInterrupt. Stopping.')
-                            exit()
-                    else:
-                        client.send_message(chat_id, f'Starting again at 23:35')
-                        print('Starting again at 23:35')
-                        time.sleep(180)
-                        continue
-
-
-
-    if __name__ == '__main__':
-        Trade = Alfris()
-        Trade.execution_main()
+                    except KeyboardInterrupt:
+                        notifier.publish('status', "KeyboardInterrupt. Stopping.")
+                        print('\n\KeyboardInterrupt. Stopping.')
+                        exit()
+                else:
+                    notifier.publish('status', 'Starting again at 23:35')
+                    print('Starting again at 23:35')
+                    self.stopping.wait(180)
+                    continue
+
+
+    # EXECUTE ON BARS BUILT FROM THE TICK STREAM (on)
+    def execution_ticks(self):
+        # Symbols are evaluated the moment their bar closes, and the stop losses are removed
+        # while the measured spread is abnormally wide instead of by the clock.
+        self.ticks = None
+
+        notifier.publish('status', f'Streaming ticks for {self.symbol_list}...')
+        print(f'Streaming ticks for {self.symbol_list}...')
+        next_spread_check = 0
+        while not self.stopping.is_set():
+            try:
+                if self.ticks is None:
+                    # seeded here so a broker that is down on start is waited for like any other outage
+                    self.ticks = self.seed_ticks()
+                closed = list(self.ticks.poll())
+                if closed:
+                    self.main(0, closed), self.main_close(closed)
+
+                if time.monotonic() >= next_spread_check:
+                    next_spread_check = time.monotonic() + 5
+                    for S in self.symbol_list:
+                        wide = self.ticks.spread_is_wide(S, self.SPREAD_FACTOR)
+                        if wide and S not in self.stops_removed:
+                            self.remove_sl(S, None)
+                            self.stops_removed.add(S)
+                            print(f'Spread wide on {S}, stop loss removed {self.ticks.spread_stats(S)}')
+                        elif not wide and S in self.stops_removed:
+                            self.add_sl(S, None)
+                            self.stops_removed.discard(S)
+                            print(f'Spread back to normal on {S}, stop loss added')
+
+                self.maybe_snapshot()
+                self.stopping.wait(self.TICK_INTERVAL)
+
+            except BrokerUnavailable as e:
+                print(f'Broker unavailable, waiting: {e}')
+                self.stopping.wait(5)
+
+            except KeyboardInterrupt:
+                notifier.publish('status', "KeyboardInterrupt. Stopping.")
+                print('\nKeyboardInterrupt. Stopping.')
+                exit()
+
+
+    # RUN THE SCAN LOOP IN THE BACKGROUND (on)
+    @property
+    def running(self):
+        return self.thread is not None and self.thread.is_alive() and not self.stopping.is_set()
+
+    # Start the loop unless a thread is still alive, running or winding down after stop(),
+    # so there is never more than one. Returns at once (False when not started); handlers
+    # call it, and a loop can take a whole scan cycle to notice stop().
+    def start(self):
+        with self.start_lock:
+            if self.thread is not None and self.thread.is_alive():
+                return False
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.execution_main, name='alfris', daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stopping.set()
+
+    # At exit: stop the loop and wait for it, so the snapshot is not taken while it updates the buffers
+    def close(self, timeout=30):
+        self.stop()
+        if self.thread is not None:
+            self.thread.join(timeout)
+            if self.thread.is_alive():
+                print('Scan loop still running, snapshot not saved')
+                return
+        self.save_snapshot()
+
+
+engine = None
+engine_lock = threading.Lock()
+
+def get_engine():
+    global engine
+    with engine_lock:
+        if engine is None:
+            engine = Alfris()
+        return engine
+
+
+# Alfris action when the user selects "AutoTrade"
+@bot.on_callback_query(filters.regex("autotrade"))
+def autotrade_callback_handler(client, callback_query):
+    chat_id = callback_query.message.chat.id
+    subscriptions.subscribe(chat_id)
+    mt5.connect()
+    if get_engine().start():
+        text = "AutoTrade started. Press /close to stop."
+    elif engine.running:
+        text = "Joined the running AutoTrade. Press /close to stop."
+    else:
+        text = "AutoTrade is still stopping, press AutoTrade again in a minute."
+    buttons = [
+        [InlineKeyboardButton("Generate Signal", callback_data="generatesignal"),
+         InlineKeyboardButton("Candlestick chart", callback_data="chart")]
+    ]
+    reply_markup = InlineKeyboardMarkup(buttons)
+    client.send_message(chat_id, text=text, reply_markup=reply_markup)
 
 
-def shutdown_mt5():
-    # Check if MT5 is initialized
-    if mt5.initialize():
-        # Log out from the account
-        mt5.shutdown()
-        print("Logged out from MetaTrader 5 account.")
 
-    # Deinitialize the MT5 library
+def shutdown_mt5():
+    # Close the shared session, nothing reconnects until mt5.connect()
     mt5.shutdown()
     print("MetaTrader 5 library deinitialized.")
 
 # Command handler for /close command
 @bot.on_message(filters.command(["close"]) & filters.private)
 def close_command_handler(client, message):
-    # Check if the MT5 connection is initialized
-    if mt5.initialize():
-        # Shutdown the MT5 connection
-        shutdown_mt5()
+    # Only the last subscriber stops the engine, the others just stop receiving its events
+    subscriptions.unsubscribe(message.chat.id)
+    if len(subscriptions) > 0:
+        client.send_message(message.chat.id, f"Unsubscribed. AutoTrade keeps running for {len(subscriptions)} other chat(s).")
+        return
+    if engine is not None:
+        engine.stop()
+
+    # Shutdown the MT5 connection (also stops reconnect attempts if it was down)
+    connected = mt5.connected
+    shutdown_mt5()
+    if connected:
         # Send a message to the user indicating successful shutdown
         client.send_message(message.chat.id, "MetaTrader 5 connection has been closed.")
     else:
         # Send a message to the user indicating that MT5 is not initialized
         client.send_message(message.chat.id, "MetaTrader 5 connection is not initialized.")
 
+# Command handler for /broker command: session state, reconnects and time to recover
+@bot.on_message(filters.command(["broker"]) & filters.private)
+def broker_command_handler(client, message):
+    client.send_message(message.chat.id, mt5.report())
+
+# Command handler for /subscribe SYMBOL ... (no symbol: all of them)
+@bot.on_message(filters.command(["subscribe"]) & filters.private)
+def subscribe_command_handler(client, message):
+    symbols = [s.upper() for s in message.command[1:]]
+    known = [s for s in symbols if s in get_engine().symbol_list]
+    unknown = [s for s in symbols if s not in known]
+    if symbols and not known:
+        client.send_message(message.chat.id, f"Not traded by AutoTrade: {', '.join(unknown)}")
+        return
+    sub = subscriptions.subscribe(message.chat.id, known)
+    text = f"Following: {', '.join(sorted(sub['symbols']))}"
+    if unknown:
+        text += f"\nNot traded by AutoTrade: {', '.join(unknown)}"
+    client.send_message(message.chat.id, text)
+
+# Command handler for /unsubscribe SYMBOL ... (no symbol: everything)
+@bot.on_message(filters.command(["unsubscribe"]) & filters.private)
+def unsubscribe_command_handler(client, message):
+    symbols = [s.upper() for s in message.command[1:]]
+    if subscriptions.unsubscribe(message.chat.id, symbols, all_symbols=get_engine().symbol_list):
+        text = "Unsubscribed from AutoTrade events."
+        # as with /close, the last subscriber leaving stops the engine
+        if len(subscriptions) == 0 and engine.running:
+            engine.stop()
+            text += "\nNo chat follows AutoTrade any more, so it was stopped."
+        client.send_message(message.chat.id, text)
+    else:
+        client.send_message(message.chat.id, f"Following: {', '.join(sorted(subscriptions.get(message.chat.id)['symbols']))}")
+
+# Command handler for /notify EVENT on|off
+@bot.on_message(filters.command(["notify"]) & filters.private)
+def notify_command_handler(client, message):
+    if len(message.command) != 3 or message.command[1] not in EVENTS or message.command[2] not in ('on', 'off'):
+        client.send_message(message.chat.id, f"Usage: /notify {'|'.join(EVENTS)} on|off")
+        return
+    sub = subscriptions.set_event(message.chat.id, message.command[1], message.command[2] == 'on')
+    if sub is None:
+        client.send_message(message.chat.id, "Not subscribed. Press AutoTrade or use /subscribe first.")
+    else:
+        client.send_message(message.chat.id, f"Notifications: {', '.join(sorted(sub['events'])) or 'none'}")
+
+# Command handler for /subscriptions command
+@bot.on_message(filters.command(["subscriptions"]) & filters.private)
+def subscriptions_command_handler(client, message):
+    sub = subscriptions.get(message.chat.id)
+    if sub is None:
+        client.send_message(message.chat.id, "Not subscribed.")
+    else:
+        client.send_message(message.chat.id, f"Following: {', '.join(sorted(sub['symbols']))}\n"
+                                             f"Notifications: {', '.join(sorted(sub['events']))}")
+
+# Command handler for /exposure command
+@bot.on_message(filters.command(["exposure"]) & filters.private)
+def exposure_command_handler(client, message):
+    try:
+        ledger.refresh(mt5.positions_get, max_age=30)
+    except BrokerUnavailable:
+        client.send_message(message.chat.id, BROKER_UNAVAILABLE)
+        return
+    client.send_message(message.chat.id, ledger.summary())
+
+
+#~~~~~~~ CHARTS ~~~~~~~~~~
+CHART_USAGE = "Send /chart SYMBOL [TIMEFRAME] [BARS] [levels] [zones]\n" \
+              f"Timeframes: {', '.join(TIMEFRAME_SECONDS)}\n" \
+              "levels: ATR take profit / stop loss, zones: supply and demand zones\n" \
+              "Example: /chart EURUSD M15 120 levels zones"
+
+# Alfris action when the user selects "Candlestick chart"
+@bot.on_callback_query(filters.regex("^chart$"))
+def chart_callback_handler(client, callback_query):
+    client.send_message(callback_query.message.chat.id, CHART_USAGE)
+
+# Command handler for /chart SYMBOL TF N: closed bars are fetched off the event loop and rendered in the pool
+@bot.on_message(filters.command(["chart"]) & filters.private)
+async def chart_command_handler(client, message):
+    args = [a.upper() for a in message.command[1:]]
+    options = {a for a in args if a in ('LEVELS', 'ZONES')}
+    args = [a for a in args if a not in options]
+    symbol = args[0] if args else None
+    timeframe = args[1] if len(args) > 1 else 'M5'
+    if symbol is None or timeframe not in TIMEFRAME_SECONDS or (len(args) > 2 and not args[2].isdigit()):
+        await message.reply_text(CHART_USAGE)
+        return
+    count = min(max(int(args[2]) if len(args) > 2 else 100, 20), 500)
+
+    loop = asyncio.get_running_loop()
+    try:
+        rates = await loop.run_in_executor(None, mt5.copy_rates_from_pos, symbol, getattr(mt5, f'TIMEFRAME_{timeframe}'), 1, count)
+    except BrokerUnavailable:
+        await message.reply_text(BROKER_UNAVAILABLE)
+        return
+    if rates is None or len(rates) == 0:
+        await message.reply_text(f"No data for {symbol} {timeframe}")
+        return
+    try:
+        png = await asyncio.wrap_future(charts.render(symbol, timeframe, rates, 'LEVELS' in options, 'ZONES' in options))
+    except Exception as e:
+        journal.log_error('chart', symbol, e)
+        await message.reply_text(f"Could not draw the chart for {symbol}")
+        return
+    photo = io.BytesIO(png)
+    photo.name = f'{symbol}_{timeframe}.png'
+    await client.send_photo(message.chat.id, photo, caption=f"{symbol} {timeframe}, {len(rates)} bars")
 
-#~~~~~~~ FEEDBACK ~~~~~~~~~~
-# Connect to SQLite database
-conn = sqlite3.connect('feedback.db')
-c = conn.cursor()
-
-# Create feedback table if it doesn't exist
-c.execute('''CREATE TABLE IF NOT EXISTS feedback (
-             id INTEGER PRIMARY KEY,
-             user_id INTEGER,
-             text TEXT,
-             timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
-conn.commit()
 
+#~~~~~~~ FEEDBACK ~~~~~~~~~~
 import aiosqlite
 
 # Define a coroutine to save feedback to the database
@@ -875,6 +1318,50 @@ async def showfeedback_command_handler(client, message):
     # Close the database connection
     conn.close()
 
+# ~~~~~~~ SETUP ~~~~~~~~
+# Everything that opens a connection, a file or a thread. On Windows the chart workers
+# are started with spawn and import this module as __mp_main__, so this only runs below.
+def setup():
+    global mt5, journal, ledger, order_guard, subscriptions, notifier, charts
+
+    # Journal of signals, orders and broker responses (written in background)
+    journal = TradeJournal('journal.db')
+
+    # One terminal session for the bot and the engine: MetaTrader5 (or a recording / replay of it, recorder.py)
+    # behind health checks and reconnects with backoff (connection.py). A replay has no session to check.
+    mt5 = BrokerConnection(broker_from_env(), probe_interval=None if os.environ.get('ALFRIS_REPLAY') else 10,
+                           on_event=lambda kind, details: journal.log_error('broker', None, f'{kind} {details}'))
+
+    # Open exposure per symbol and currency, updated from every deal and reconciled against positions_get
+    # (the engine sets the lot limits from its VOLUME and symbol list)
+    ledger = ExposureLedger()
+
+    # Per-symbol submit locks and idempotency keys (in the order comment) shared by every scan
+    order_guard = OrderGuard(magic=2022)
+
+    # Chats following the engine: the symbols and event kinds each chat wants
+    subscriptions = SubscriptionRegistry('subscriptions.db')
+    notifier = Notifier(subscriptions, bot.send_message, on_error=lambda chat_id, e: journal.log_error('notify', str(chat_id), e))
+
+    # PNG rendering in worker processes, cached until the next bar closes
+    charts = ChartRenderer(workers=2)
+    atexit.register(charts.close)
+
+    # Create the feedback table if it doesn't exist
+    conn = sqlite3.connect('feedback.db')
+    conn.execute('''CREATE TABLE IF NOT EXISTS feedback (
+                 id INTEGER PRIMARY KEY,
+                 user_id INTEGER,
+                 text TEXT,
+                 timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    conn.commit()
+    conn.close()
+
+    mt5.connect()
+
+
 # ~~~~~~~ Indicates that Alfris is live ~~~~~~~~
-print("Alfris Running")
-bot.run()
+if __name__ == '__main__':
+    setup()
+    print("Alfris Running")
+    bot.run()
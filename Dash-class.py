@@ -2,7 +2,15 @@ from dash import Dash, html, dcc, Output, Input, State
 import dash_bootstrap_components as dbc 
 import pandas as pd 
 import plotly.graph_objects as go
-import MetaTrader5 as mt5 
+import os
+import time
+from bars import TimeframeSet, TIMEFRAME_SECONDS
+from patterns import bar_patterns, names, BULLISH, BEARISH
+from recorder import broker_from_env
+from connection import BrokerConnection
+
+# Own terminal session, checked and reconnected as in Bot.py (no checks when replaying a recording)
+mt5 = BrokerConnection(broker_from_env(), probe_interval=None if os.environ.get('ALFRIS_REPLAY') else 10)
 # from mt5_funcs import get_symbol_names, TIMEFRAMES, TIMEFRAME_DICT
 
 TIMEFRAMES = ['M1', 'M5', 'M15', 'M30', "H1", 'H4', 'D1', 'W1','MN1']
@@ -18,8 +26,12 @@ TIMEFRAME_DICT = {
     'MN1': mt5.TIMEFRAME_MN1,
 }
 
+# Timeframes built locally from one M5 stream per symbol, the rest come from the terminal
+LOCAL_TIMEFRAMES = ['M5', 'M15', 'M30', 'H1', 'H4']
+BASE_TIMEFRAME = 'M5'
+
 def get_symbol_names():
-    mt5.initialize()
+    mt5.connect()
 
     symbols = mt5.symbols_get()
     symbols_df = pd.DataFrame(symbols, columns=symbols[0]._asdict().keys())
@@ -30,6 +42,7 @@ def get_symbol_names():
 class RealTimeChartsApp:
     def __init__(self):
         self.app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+        self.feeds = {} # symbol -> [TimeframeSet, base bars fetched, last update]
         self.setup_layout()
         self.register_callbacks()
 
@@ -89,7 +102,7 @@ class RealTimeChartsApp:
 
             print(symbol, timeframe, num_bars)
 
-            bars = mt5.copy_rates_from_pos(symbol, timeframe, 0, num_bars)
+            bars = self.get_bars(symbol, timeframe_str, num_bars)
             df = pd.DataFrame(bars)
             df['time'] = pd.to_datetime(df['time'], unit='s')
 
@@ -98,6 +111,16 @@ class RealTimeChartsApp:
                                                 high=df['high'],
                                                 low=df['low'],
                                                 close=df['close']))
+
+            # Candle patterns, bullish marked under the low and bearish over the high
+            mask = bar_patterns(bars)
+            for bits, price, symbol_marker, color in ((BULLISH, 'low', 'triangle-up', 'green'),
+                                                      (BEARISH, 'high', 'triangle-down', 'red')):
+                hit = (mask & bits) != 0
+                fig.add_trace(go.Scatter(x=df['time'][hit], y=df[price][hit], mode='markers',
+                                         marker=dict(symbol=symbol_marker, color=color, size=9),
+                                         hovertext=[', '.join(names(int(b))) for b in mask[hit]], hoverinfo='text'))
+            fig.update_layout(showlegend=False)
             
             fig.update(layout_xaxis_rangeslider_visible=False)
             fig.update_layout(yaxis={'side':'right'})
@@ -109,6 +132,30 @@ class RealTimeChartsApp:
                 dcc.Graph(figure=fig, config={'displayModeBar': False})
             ]
 
+    # Bars for the chart. Intraday timeframes are resampled from a cached M5 stream,
+    # so switching between them only fetches the M5 bars that closed since the last update.
+    def get_bars(self, symbol, timeframe_str, num_bars):
+        if timeframe_str not in LOCAL_TIMEFRAMES:
+            return mt5.copy_rates_from_pos(symbol, TIMEFRAME_DICT[timeframe_str], 0, num_bars)
+
+        base_seconds = TIMEFRAME_SECONDS[BASE_TIMEFRAME]
+        needed = (num_bars + 1) * TIMEFRAME_SECONDS[timeframe_str] // base_seconds
+        feed = self.feeds.get(symbol)
+
+        if feed is None or feed[1] < needed:
+            # first request or deeper history than cached: one full fetch
+            depth = max(needed, 12 * 24)
+            feed = [TimeframeSet(BASE_TIMEFRAME, targets=LOCAL_TIMEFRAMES[1:], capacity=depth), depth, time.monotonic()]
+            feed[0].update(mt5.copy_rates_from_pos(symbol, TIMEFRAME_DICT[BASE_TIMEFRAME], 0, depth))
+            self.feeds[symbol] = feed
+        else:
+            # only the bars since the last update (plus the one that was forming)
+            gap = int((time.monotonic() - feed[2]) // base_seconds) + 2
+            feed[0].update(mt5.copy_rates_from_pos(symbol, TIMEFRAME_DICT[BASE_TIMEFRAME], 0, min(gap, feed[1])))
+            feed[2] = time.monotonic()
+
+        return feed[0].bars(timeframe_str)[-num_bars:]
+
     def run(self, host='127.0.0.1', port=8080):
         self.app.run_server(host=host, port=port)
 
@@ -0,0 +1,206 @@
+import numpy as np
+import pandas as pd
+
+
+# ~~~~~~~ BAR DATA ~~~~~~~~
+# Bars are kept in the same numpy structured layout that mt5.copy_rates_* returns,
+# so broker arrays can be stored, merged and resampled without conversion.
+
+BAR_DTYPE = np.dtype([
+    ('time', '<i8'),
+    ('open', '<f8'),
+    ('high', '<f8'),
+    ('low', '<f8'),
+    ('close', '<f8'),
+    ('tick_volume', '<u8'),
+    ('spread', '<i4'),
+    ('real_volume', '<u8'),
+])
+
+# Timeframes that can be built locally. W1 and MN1 do not align on a fixed number
+# of seconds since the epoch, so they still come from the broker.
+TIMEFRAME_SECONDS = {
+    'M1': 60,
+    'M5': 300,
+    'M15': 900,
+    'M30': 1800,
+    'H1': 3600,
+    'H4': 14400,
+    'D1': 86400,
+}
+
+
+# Convert broker rates (or anything with the same field names) to BAR_DTYPE
+def as_bars(rates):
+    if rates is None or len(rates) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    if isinstance(rates, pd.DataFrame):
+        out = np.zeros(len(rates), dtype=BAR_DTYPE)
+        for name in BAR_DTYPE.names:
+            if name in rates.columns:
+                column = rates[name]
+                if name == 'time' and np.issubdtype(column.dtype, np.datetime64):
+                    column = column.astype('int64') // 10**9
+                out[name] = column.to_numpy()
+        return out
+    rates = np.asarray(rates)
+    if rates.dtype == BAR_DTYPE:
+        return rates
+    out = np.zeros(len(rates), dtype=BAR_DTYPE)
+    for name in BAR_DTYPE.names:
+        if name in rates.dtype.names:
+            out[name] = rates[name]
+    return out
+
+
+# Same columns Alfris.Historical works with
+def to_frame(bars):
+    df = pd.DataFrame({
+        'time': pd.to_datetime(bars['time'], unit='s'),
+        'open': bars['open'],
+        'high': bars['high'],
+        'low': bars['low'],
+        'close': bars['close'],
+        'tick_volume': bars['tick_volume'],
+    })
+    return df
+
+
+''' R E S A M P L I N G '''
+
+# Aggregate time-sorted bars into bars of `seconds`. Each output bar opens at a
+# multiple of `seconds`, takes the open of its first and the close of its last
+# input bar, and sums the volumes.
+def resample(bars, seconds):
+    bars = as_bars(bars)
+    if len(bars) == 0:
+        return bars
+    bucket = bars['time'] - bars['time'] % seconds
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(bars)] - 1
+
+    out = np.empty(len(starts), dtype=BAR_DTYPE)
+    out['time'] = bucket[starts]
+    out['open'] = bars['open'][starts]
+    out['high'] = np.maximum.reduceat(bars['high'], starts)
+    out['low'] = np.minimum.reduceat(bars['low'], starts)
+    out['close'] = bars['close'][ends]
+    out['tick_volume'] = np.add.reduceat(bars['tick_volume'], starts)
+    out['spread'] = np.minimum.reduceat(bars['spread'], starts)
+    out['real_volume'] = np.add.reduceat(bars['real_volume'], starts)
+    return out
+
+
+class BarBuffer:
+    # Fixed-capacity, time-ordered store of bars for one symbol and timeframe
+    def __init__(self, capacity=5000):
+        self.capacity = capacity
+        self.bars = np.empty(0, dtype=BAR_DTYPE)
+
+    def __len__(self):
+        return len(self.bars)
+
+    @property
+    def last_time(self):
+        return int(self.bars['time'][-1]) if len(self.bars) else None
+
+    # Merge new bars; a bar with the time of an existing one replaces it (the forming bar updates)
+    def update(self, rates):
+        new = as_bars(rates)
+        if len(new) == 0:
+            return 0
+        if len(self.bars) and new['time'][0] <= self.bars['time'][-1]:
+            before = np.searchsorted(self.bars['time'], new['time'][0], side='left')
+            after = np.searchsorted(self.bars['time'], new['time'][-1], side='right')
+            added = len(new) - (after - before)
+            self.bars = np.concatenate([self.bars[:before], new, self.bars[after:]])
+        else:
+            added = len(new)
+            self.bars = np.concatenate([self.bars, new])
+        if len(self.bars) > self.capacity:
+            self.bars = self.bars[-self.capacity:]
+        return max(added, 0)
+
+    def tail(self, n):
+        return self.bars[-n:]
+
+    def frame(self, n=None):
+        return to_frame(self.bars if n is None else self.bars[-n:])
+
+
+class BarResampler:
+    # Builds bars of one higher timeframe incrementally from closed base bars
+    def __init__(self, base_seconds, target_seconds, capacity=5000):
+        if target_seconds % base_seconds:
+            raise ValueError(f'{target_seconds}s bars cannot be built from {base_seconds}s bars')
+        self.base_seconds = base_seconds
+        self.target_seconds = target_seconds
+        self.closed = BarBuffer(capacity)
+        self.partial = np.empty(0, dtype=BAR_DTYPE)  # base bars of the bucket still open
+        self.last_base_time = None
+
+    # Feed closed base bars, returns the target bars that closed
+    def update(self, base_bars):
+        base_bars = as_bars(base_bars)
+        if self.last_base_time is not None:
+            base_bars = base_bars[base_bars['time'] > self.last_base_time]
+        elif len(base_bars):
+            # start at the first complete bucket so the first bar has the right open
+            first = int(base_bars['time'][0])
+            if first % self.target_seconds:
+                base_bars = base_bars[base_bars['time'] >= first - first % self.target_seconds + self.target_seconds]
+        if len(base_bars) == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        self.last_base_time = int(base_bars['time'][-1])
+
+        pending = np.concatenate([self.partial, base_bars])
+        merged = resample(pending, self.target_seconds)
+        last_bucket = merged['time'][-1]
+        # the last bucket is complete once its final base bar has closed
+        if self.last_base_time + self.base_seconds >= last_bucket + self.target_seconds:
+            done = merged
+            self.partial = np.empty(0, dtype=BAR_DTYPE)
+        else:
+            done = merged[:-1]
+            self.partial = pending[pending['time'] >= last_bucket]
+        self.closed.update(done)
+        return done
+
+    # Closed bars plus the bar still forming from `forming` (the open base bar, if any)
+    def bars(self, forming=None):
+        open_part = self.partial
+        if forming is not None and len(forming):
+            forming = as_bars(forming)
+            forming = forming[forming['time'] > (self.last_base_time or -1)]
+            open_part = np.concatenate([open_part, forming])
+        if len(open_part) == 0:
+            return self.closed.bars
+        return np.concatenate([self.closed.bars, resample(open_part, self.target_seconds)])
+
+
+class TimeframeSet:
+    # One base stream per symbol with the higher timeframes resampled from it.
+    # The last row of every timeframe is the forming bar, as with broker data.
+    def __init__(self, base='M5', targets=('M15', 'M30', 'H1', 'H4'), capacity=5000):
+        self.base = base
+        self.base_seconds = TIMEFRAME_SECONDS[base]
+        self.buffer = BarBuffer(capacity)
+        self.resamplers = {tf: BarResampler(self.base_seconds, TIMEFRAME_SECONDS[tf], capacity) for tf in targets}
+
+    # Feed broker rates whose last row is the bar still forming
+    def update(self, rates):
+        rates = as_bars(rates)
+        self.buffer.update(rates)
+        closed = rates[:-1]
+        for resampler in self.resamplers.values():
+            resampler.update(closed)
+
+    def bars(self, timeframe):
+        if timeframe == self.base:
+            return self.buffer.bars
+        forming = self.buffer.bars[-1:]
+        return self.resamplers[timeframe].bars(forming)
+
+    def frame(self, timeframe, n=None):
+        bars = self.bars(timeframe)
+        return to_frame(bars if n is None else bars[-n:])
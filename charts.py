@@ -0,0 +1,146 @@
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import numpy as np
+
+import signals
+
+
+# ~~~~~~~ CHART IMAGES ~~~~~~~~
+# Candlestick PNGs for the /chart command. Rendering runs in a process pool so the
+# bot's dispatcher never waits on it. Images are cached by (symbol, timeframe, bar
+# count, last closed bar, overlays): until a new bar closes the same request is served
+# from the cache, and identical requests already in flight share one render.
+# Bars are closed candles only (mt5 rates or bars.BAR_DTYPE), oldest first.
+
+UP = '#26a69a'
+DOWN = '#ef5350'
+
+
+''' O V E R L A Y S '''
+
+# ATR take profit / stop loss the engine would use now: signals.atr_levels reads the
+# second to last row of a window that ends with the forming candle. Chart bars are all
+# closed, so the last one is repeated in its place (the ATR only looks back, so the
+# stand-in row never changes the levels). [TP_buy, SL_buy, TP_sell, SL_sell]
+def atr_levels(bars, **params):
+    h, l, c = (np.append(bars[f].astype(float), bars[f][-1]) for f in ('high', 'low', 'close'))
+    return signals.atr_levels(h, l, c, **params)
+
+# Latest supply and demand zones: the body-to-wick range of the last candle labelled
+# SUPPLY (high side) and DEMAND (low side). Returns [(label, bar index, bottom, top)]
+def sd_zones(bars, window=50):
+    o, h, l, c = (bars[f].astype(float) for f in ('open', 'high', 'low', 'close'))
+    labels = signals.supply_demand(h, l, window)
+    zones = []
+    for label, kind in ((signals.SUPPLY, 'supply'), (signals.DEMAND, 'demand')):
+        idx = np.flatnonzero(labels == label)
+        if len(idx) == 0:
+            continue
+        i = idx[-1]
+        if label == signals.SUPPLY:
+            zones.append((kind, i, max(o[i], c[i]), h[i]))
+        else:
+            zones.append((kind, i, l[i], min(o[i], c[i])))
+    return zones
+
+
+''' R E N D E R '''
+
+# PNG bytes of a candlestick chart; runs in the worker processes
+def render_png(symbol, timeframe, bars, levels=False, zones=False, width=10, height=5.5, dpi=100):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    o, h, l, c = (bars[f].astype(float) for f in ('open', 'high', 'low', 'close'))
+    x = np.arange(len(bars))
+    color = np.where(c >= o, UP, DOWN)
+
+    fig, ax = plt.subplots(figsize=(width, height), dpi=dpi)
+    try:
+        ax.vlines(x, l, h, colors=color, linewidth=0.8)
+        ax.bar(x, np.maximum(np.abs(c - o), (h - l).max() * 1e-3), bottom=np.minimum(o, c), color=color, width=0.7)
+
+        if zones:
+            for kind, i, bottom, top in sd_zones(bars):
+                ax.fill_between([i - 0.5, len(bars) - 0.5], bottom, top, color=DOWN if kind == 'supply' else UP,
+                                alpha=0.15, label=kind.capitalize())
+        if levels:
+            tp_buy, sl_buy, tp_sell, sl_sell = atr_levels(bars)
+            start = max(len(bars) - 20, 0) - 0.5
+            for price, name, style, col in ((tp_buy, 'TP buy', '--', UP), (sl_buy, 'SL buy', ':', UP),
+                                            (tp_sell, 'TP sell', '--', DOWN), (sl_sell, 'SL sell', ':', DOWN)):
+                ax.hlines(price, start, len(bars) - 0.5, colors=col, linestyles=style, linewidth=1, label=name)
+        if zones or levels:
+            ax.legend(loc='upper left', fontsize=8)
+
+        times = bars['time'].astype('datetime64[s]')
+        ticks = x[::max(len(x) // 8, 1)]
+        ax.set_xticks(ticks)
+        ax.set_xticklabels([str(t)[5:16].replace('T', ' ') for t in times[ticks]], fontsize=8)
+        ax.set_xlim(-1, len(bars))
+        ax.ticklabel_format(axis='y', useOffset=False)
+        ax.set_title(f'{symbol} {timeframe} - last close {c[-1]:g} ({str(times[-1]).replace("T", " ")})')
+        ax.grid(alpha=0.2)
+        fig.tight_layout()
+
+        out = io.BytesIO()
+        fig.savefig(out, format='png')
+        return out.getvalue()
+    finally:
+        plt.close(fig)
+
+
+''' P O O L   A N D   C A C H E '''
+
+class ChartRenderer:
+    def __init__(self, workers=2, cache_size=64):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.pool = None # started on first use
+        self.lock = threading.Lock()
+        self.cache = OrderedDict() # key -> png bytes, least recently used first
+        self.pending = {} # key -> Future of a render in progress
+        self.hits = 0
+        self.renders = 0
+
+    @staticmethod
+    def key(symbol, timeframe, bars, levels=False, zones=False):
+        return symbol, timeframe, len(bars), int(bars['time'][-1]), bool(levels), bool(zones)
+
+    # Future with the PNG bytes; resolved at once on a cache hit
+    def render(self, symbol, timeframe, bars, levels=False, zones=False):
+        key = self.key(symbol, timeframe, bars, levels, zones)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                self.hits += 1
+                future = Future()
+                future.set_result(self.cache[key])
+                return future
+            if key in self.pending:
+                self.hits += 1
+                return self.pending[key]
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=self.workers)
+            self.renders += 1
+            future = self.pool.submit(render_png, symbol, timeframe, bars, levels, zones)
+            self.pending[key] = future
+        future.add_done_callback(lambda f: self._done(key, f))
+        return future
+
+    def _done(self, key, future):
+        with self.lock:
+            self.pending.pop(key, None)
+            if future.cancelled() or future.exception() is not None:
+                return
+            self.cache[key] = future.result()
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,188 @@
+import threading
+import time
+
+
+# ~~~~~~~ BROKER CONNECTION ~~~~~~~~
+# Owns the terminal session: initialize() runs once, and the bot, the engine and the
+# dashboard share the session through this object. It exposes the same functions and
+# constants as the broker module.
+# Health is checked lazily. A call that comes more than `probe_interval` seconds after
+# the last check first runs terminal_info(), and so does any call right after a broker
+# function returned None. A failed check reconnects (shutdown + initialize) with
+# exponential backoff between attempts, and each outage is timed until it recovers.
+# While the session is down (or shut down on purpose) broker functions raise
+# BrokerUnavailable instead of reaching the terminal. Calls run outside the lock, but
+# a reconnect or shutdown waits for the calls in progress to finish first.
+
+NO_PROBE = {'initialize', 'shutdown', 'login', 'last_error', 'terminal_info', 'version'}
+
+
+class BrokerUnavailable(ConnectionError):
+    pass
+
+
+class BrokerConnection:
+    # settings: passed to initialize() (path, login, password, server, timeout...)
+    # probe_interval None turns the health checks off (e.g. replaying a recording)
+    def __init__(self, broker, probe_interval=10, backoff=1.0, max_backoff=60.0, on_event=None, **settings):
+        self.broker = broker
+        self.settings = settings
+        self.probe_interval = probe_interval
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_event = on_event
+        self.lock = threading.RLock()
+        self.idle = threading.Condition(self.lock)
+        self.active = 0 # broker calls in progress
+        self.reconnecting = False
+        self.session = 0 # bumped whenever the terminal session is shut down or re-initialized
+        self.drain_timeout = 10.0 # seconds a reconnect waits for the calls in progress
+        self.connected = False
+        self.closed = False # shut down on purpose, no reconnecting until connect()
+        self.next_probe = 0.0
+        self.next_attempt = 0.0
+        self.failures = 0 # failed attempts in the current outage
+        self.down_since = None
+        self.reconnects = 0
+        self.recover_times = [] # seconds from losing the session to getting it back
+        self.wrapped = {}
+
+    def _event(self, kind, **details):
+        print(f'Broker {kind}: {details}' if details else f'Broker {kind}')
+        if self.on_event is not None:
+            self.on_event(kind, details)
+
+    # Initialize the terminal session (no-op if it is already up)
+    def connect(self):
+        with self.lock:
+            self.closed = False
+            if self.connected or self.reconnecting:
+                return self.connected
+            return self._attempt()
+
+    # With the lock held: wait until no call is using the session (the wait releases the lock)
+    def _drain(self):
+        self.idle.wait_for(lambda: self.active == 0, self.drain_timeout)
+
+    def _attempt(self):
+        now = time.monotonic()
+        self.reconnecting = True
+        try:
+            if self.down_since is not None:
+                self._drain()
+                self.session += 1
+                self.broker.shutdown()
+            ok = bool(self.broker.initialize(**self.settings))
+        finally:
+            self.reconnecting = False
+        if ok:
+            if self.down_since is not None:
+                self.reconnects += 1
+                self.recover_times.append(now - self.down_since)
+                self._event('reconnected', after_s=round(now - self.down_since, 1), attempts=self.failures + 1)
+            self.connected = True
+            self.failures = 0
+            self.down_since = None
+            self.next_probe = now + (self.probe_interval or 0)
+        else:
+            self.connected = False
+            if self.down_since is None:
+                self.down_since = now
+            delay = min(self.max_backoff, self.backoff * 2 ** self.failures)
+            self.failures += 1
+            self.next_attempt = now + delay
+            self._event('initialize failed', error=self.broker.last_error(), retry_in_s=delay)
+        return ok
+
+    def probe(self):
+        try:
+            info = self.broker.terminal_info()
+        except Exception:
+            return False
+        return info is not None and getattr(info, 'connected', True)
+
+    # True if the session is usable, reconnecting first when it is due for a check and the check fails
+    def ensure(self):
+        if self.closed:
+            return False
+        now = time.monotonic()
+        if self.connected and (self.probe_interval is None or now < self.next_probe):
+            return True
+        with self.lock:
+            now = time.monotonic()
+            if self.connected and self.probe_interval is not None and now >= self.next_probe:
+                if self.probe():
+                    self.next_probe = now + self.probe_interval
+                    return True
+                self.connected = False
+                self.down_since = now
+                self.failures = 0
+                self.next_attempt = now
+                self._event('lost', error=self.broker.last_error())
+            if self.connected:
+                return True
+            if self.reconnecting or now < self.next_attempt:
+                return False
+            return self._attempt()
+
+    def shutdown(self):
+        with self.lock:
+            self.closed = True
+            self.connected = False
+            self.down_since = None
+            self._drain()
+            self.session += 1
+            return self.broker.shutdown()
+
+    def stats(self):
+        down = time.monotonic() - self.down_since if self.down_since is not None else 0.0
+        return {
+            'connected': self.connected,
+            'reconnects': self.reconnects,
+            'down_for_s': round(down, 1),
+            'mean_recover_s': round(sum(self.recover_times) / len(self.recover_times), 1) if self.recover_times else None,
+            'max_recover_s': round(max(self.recover_times), 1) if self.recover_times else None,
+        }
+
+    def report(self):
+        s = self.stats()
+        lines = [f"Broker: {'connected' if s['connected'] else 'disconnected'}",
+                 f"Reconnects: {s['reconnects']}"]
+        if s['down_for_s']:
+            lines.append(f"Down for: {s['down_for_s']}s")
+        if s['mean_recover_s'] is not None:
+            lines.append(f"Time to recover: mean {s['mean_recover_s']}s, max {s['max_recover_s']}s")
+        return '\n'.join(lines)
+
+    # Broker functions and constants; functions check the session first and raise
+    # BrokerUnavailable rather than call a terminal that is not connected
+    def __getattr__(self, name):
+        attr = getattr(self.broker, name)
+        if not callable(attr) or name in NO_PROBE:
+            return attr
+        if name not in self.wrapped:
+            def call(*args, **kwargs):
+                # checked and counted in under the lock, so no reconnect starts in between
+                with self.lock:
+                    if not self.ensure():
+                        state = 'closed' if self.closed else f'down, next reconnect in {max(self.next_attempt - time.monotonic(), 0):.0f}s'
+                        raise BrokerUnavailable(f'{name}: broker session {state}')
+                    self.active += 1
+                    session = self.session
+                try:
+                    result = attr(*args, **kwargs)
+                finally:
+                    with self.lock:
+                        # read before counting out: once active drops a waiting reset may bump it
+                        reset = self.session != session
+                        self.active -= 1
+                        if self.active == 0:
+                            self.idle.notify_all()
+                if reset:
+                    # shut down or reset while this call ran (a reconnect only waits drain_timeout)
+                    raise BrokerUnavailable(f'{name}: broker session reset during the call')
+                if result is None:
+                    self.next_probe = 0.0 # failed call: check the session before the next one
+                return result
+            self.wrapped[name] = call
+        return self.wrapped[name]
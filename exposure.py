@@ -0,0 +1,142 @@
+import threading
+import time
+
+from retcodes import DONE_RETCODES, TRADE_ACTION_DEAL
+
+
+# ~~~~~~~ EXPOSURE LEDGER ~~~~~~~~
+# Running totals of open exposure per position, symbol and currency. Order results
+# update it incrementally and a positions snapshot reconciles it periodically, so
+# per-symbol, per-currency and total queries are dictionary lookups.
+#
+# Currency exposure is in units of the currency: buying 1 lot of EURUSD at 1.10 is
+# +100000 EUR and -110000 USD.
+
+
+class ExposureLedger:
+    def __init__(self, max_total_lots=None, max_symbol_lots=None, max_currency=None, contract_size=100000,
+                 contract_sizes=None):
+        self.max_total_lots = max_total_lots
+        self.max_symbol_lots = max_symbol_lots
+        self.max_currency = max_currency or {} # currency -> max absolute net exposure in that currency
+        self.contract_size = contract_size
+        self.contract_sizes = contract_sizes or {}
+        self.lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.positions = {} # ticket -> [symbol, side, volume, price]
+            self.symbol_net = {}
+            self.symbol_gross = {}
+            self.currency = {}
+            self.total = 0.0
+            self.reconciled_at = None
+
+    @staticmethod
+    def currencies(symbol):
+        return symbol[:3], symbol[3:6]
+
+
+    ''' U P D A T E S '''
+
+    # side: 1 long, -1 short; sign: 1 adds the volume, -1 removes it
+    def _apply(self, symbol, side, volume, price, sign=1):
+        base, quote = self.currencies(symbol)
+        units = volume * self.contract_sizes.get(symbol, self.contract_size)
+        self.symbol_net[symbol] = self.symbol_net.get(symbol, 0.0) + sign * side * volume
+        self.symbol_gross[symbol] = self.symbol_gross.get(symbol, 0.0) + sign * volume
+        self.currency[base] = self.currency.get(base, 0.0) + sign * side * units
+        self.currency[quote] = self.currency.get(quote, 0.0) - sign * side * units * price
+        self.total += sign * volume
+
+    def open(self, ticket, symbol, side, volume, price):
+        with self.lock:
+            self.positions[ticket] = [symbol, side, volume, price]
+            self._apply(symbol, side, volume, price)
+
+    # Close all or part of a position
+    def close(self, ticket, volume=None):
+        with self.lock:
+            position = self.positions.get(ticket)
+            if position is None:
+                return
+            symbol, side, held, price = position
+            volume = held if volume is None else min(volume, held)
+            self._apply(symbol, side, volume, price, sign=-1)
+            position[2] = held - volume
+            if position[2] <= 1e-9:
+                del self.positions[ticket]
+
+    # Update from an order_send request and its result (only executed deals change exposure)
+    def apply_result(self, request, response):
+        if request.get('action') != TRADE_ACTION_DEAL:
+            return
+        if response is None or getattr(response, 'retcode', None) not in DONE_RETCODES:
+            return
+        volume = getattr(response, 'volume', 0) or request.get('volume', 0)
+        if request.get('position'):
+            self.close(request['position'], volume)
+        elif request.get('type') in (0, 1): # market buy / sell opens a position
+            side = 1 if request['type'] == 0 else -1
+            price = getattr(response, 'price', 0) or request.get('price', 0)
+            self.open(getattr(response, 'order', None) or ('order', time.time()), request['symbol'], side, volume, price)
+
+    # Rebuild from one positions_get() snapshot, returns the symbols whose lots drifted
+    def reconcile(self, positions):
+        with self.lock:
+            before = dict(self.symbol_net)
+            self.reset()
+            for pos in positions or ():
+                self.open(pos.ticket, pos.symbol, 1 if pos.type == 0 else -1, pos.volume, pos.price_open)
+            self.reconciled_at = time.monotonic()
+            symbols = set(before) | set(self.symbol_net)
+            return {s: self.symbol_net.get(s, 0.0) - before.get(s, 0.0) for s in symbols
+                    if abs(self.symbol_net.get(s, 0.0) - before.get(s, 0.0)) > 1e-9}
+
+    # Reconcile only when the last snapshot is older than max_age seconds
+    def refresh(self, positions_get, max_age=30):
+        if self.reconciled_at is None or time.monotonic() - self.reconciled_at > max_age:
+            return self.reconcile(positions_get())
+        return {}
+
+
+    ''' Q U E R I E S '''
+
+    def symbol_lots(self, symbol):
+        return self.symbol_net.get(symbol, 0.0)
+
+    def symbol_gross_lots(self, symbol):
+        return self.symbol_gross.get(symbol, 0.0)
+
+    def currency_exposure(self, currency):
+        return self.currency.get(currency, 0.0)
+
+    def total_lots(self):
+        return self.total
+
+    # Reason the order would break a limit, or None
+    def check(self, symbol, side, volume, price):
+        with self.lock:
+            if self.max_total_lots is not None and self.total + volume > self.max_total_lots + 1e-9:
+                return f'total {self.total + volume:.2f} lots over the {self.max_total_lots} limit'
+            if self.max_symbol_lots is not None and self.symbol_gross.get(symbol, 0.0) + volume > self.max_symbol_lots + 1e-9:
+                return f'{symbol} {self.symbol_gross.get(symbol, 0.0) + volume:.2f} lots over the {self.max_symbol_lots} limit'
+            base, quote = self.currencies(symbol)
+            units = volume * self.contract_sizes.get(symbol, self.contract_size)
+            for ccy, delta in ((base, side * units), (quote, -side * units * price)):
+                limit = self.max_currency.get(ccy)
+                if limit is not None and abs(self.currency.get(ccy, 0.0) + delta) > limit:
+                    return f'{ccy} exposure {self.currency.get(ccy, 0.0) + delta:,.0f} over the {limit:,.0f} limit'
+            return None
+
+    def summary(self):
+        with self.lock:
+            lines = [f'Total: {self.total:.2f} lots in {len(self.positions)} positions']
+            for symbol in sorted(s for s, lots in self.symbol_gross.items() if lots > 1e-9):
+                lines.append(f'{symbol}: net {self.symbol_net[symbol]:+.2f} / gross {self.symbol_gross[symbol]:.2f} lots')
+            exposures = sorted(((c, v) for c, v in self.currency.items() if abs(v) > 1e-6), key=lambda cv: -abs(cv[1]))
+            if exposures:
+                lines.append('Currencies:')
+                lines.extend(f'{c}: {v:+,.0f}' for c, v in exposures)
+            return '\n'.join(lines)
@@ -0,0 +1,81 @@
+import collections
+import itertools
+import time
+
+import numpy as np
+
+from bars import BAR_DTYPE
+from retcodes import TRADE_ACTION_DEAL
+import signals
+
+
+# ~~~~~~~ STAND-IN BROKER ~~~~~~~~
+# The MetaTrader5 functions shard.py uses, without a terminal. Every symbol gets a
+# seeded random walk, and copy_rates_from_pos serves a window of it that ends on a
+# bar where the strategy fires, so every scan produces a signal. Orders fill at once
+# and become positions of this process (each worker has its own, like its own terminal).
+#
+#   python shard.py EURUSD GBPUSD --broker fake_broker
+#   python -m pytest tests/test_shard.py  # approve/deny, the global limits and respawn
+
+TIMEFRAME_M5 = 5
+ORDER_TYPE_BUY = 0
+ORDER_TYPE_SELL = 1
+ORDER_TIME_GTC = 0
+ORDER_FILLING_IOC = 1
+TRADE_RETCODE_DONE = 10009
+
+Tick = collections.namedtuple('Tick', 'time bid ask last volume time_msc')
+TradePosition = collections.namedtuple('TradePosition', 'ticket symbol type volume price_open sl tp magic comment')
+OrderSendResult = collections.namedtuple('OrderSendResult', 'retcode deal order volume price bid ask comment request_id')
+
+_positions = []
+_tickets = itertools.count(1)
+_windows = {}
+
+
+def initialize(**account):
+    return True
+
+def shutdown():
+    return True
+
+def last_error():
+    return (1, 'Success')
+
+def _window(symbol, count):
+    if (symbol, count) not in _windows:
+        rng = np.random.default_rng(sum(symbol.encode()))
+        n = count * 20
+        close = 1.0 + np.cumsum(rng.normal(0, 5e-4, n))
+        open_ = np.r_[close[0], close[:-1]]
+        bars = np.zeros(n, dtype=BAR_DTYPE)
+        bars['time'] = 1_700_000_100 - 1_700_000_100 % 300 + 300 * np.arange(n)
+        bars['open'] = open_
+        bars['close'] = close
+        bars['high'] = np.maximum(open_, close) + np.abs(rng.normal(0, 2e-4, n))
+        bars['low'] = np.minimum(open_, close) - np.abs(rng.normal(0, 2e-4, n))
+        bars['tick_volume'] = rng.integers(50, 500, n)
+        fired = np.flatnonzero(signals.signals(bars['open'], bars['high'], bars['low'], bars['close'], bars['tick_volume']))
+        end = fired[fired >= count - 1][0] + 1
+        _windows[symbol, count] = bars[end - count:end]
+    return _windows[symbol, count]
+
+def copy_rates_from_pos(symbol, timeframe, start, count):
+    return _window(symbol, count)
+
+def symbol_info_tick(symbol):
+    close = float(_window(symbol, 400)['close'][-1])
+    return Tick(int(time.time()), close, close + 1e-4, close, 1, int(time.time() * 1000))
+
+def positions_get(symbol=None):
+    return tuple(pos for pos in _positions if symbol is None or pos.symbol == symbol)
+
+def order_send(request):
+    if request['action'] != TRADE_ACTION_DEAL:
+        return None
+    ticket = next(_tickets)
+    _positions.append(TradePosition(ticket, request['symbol'], request['type'], request['volume'], request['price'],
+                                     request['sl'], request['tp'], request['magic'], request['comment']))
+    return OrderSendResult(TRADE_RETCODE_DONE, ticket, ticket, request['volume'], request['price'],
+                           request['price'], request['price'], 'Request executed', 0)
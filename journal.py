@@ -0,0 +1,214 @@
+import atexit
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+import pandas as pd
+
+from retcodes import DONE_RETCODES
+
+
+# ~~~~~~~ TRADE JOURNAL ~~~~~~~~
+# Append-only record of every signal evaluation, order request and broker response.
+# The trading loop only puts rows on a queue; a background thread writes them to
+# SQLite in batches so the loop never waits on disk.
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS signals (
+    id INTEGER PRIMARY KEY,
+    ts REAL,
+    symbol TEXT,
+    bar_time TEXT,
+    signal INTEGER,
+    close REAL,
+    eval_ms REAL,
+    details TEXT
+);
+CREATE TABLE IF NOT EXISTS orders (
+    id INTEGER PRIMARY KEY,
+    ts REAL,
+    kind TEXT,
+    symbol TEXT,
+    order_type INTEGER,
+    volume REAL,
+    req_price REAL,
+    quote REAL,
+    sl REAL,
+    tp REAL,
+    point REAL,
+    retcode INTEGER,
+    deal INTEGER,
+    order_id INTEGER,
+    fill_price REAL,
+    fill_volume REAL,
+    broker_comment TEXT,
+    latency_ms REAL,
+    error TEXT,
+    request TEXT
+);
+CREATE TABLE IF NOT EXISTS errors (
+    id INTEGER PRIMARY KEY,
+    ts REAL,
+    location TEXT,
+    symbol TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS orders_symbol ON orders (symbol);
+CREATE INDEX IF NOT EXISTS signals_symbol ON signals (symbol);
+'''
+
+INSERTS = {
+    'signals': 'INSERT INTO signals (ts, symbol, bar_time, signal, close, eval_ms, details) VALUES (?, ?, ?, ?, ?, ?, ?)',
+    'orders': 'INSERT INTO orders (ts, kind, symbol, order_type, volume, req_price, quote, sl, tp, point, retcode, deal, '
+              'order_id, fill_price, fill_volume, broker_comment, latency_ms, error, request) '
+              'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+    'errors': 'INSERT INTO errors (ts, location, symbol, error) VALUES (?, ?, ?, ?)',
+}
+
+
+class TradeJournal:
+    def __init__(self, path='journal.db', batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.closed = False
+
+        conn = sqlite3.connect(self.path)
+        conn.execute('PRAGMA journal_mode=WAL')  # readers never block the writer
+        conn.executescript(SCHEMA)
+        if 'quote' not in [row[1] for row in conn.execute('PRAGMA table_info(orders)')]:
+            conn.execute('ALTER TABLE orders ADD COLUMN quote REAL')  # journals written before the column existed
+        conn.commit()
+        conn.close()
+
+        self.writer = threading.Thread(target=self._writer_loop, name='journal-writer', daemon=True)
+        self.writer.start()
+        atexit.register(self.close)
+
+
+    ''' W R I T E '''
+
+    # Record the result of one check_signal evaluation
+    def log_signal(self, symbol, signal, bar_time=None, close=None, eval_ms=None, **details):
+        self.queue.put(('signals', (time.time(), symbol, str(bar_time) if bar_time is not None else None,
+                                    int(signal), _float(close), _float(eval_ms), json.dumps(details, default=str))))
+
+    # Record an order request together with the broker response (or the failure).
+    # quote: the price the order could fill at when it was sent, ask for buys and bid for sells
+    def log_order(self, kind, request, response, sent_at, latency_ms, point=None, error=None, quote=None):
+        get = (lambda name: getattr(response, name, None)) if response is not None else (lambda name: None)
+        self.queue.put(('orders', (sent_at, kind, request.get('symbol'), request.get('type'), _float(request.get('volume')),
+                                   _float(request.get('price')), _float(quote), _float(request.get('sl')), _float(request.get('tp')),
+                                   _float(point), get('retcode'), get('deal'), get('order'), _float(get('price')),
+                                   _float(get('volume')), get('comment'), latency_ms, error,
+                                   json.dumps(request, default=str))))
+
+    # Record an exception instead of swallowing it
+    def log_error(self, location, symbol, error):
+        self.queue.put(('errors', (time.time(), location, symbol, repr(error))))
+
+    # Flush what is queued and stop the writer
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.queue.put(None)
+        self.writer.join(timeout=10)
+
+    def _writer_loop(self):
+        conn = sqlite3.connect(self.path)
+        running = True
+        while running:
+            batch = {}
+            deadline = time.monotonic() + self.flush_interval
+            count = 0
+            while count < self.batch_size:
+                try:
+                    item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                table, row = item
+                batch.setdefault(table, []).append(row)
+                count += 1
+            if batch:
+                try:
+                    with conn:
+                        for table, rows in batch.items():
+                            conn.executemany(INSERTS[table], rows)
+                except sqlite3.Error as e:
+                    print(f'Journal write failed: {e}')
+        conn.close()
+
+
+    ''' Q U E R Y '''
+
+    def _read(self, sql, params=()):
+        conn = sqlite3.connect(self.path)
+        try:
+            return pd.read_sql_query(sql, conn, params=params)
+        finally:
+            conn.close()
+
+    def orders(self, symbol=None, kind=None):
+        sql = 'SELECT * FROM orders WHERE 1=1'
+        params = []
+        if symbol:
+            sql += ' AND symbol = ?'
+            params.append(symbol)
+        if kind:
+            sql += ' AND kind = ?'
+            params.append(kind)
+        return self._read(sql + ' ORDER BY ts', params)
+
+    def signals(self, symbol=None):
+        if symbol:
+            return self._read('SELECT * FROM signals WHERE symbol = ? ORDER BY ts', (symbol,))
+        return self._read('SELECT * FROM signals ORDER BY ts')
+
+    # Per-symbol order_send round trip in milliseconds
+    def fill_latency_report(self, symbol=None):
+        df = self.orders(symbol)
+        if df.empty:
+            return df
+        grouped = df.groupby('symbol')['latency_ms']
+        report = pd.DataFrame({
+            'orders': grouped.count(),
+            'mean_ms': grouped.mean(),
+            'median_ms': grouped.median(),
+            'p95_ms': grouped.quantile(0.95),
+            'max_ms': grouped.max(),
+            'rejected': df[~df['retcode'].isin(DONE_RETCODES)].groupby('symbol').size(),
+        })
+        report['rejected'] = report['rejected'].fillna(0).astype(int)
+        return report.sort_values('mean_ms', ascending=False)
+
+    # Per-symbol slippage in points between the quote at send time (ask for buys, bid for
+    # sells) and the filled price, so the spread is not counted. Positive means the fill
+    # was worse than quoted.
+    def slippage_report(self, symbol=None):
+        df = self.orders(symbol)
+        df = df[df['retcode'].isin(DONE_RETCODES) & df['fill_price'].gt(0) & df['quote'].gt(0) & df['point'].gt(0)]
+        if df.empty:
+            return df
+        # order type 0 == buy, 1 == sell
+        direction = df['order_type'].map({0: 1.0, 1: -1.0})
+        df = df.assign(slippage_pts=(df['fill_price'] - df['quote']) / df['point'] * direction)
+        grouped = df.groupby('symbol')['slippage_pts']
+        report = pd.DataFrame({
+            'fills': grouped.count(),
+            'mean_pts': grouped.mean(),
+            'median_pts': grouped.median(),
+            'worst_pts': grouped.max(),
+            'best_pts': grouped.min(),
+        })
+        return report.sort_values('mean_pts', ascending=False)
+
+
+def _float(value):
+    return float(value) if value is not None else None
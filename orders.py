@@ -0,0 +1,91 @@
+import hashlib
+import threading
+import time
+
+from retcodes import DONE_RETCODES
+
+
+# ~~~~~~~ ORDER GUARD ~~~~~~~~
+# Stops the same entry from being sent twice when scans overlap. Each symbol has a
+# lock held while an order is submitted. Each signal gets an idempotency key from
+# (symbol, side, signal bar), sent to the broker in the order comment. After a fill
+# the symbol stays pending until the position shows up in positions_get, so a scan
+# working from older data cannot enter again.
+
+
+class OrderGuard:
+    def __init__(self, magic, prefix='Alfris', fill_timeout=30, key_ttl=3600):
+        self.magic = magic
+        self.prefix = prefix
+        self.fill_timeout = fill_timeout # seconds to wait for a filled order to appear as a position
+        self.key_ttl = key_ttl
+        self.locks = {}
+        self.locks_lock = threading.Lock()
+        self.pending = {} # symbol -> {'key', 'comment', 'side', 'sent'}
+        self.sent = {} # idempotency key -> time sent
+
+    def _lock(self, symbol):
+        with self.locks_lock:
+            return self.locks.setdefault(symbol, threading.Lock())
+
+    def key(self, symbol, side, bar_time):
+        return hashlib.sha1(f'{symbol}|{side}|{bar_time}'.encode()).hexdigest()[:8]
+
+    # Order comment carrying the key (mt5 keeps up to 31 characters)
+    def comment(self, key):
+        return f'{self.prefix}-{key}'
+
+    def _on_broker(self, symbol, comment, positions_get, orders_get):
+        for get in (positions_get, orders_get):
+            if get is None:
+                continue
+            for item in get(symbol=symbol) or ():
+                if item.magic == self.magic and item.comment == comment:
+                    return True
+        return False
+
+    # False while an order for the symbol is in flight or filled but not yet visible
+    def can_enter(self, symbol, positions_get=None, orders_get=None):
+        pending = self.pending.get(symbol)
+        if pending is None:
+            return True
+        if self._on_broker(symbol, pending['comment'], positions_get, orders_get):
+            del self.pending[symbol] # confirmed, the open position now blocks re-entry itself
+            return False
+        if time.monotonic() - pending['sent'] > self.fill_timeout:
+            del self.pending[symbol]
+            return True
+        return False
+
+    # Submit through send(comment) unless the same signal was already sent or the symbol
+    # is busy. Returns (response, None) or (None, reason it was not sent).
+    def submit(self, symbol, side, bar_time, send, positions_get=None, orders_get=None):
+        key = self.key(symbol, side, bar_time)
+        comment = self.comment(key)
+        lock = self._lock(symbol)
+        if not lock.acquire(blocking=False):
+            return None, 'another order for the symbol is being submitted'
+        try:
+            now = time.monotonic()
+            self.sent = {k: t for k, t in self.sent.items() if now - t < self.key_ttl}
+            if not self.can_enter(symbol, positions_get, orders_get):
+                return None, 'previous order still pending fill'
+            if key in self.sent:
+                return None, f'signal {key} already sent'
+            if self._on_broker(symbol, comment, positions_get, orders_get):
+                self.sent[key] = now
+                return None, f'signal {key} already on the broker'
+
+            self.sent[key] = now
+            self.pending[symbol] = {'key': key, 'comment': comment, 'side': side, 'sent': now}
+            response = send(comment)
+            if response is None or getattr(response, 'retcode', None) not in DONE_RETCODES:
+                # rejected: nothing is pending and the same signal may be retried
+                self.pending.pop(symbol, None)
+                self.sent.pop(key, None)
+            return response, None
+        finally:
+            lock.release()
+
+    def in_flight(self):
+        return dict(self.pending)
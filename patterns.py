@@ -0,0 +1,97 @@
+import numpy as np
+
+
+# ~~~~~~~ CANDLE PATTERNS ~~~~~~~~
+# Every pattern is evaluated for every bar in one pass and stored as one bit of a
+# per-bar uint16 mask. Like signals.py, everything works on the last axis, so a
+# (symbols, bars) array gives a (symbols, bars) mask. A bit at index i means the
+# pattern completes on bar i (multi-candle patterns look back from i).
+
+BULL_ENGULFING = 1 << 0
+BEAR_ENGULFING = 1 << 1
+BULL_PIN = 1 << 2       # hammer: long lower wick, small body near the high
+BEAR_PIN = 1 << 3       # shooting star: long upper wick, small body near the low
+INSIDE_BAR = 1 << 4
+OUTSIDE_BAR = 1 << 5
+DOJI = 1 << 6
+BULL_MARUBOZU = 1 << 7
+BEAR_MARUBOZU = 1 << 8
+BULL_HARAMI = 1 << 9
+BEAR_HARAMI = 1 << 10
+MORNING_STAR = 1 << 11
+EVENING_STAR = 1 << 12
+
+PATTERNS = {
+    'bull_engulfing': BULL_ENGULFING,
+    'bear_engulfing': BEAR_ENGULFING,
+    'bull_pin': BULL_PIN,
+    'bear_pin': BEAR_PIN,
+    'inside_bar': INSIDE_BAR,
+    'outside_bar': OUTSIDE_BAR,
+    'doji': DOJI,
+    'bull_marubozu': BULL_MARUBOZU,
+    'bear_marubozu': BEAR_MARUBOZU,
+    'bull_harami': BULL_HARAMI,
+    'bear_harami': BEAR_HARAMI,
+    'morning_star': MORNING_STAR,
+    'evening_star': EVENING_STAR,
+}
+
+BULLISH = BULL_ENGULFING | BULL_PIN | BULL_MARUBOZU | BULL_HARAMI | MORNING_STAR
+BEARISH = BEAR_ENGULFING | BEAR_PIN | BEAR_MARUBOZU | BEAR_HARAMI | EVENING_STAR
+
+
+# Previous value along the last axis (NaN for the first bar)
+def _prev(x, n=1):
+    out = np.full(x.shape, np.nan)
+    out[..., n:] = x[..., :-n]
+    return out
+
+def pattern_mask(open_, high, low, close, doji_body=0.1, pin_body=0.35, pin_wick=2.0, marubozu_body=0.9):
+    o, h, l, c = (np.asarray(x, dtype=float) for x in (open_, high, low, close))
+    o1, h1, l1, c1 = _prev(o), _prev(h), _prev(l), _prev(c)
+    o2, c2 = _prev(o, 2), _prev(c, 2)
+
+    body = np.abs(c - o)
+    rng = h - l
+    upper = h - np.maximum(o, c)
+    lower = np.minimum(o, c) - l
+    bull, bear = c > o, c < o
+    bull1, bear1 = c1 > o1, c1 < o1
+    body1 = np.abs(c1 - o1)
+    small = body <= doji_body * rng
+
+    patterns = (
+        # the last candle opens at or beyond the previous close and closes past its open
+        (BULL_ENGULFING, bear1 & bull & (o <= c1) & (c > o1) & (h > h1)),
+        (BEAR_ENGULFING, bull1 & bear & (o >= c1) & (c < o1) & (l < l1)),
+        # the wick is `pin_wick` times both the body and the other wick; the body limit is
+        # the pins' own, so a pin with a doji-sized body is still a pin
+        (BULL_PIN, (body <= pin_body * rng) & (lower >= pin_wick * np.maximum(body, upper)) & (rng > 0)),
+        (BEAR_PIN, (body <= pin_body * rng) & (upper >= pin_wick * np.maximum(body, lower)) & (rng > 0)),
+        (INSIDE_BAR, (h < h1) & (l > l1)),
+        (OUTSIDE_BAR, (h > h1) & (l < l1)),
+        (DOJI, small & (rng > 0)),
+        (BULL_MARUBOZU, bull & (body >= marubozu_body * rng)),
+        (BEAR_MARUBOZU, bear & (body >= marubozu_body * rng)),
+        (BULL_HARAMI, bear1 & bull & (o > c1) & (c < o1)),
+        (BEAR_HARAMI, bull1 & bear & (o < c1) & (c > o1)),
+        # long candle, small candle, long candle back past the middle of the first
+        (MORNING_STAR, (c2 < o2) & (body1 <= 0.3 * np.abs(c2 - o2)) & bull & (c > (o2 + c2) / 2)),
+        (EVENING_STAR, (c2 > o2) & (body1 <= 0.3 * np.abs(c2 - o2)) & bear & (c < (o2 + c2) / 2)),
+    )
+    mask = np.zeros(c.shape, dtype=np.uint16)
+    for bit, hit in patterns:
+        mask |= np.where(hit, bit, 0).astype(np.uint16)
+    return mask
+
+# Mask straight from a bar array (bars.BAR_DTYPE or broker rates)
+def bar_patterns(bars, **options):
+    return pattern_mask(bars['open'], bars['high'], bars['low'], bars['close'], **options)
+
+# Indices of the bars that have any of the pattern bits
+def find(mask, bits):
+    return np.flatnonzero(mask & bits)
+
+def names(bits):
+    return [name for name, bit in PATTERNS.items() if bits & bit]
@@ -0,0 +1,215 @@
+import atexit
+import collections
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+
+
+# ~~~~~~~ BROKER RECORD / REPLAY ~~~~~~~~
+# RecordingBroker wraps the MetaTrader5 module and writes every call, its arguments,
+# result and latency to a compact binary log. ReplayBroker reads that log back and
+# behaves like the module (same functions and constants), at full speed or with the
+# original timing, so a session can be profiled on a machine without a terminal.
+#
+# Log: MAGIC, then frames of <uint32 length><zlib(pickle)>. The first frame holds the
+# module constants, the others (name, args, kwargs, result, started, latency, error).
+# mt5 result types are namedtuples; they are stored as plain (type, fields, values)
+# so the log can be read without the MetaTrader5 package.
+
+MAGIC = b'ALFREC1\n'
+FRAME = struct.Struct('<I')
+
+
+class _Record:
+    __slots__ = ('type_name', 'fields', 'values')
+
+    def __init__(self, type_name, fields, values):
+        self.type_name = type_name
+        self.fields = fields
+        self.values = values
+
+def _pack(value):
+    if hasattr(value, '_asdict') and hasattr(value, '_fields'):
+        return _Record(type(value).__name__, tuple(value._fields), tuple(_pack(v) for v in value))
+    if isinstance(value, tuple):
+        return tuple(_pack(v) for v in value)
+    if isinstance(value, list):
+        return [_pack(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _pack(v) for k, v in value.items()}
+    return value
+
+_types = {}
+
+def _unpack(value):
+    if isinstance(value, _Record):
+        key = (value.type_name, value.fields)
+        if key not in _types:
+            _types[key] = collections.namedtuple(value.type_name, value.fields)
+        return _types[key](*(_unpack(v) for v in value.values))
+    if isinstance(value, tuple):
+        return tuple(_unpack(v) for v in value)
+    if isinstance(value, list):
+        return [_unpack(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _unpack(v) for k, v in value.items()}
+    return value
+
+def read_frames(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f'{path} is not a broker recording')
+        while True:
+            head = f.read(FRAME.size)
+            if len(head) < FRAME.size:
+                return
+            (size,) = FRAME.unpack(head)
+            data = f.read(size)
+            if len(data) < size:
+                return # last frame cut short by a crash
+            yield pickle.loads(zlib.decompress(data))
+
+
+''' R E C O R D '''
+
+class RecordingBroker:
+    def __init__(self, module, path, level=1):
+        self._module = module
+        self._level = level
+        self._lock = threading.Lock()
+        self._file = open(path, 'wb')
+        self._file.write(MAGIC)
+        self._t0 = time.perf_counter()
+        constants = {name: getattr(module, name) for name in dir(module)
+                     if name.isupper() and isinstance(getattr(module, name), (int, float, str))}
+        self._write({'constants': constants, 'started': time.time()})
+        self._wrapped = {}
+        atexit.register(self.close)
+
+    def _write(self, frame):
+        data = zlib.compress(pickle.dumps(frame, protocol=pickle.HIGHEST_PROTOCOL), self._level)
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(FRAME.pack(len(data)))
+                self._file.write(data)
+
+    def __getattr__(self, name):
+        attr = getattr(self._module, name)
+        if not callable(attr):
+            return attr
+        if name not in self._wrapped:
+            def call(*args, **kwargs):
+                started = time.perf_counter()
+                error = None
+                result = None
+                try:
+                    result = attr(*args, **kwargs)
+                    return result
+                except Exception as e:
+                    error = e
+                    raise
+                finally:
+                    latency = time.perf_counter() - started
+                    self._write((name, _pack(args), _pack(kwargs), _pack(result), started - self._t0, latency,
+                                 repr(error) if error else None))
+            self._wrapped[name] = call
+        return self._wrapped[name]
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+''' R E P L A Y '''
+
+class ReplayBroker:
+    # speed: None replays at full speed, 1.0 with the original timing, 2.0 twice as fast...
+    def __init__(self, path, speed=None):
+        frames = read_frames(path)
+        header = next(frames)
+        self._constants = header['constants']
+        self._calls = list(frames)
+        self._speed = speed
+        self._by_key = collections.defaultdict(collections.deque)
+        self._by_name = collections.defaultdict(collections.deque)
+        for i, (name, args, kwargs, *_rest) in enumerate(self._calls):
+            self._by_key[self._key(name, args, kwargs)].append(i)
+            self._by_name[name].append(i)
+        self._used = set()
+        self._start = None
+        self.stats = collections.Counter()
+
+    @staticmethod
+    def _key(name, args, kwargs):
+        return name, repr(args), repr(sorted(kwargs.items()))
+
+    # Next unused recorded call with the same arguments, else the next one of the same function
+    def _next(self, name, args, kwargs):
+        for queue, kind in ((self._by_key[self._key(name, _pack(args), _pack(kwargs))], 'matched'),
+                            (self._by_name[name], 'mismatched')):
+            while queue and queue[0] in self._used:
+                queue.popleft()
+            if queue:
+                i = queue.popleft()
+                self._used.add(i)
+                self.stats[kind] += 1
+                return self._calls[i]
+        self.stats['missing'] += 1
+        return None
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name in self._constants:
+            return self._constants[name]
+
+        def call(*args, **kwargs):
+            frame = self._next(name, args, kwargs)
+            if frame is None:
+                raise LookupError(f'No recorded call left for {name}{args}')
+            _name, _args, _kwargs, result, started, latency, error = frame
+            if self._speed:
+                if self._start is None:
+                    self._start = time.perf_counter() - started / self._speed
+                wait = self._start + (started + latency) / self._speed - time.perf_counter()
+                if wait > 0:
+                    time.sleep(wait)
+            if error:
+                raise RuntimeError(f'recorded {name} failed: {error}')
+            return _unpack(result)
+        return call
+
+    def remaining(self):
+        return len(self._calls) - len(self._used)
+
+
+# The broker module for Bot.py and the dashboard:
+# ALFRIS_REPLAY=log replays a recording (ALFRIS_REPLAY_SPEED=1 for the original timing),
+# ALFRIS_RECORD=log records the live MetaTrader5 session, otherwise MetaTrader5 itself.
+def broker_from_env():
+    if os.environ.get('ALFRIS_REPLAY'):
+        return ReplayBroker(os.environ['ALFRIS_REPLAY'], speed=float(os.environ.get('ALFRIS_REPLAY_SPEED', 0)) or None)
+    import MetaTrader5
+    if os.environ.get('ALFRIS_RECORD'):
+        return RecordingBroker(MetaTrader5, os.environ['ALFRIS_RECORD'])
+    return MetaTrader5
+
+# Calls, total and mean latency per function of a recording
+def summary(path):
+    import pandas as pd
+    frames = read_frames(path)
+    next(frames)
+    rows = [(name, latency * 1000, error is not None) for name, _a, _k, _r, _s, latency, error in frames]
+    df = pd.DataFrame(rows, columns=['function', 'latency_ms', 'error'])
+    return df.groupby('function').agg(calls=('latency_ms', 'size'), total_ms=('latency_ms', 'sum'),
+                                      mean_ms=('latency_ms', 'mean'), max_ms=('latency_ms', 'max'),
+                                      errors=('error', 'sum')).sort_values('total_ms', ascending=False)
+
+
+if __name__ == '__main__':
+    import sys
+    print(summary(sys.argv[1]).to_string())
@@ -0,0 +1,9 @@
+# ~~~~~~~ BROKER CODES ~~~~~~~~
+# mt5 values the bot's modules share, kept in one place so they cannot disagree
+# and none of them needs MetaTrader5 to import.
+
+# retcodes that mean the order was executed
+DONE_RETCODES = (10008, 10009, 10010)  # PLACED, DONE, DONE_PARTIAL
+
+# order_send action that opens or closes a position at market
+TRADE_ACTION_DEAL = 1
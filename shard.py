@@ -0,0 +1,285 @@
+import importlib
+import multiprocessing as mp
+import queue
+import time
+
+from bars import as_bars
+from retcodes import DONE_RETCODES
+import signals
+
+
+# ~~~~~~~ SHARDED EXECUTION ~~~~~~~~
+# One MetaTrader5 connection serializes every call, so the symbol list is split
+# across worker processes, each with its own broker connection (and optionally its
+# own account). Workers scan their shard and ask the coordinator before opening a
+# position; the coordinator enforces the global limits and moves the shard of a
+# dead worker to the survivors.
+#
+# The broker is given as a module name so a stand-in module with the same
+# functions as MetaTrader5 can be used for testing.
+
+DEFAULT_SETTINGS = {
+    'bars': 400,
+    'volume': 0.01,
+    'magic': 2022,
+    'comment': 'Alfris',
+    'deviation': 20,
+    'interval': 28, # seconds between scans of the shard
+    'approval_timeout': 10,
+}
+
+
+''' W O R K E R '''
+
+def worker_main(worker_id, broker_module, account, inbox, outbox, settings):
+    broker = importlib.import_module(broker_module)
+    if not (broker.initialize(**account) if account else broker.initialize()):
+        outbox.put(('error', worker_id, {'where': 'initialize', 'error': str(broker.last_error())}))
+        return
+
+    symbols = []
+    awaiting = {} # symbol -> time the signal was sent to the coordinator
+    running = True
+    next_scan = 0
+
+    while running:
+        # messages from the coordinator
+        try:
+            while True:
+                kind, payload = inbox.get(timeout=0.2)
+                if kind == 'assign':
+                    symbols = list(payload)
+                    next_scan = 0
+                elif kind == 'approve':
+                    awaiting.pop(payload['symbol'], None)
+                    outbox.put(('fill', worker_id, _open_position(broker, payload, settings)))
+                elif kind == 'deny':
+                    awaiting.pop(payload['symbol'], None)
+                elif kind == 'stop':
+                    running = False
+                    break
+        except queue.Empty:
+            pass
+
+        if not running or time.monotonic() < next_scan:
+            continue
+        next_scan = time.monotonic() + settings['interval']
+
+        positions = broker.positions_get() or ()
+        held = {pos.symbol for pos in positions}
+        for symbol in symbols:
+            if symbol in held or time.monotonic() - awaiting.get(symbol, -1e9) < settings['approval_timeout']:
+                continue
+            try:
+                bars = as_bars(broker.copy_rates_from_pos(symbol, broker.TIMEFRAME_M5, 0, settings['bars']))
+                if len(bars) < 60:
+                    continue
+                signal = signals.last_signal(bars)
+                if signal != 0:
+                    tp_buy, sl_buy, tp_sell, sl_sell = signals.atr_levels(bars['high'], bars['low'], bars['close'])
+                    awaiting[symbol] = time.monotonic()
+                    outbox.put(('signal', worker_id, {
+                        'symbol': symbol, 'signal': signal, 'volume': settings['volume'],
+                        'tp': tp_buy if signal == 1 else tp_sell, 'sl': sl_buy if signal == 1 else sl_sell}))
+            except Exception as e:
+                outbox.put(('error', worker_id, {'where': 'scan', 'symbol': symbol, 'error': repr(e)}))
+
+        mine = [pos for pos in positions if pos.symbol in symbols]
+        outbox.put(('report', worker_id, {
+            'symbols': symbols,
+            'positions': [(pos.symbol, pos.type, pos.volume) for pos in mine],
+            'exposure': sum(pos.volume for pos in mine),
+        }))
+
+    broker.shutdown()
+
+def _open_position(broker, order, settings):
+    symbol = order['symbol']
+    tick = broker.symbol_info_tick(symbol)
+    request = {
+        "action": broker.TRADE_ACTION_DEAL,
+        "symbol": symbol,
+        "volume": order['volume'],
+        "type": broker.ORDER_TYPE_BUY if order['signal'] == 1 else broker.ORDER_TYPE_SELL,
+        "price": tick.ask if order['signal'] == 1 else tick.bid,
+        "sl": float(order['sl']),
+        "tp": float(order['tp']),
+        "deviation": settings['deviation'],
+        "magic": settings['magic'],
+        "comment": settings['comment'],
+        "type_time": broker.ORDER_TIME_GTC,
+        "type_filling": broker.ORDER_FILLING_IOC,}
+    response = broker.order_send(request)
+    return {
+        'symbol': symbol,
+        'signal': order['signal'],
+        'volume': order['volume'],
+        'retcode': getattr(response, 'retcode', None),
+        'price': getattr(response, 'price', None),
+        'error': None if response is not None else str(broker.last_error()),
+    }
+
+
+''' C O O R D I N A T O R '''
+
+class Coordinator:
+    def __init__(self, broker_module, symbols, workers=4, accounts=None, max_positions=10, max_lots=1.0,
+                 heartbeat_timeout=90, respawn=True, settings=None, on_event=None):
+        self.broker_module = broker_module
+        self.symbols = list(symbols)
+        self.accounts = accounts or [None] # one group of workers per account, each group scans every symbol
+        self.workers_per_account = workers
+        self.max_positions = max_positions
+        self.max_lots = max_lots
+        self.heartbeat_timeout = heartbeat_timeout
+        self.respawn = respawn
+        self.settings = dict(DEFAULT_SETTINGS, **(settings or {}))
+        self.on_event = on_event or (lambda kind, worker_id, payload: print(kind, worker_id, payload))
+
+        self.ctx = mp.get_context()
+        self.outbox = self.ctx.Queue()
+        self.workers = {} # worker_id -> {'process', 'inbox', 'account', 'symbols', 'seen', 'positions', 'exposure'}
+        self.in_flight = {} # (account index, symbol) -> volume approved but not yet reported filled
+        self.restarts = 0
+        self.spawned = 0
+
+    def start(self):
+        for account_index in range(len(self.accounts)):
+            for n in range(self.workers_per_account):
+                self._spawn(account_index)
+            self.rebalance(account_index)
+
+    def _spawn(self, account_index):
+        # ids are never reused, so late messages from a dead worker are ignored
+        worker_id = f'{account_index}-{self.spawned}'
+        self.spawned += 1
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(target=worker_main, name=f'alfris-{worker_id}', daemon=True,
+                                   args=(worker_id, self.broker_module, self.accounts[account_index], inbox,
+                                         self.outbox, self.settings))
+        process.start()
+        self.workers[worker_id] = {'process': process, 'inbox': inbox, 'account': account_index, 'symbols': [],
+                                   'seen': time.monotonic(), 'positions': [], 'exposure': 0.0}
+
+    # Spread the symbols of one account evenly over its live workers
+    def rebalance(self, account_index):
+        live = sorted(wid for wid, w in self.workers.items() if w['account'] == account_index)
+        if not live:
+            return
+        for n, wid in enumerate(live):
+            shard = self.symbols[n::len(live)]
+            self.workers[wid]['symbols'] = shard
+            self.workers[wid]['inbox'].put(('assign', shard))
+
+
+    ''' G L O B A L   L I M I T S '''
+
+    def open_positions(self):
+        return sum(len(w['positions']) for w in self.workers.values()) + len(self.in_flight)
+
+    def total_lots(self):
+        return sum(w['exposure'] for w in self.workers.values()) + sum(self.in_flight.values())
+
+    def exposure(self):
+        return {wid: {'symbols': w['symbols'], 'positions': w['positions'], 'exposure': w['exposure']}
+                for wid, w in self.workers.items()}
+
+    def _check_limits(self, account_index, order):
+        key = (account_index, order['symbol'])
+        held = any(pos[0] == order['symbol'] for w in self.workers.values() if w['account'] == account_index
+                   for pos in w['positions'])
+        if held or key in self.in_flight:
+            return 'position already open or in flight'
+        if self.open_positions() + 1 > self.max_positions:
+            return f'max positions {self.max_positions} reached'
+        if self.total_lots() + order['volume'] > self.max_lots:
+            return f'max lots {self.max_lots} reached'
+        return None
+
+
+    ''' L O O P '''
+
+    def handle(self, kind, worker_id, payload):
+        worker = self.workers.get(worker_id)
+        if worker is None:
+            return # message from a worker that was already replaced
+        worker['seen'] = time.monotonic()
+
+        if kind == 'signal':
+            reason = self._check_limits(worker['account'], payload)
+            if reason is None:
+                self.in_flight[(worker['account'], payload['symbol'])] = payload['volume']
+                worker['inbox'].put(('approve', payload))
+            else:
+                payload = dict(payload, reason=reason)
+                worker['inbox'].put(('deny', payload))
+        elif kind == 'fill':
+            self.in_flight.pop((worker['account'], payload['symbol']), None)
+            if payload['retcode'] in DONE_RETCODES:
+                worker['positions'].append((payload['symbol'], 0 if payload['signal'] == 1 else 1, payload['volume']))
+                worker['exposure'] += payload['volume']
+        elif kind == 'report':
+            worker['positions'] = payload['positions']
+            worker['exposure'] = payload['exposure']
+        self.on_event(kind, worker_id, payload)
+
+    # Replace workers that exited or stopped reporting, moving their symbols meanwhile
+    def check_workers(self):
+        now = time.monotonic()
+        for worker_id, worker in list(self.workers.items()):
+            stale = now - worker['seen'] > self.heartbeat_timeout
+            if worker['process'].is_alive() and not stale:
+                continue
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+            worker['process'].join(timeout=5)
+            account_index = worker['account']
+            del self.workers[worker_id]
+            self.in_flight = {k: v for k, v in self.in_flight.items() if k[0] != account_index or k[1] not in worker['symbols']}
+            self.on_event('worker_died', worker_id, {'symbols': worker['symbols'], 'exitcode': worker['process'].exitcode})
+            if self.respawn:
+                self._spawn(account_index)
+                self.restarts += 1
+            self.rebalance(account_index)
+
+    def run(self, duration=None, check_every=5):
+        if not self.workers:
+            self.start()
+        end = time.monotonic() + duration if duration else None
+        next_check = time.monotonic() + check_every
+        try:
+            while end is None or time.monotonic() < end:
+                try:
+                    kind, worker_id, payload = self.outbox.get(timeout=0.5)
+                    self.handle(kind, worker_id, payload)
+                except queue.Empty:
+                    pass
+                if time.monotonic() >= next_check:
+                    self.check_workers()
+                    next_check = time.monotonic() + check_every
+        finally:
+            self.stop()
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker['inbox'].put(('stop', None))
+        for worker in self.workers.values():
+            worker['process'].join(timeout=5)
+            if worker['process'].is_alive():
+                worker['process'].terminate()
+        self.workers.clear()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Scan symbols with several MetaTrader5 connections')
+    parser.add_argument('symbols', nargs='+')
+    parser.add_argument('--broker', default='MetaTrader5', help='module with the MetaTrader5 functions')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-positions', type=int, default=10)
+    parser.add_argument('--max-lots', type=float, default=1.0)
+    args = parser.parse_args()
+
+    Coordinator(args.broker, args.symbols, workers=args.workers, max_positions=args.max_positions,
+                max_lots=args.max_lots).run()
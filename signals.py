@@ -0,0 +1,154 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+# ~~~~~~~ VECTORIZED STRATEGY RULES ~~~~~~~~
+# The rules of Alfris.check_signal evaluated for every bar at once. All functions
+# work on the last axis, so the same code handles one symbol (bars,) or many
+# (symbols, bars). Index t is the row that is still forming in check_signal, so the
+# signal at t uses the candles at t-1 (last closed, iloc[-2]) and t-2 (iloc[-3]).
+
+SUPPLY = 1
+DEMAND = -1
+
+
+''' R O L L I N G   W I N D O W S '''
+
+# Rolling reduction over the last axis; the first window-1 values are NaN like pandas
+def _rolling(x, window, reduce):
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = reduce(sliding_window_view(x, window, axis=-1), axis=-1)
+    return out
+
+def rolling_max(x, window):
+    return _rolling(x, window, np.max)
+
+def rolling_min(x, window):
+    return _rolling(x, window, np.min)
+
+def rolling_mean(x, window):
+    return _rolling(x, window, np.mean)
+
+def rolling_sum(x, window):
+    return _rolling(x, window, np.sum)
+
+# Position (absolute index) of the max over the trailing window, NaNs ignored
+def rolling_argmax(x, window):
+    x = np.where(np.isnan(x), -np.inf, np.asarray(x, dtype=float))
+    out = np.zeros(x.shape, dtype=np.int64)
+    if x.shape[-1] >= window:
+        out[..., window - 1:] = sliding_window_view(x, window, axis=-1).argmax(axis=-1) + np.arange(x.shape[-1] - window + 1)
+    return out
+
+
+''' I N D I C A T O R S '''
+
+# Supply_Demand_by_candles: SUPPLY where the high makes the rolling high, else DEMAND where the low makes the rolling low
+def supply_demand(high, low, window):
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    labels = np.zeros(high.shape, dtype=np.int8)
+    labels[low <= rolling_min(low, window)] = DEMAND
+    labels[high >= rolling_max(high, window)] = SUPPLY
+    return labels
+
+# Liquidity_pool: close weighted by its share of the rolling tick volume
+def liquidity(close, tick_volume, window=30):
+    tick_volume = np.asarray(tick_volume, dtype=float)
+    return np.asarray(close, dtype=float) * tick_volume / rolling_sum(tick_volume, window)
+
+# ATR: rolling mean of the true range
+def atr(high, low, close, window=6):
+    high = np.asarray(high, dtype=float)
+    low = np.asarray(low, dtype=float)
+    prev_close = np.concatenate([np.full(high.shape[:-1] + (1,), np.nan), np.asarray(close, dtype=float)[..., :-1]], axis=-1)
+    tr = np.fmax(high - low, np.fmax(np.abs(high - prev_close), np.abs(prev_close - low)))
+    return rolling_mean(tr, window)
+
+
+''' S I G N A L S '''
+
+# check_signal for every bar: 1 long, -1 short, 0 nothing
+def signals(open_, high, low, close, tick_volume, sd_fast=20, sd_slow=50, liq_window=30, liq_lookback=20):
+    open_ = np.asarray(open_, dtype=float)
+    close = np.asarray(close, dtype=float)
+    fast = supply_demand(high, low, sd_fast)
+    slow = supply_demand(high, low, sd_slow)
+
+    # close of the most liquid candle in the last `liq_lookback` rows must be the close of t-2
+    liq_row = rolling_argmax(liquidity(close, tick_volume, liq_window), liq_lookback)
+    liq_close = np.take_along_axis(close, liq_row, axis=-1)
+
+    out = np.zeros(close.shape, dtype=np.int8)
+    if close.shape[-1] < 3:
+        return out
+    bull_1 = close[..., 1:-1] > open_[..., 1:-1]
+    bear_1 = close[..., 1:-1] < open_[..., 1:-1]
+    liq_ok = liq_close[..., 2:] == close[..., :-2]
+
+    long_ = (slow[..., :-2] == DEMAND) & (fast[..., :-2] == DEMAND) & bull_1 & (fast[..., 1:-1] != DEMAND) & liq_ok
+    short = (slow[..., :-2] == SUPPLY) & (fast[..., :-2] == SUPPLY) & bear_1 & (fast[..., 1:-1] != SUPPLY) & liq_ok
+    out[..., 2:][long_] = 1
+    out[..., 2:][short] = -1
+    return out
+
+# check_reverse_signal for every bar: labels of the last closed candle (t-1) agree on both windows
+def reverse_signals(high, low, sd_fast=20, sd_slow=50):
+    fast = supply_demand(high, low, sd_fast)
+    slow = supply_demand(high, low, sd_slow)
+    out = np.zeros(fast.shape, dtype=np.int8)
+    out[..., 1:][(slow[..., :-1] == DEMAND) & (fast[..., :-1] == DEMAND)] = 1
+    out[..., 1:][(slow[..., :-1] == SUPPLY) & (fast[..., :-1] == SUPPLY)] = -1
+    return out
+
+# ATR take profit / stop loss from the last closed candle, as Alfris.ATR: [TP_buy, SL_buy, TP_sell, SL_sell]
+def atr_levels(high, low, close, atr_window=6, tp=1.5, sl=2.2):
+    a = atr(high, low, close, atr_window)[..., -2]
+    c = np.asarray(close, dtype=float)[..., -2]
+    return np.stack([c + a * tp, c - a * sl, c - a * tp, c + a * sl], axis=-1)
+
+# Signal of the latest row of a bar array (the same answer check_signal gives on that window)
+def last_signal(bars, **params):
+    return int(signals(bars['open'], bars['high'], bars['low'], bars['close'], bars['tick_volume'], **params)[..., -1])
+
+# Multi timeframe confirmation of check_signal: the last closed higher timeframe candle
+# (second to last row, the last one is forming) must point the same way as the signal
+def htf_confirms(signal, htf):
+    if len(htf) < 2:
+        return False
+    o, c = np.asarray(htf['open'], dtype=float)[-2], np.asarray(htf['close'], dtype=float)[-2]
+    return bool((signal == 1 and c > o) or (signal == -1 and c < o))
+
+
+''' C R O S S - S E C T I O N A L   B A T C H '''
+
+FIELDS = ('open', 'high', 'low', 'close', 'tick_volume')
+
+# Stack the last `n` bars of every symbol's window into one (symbols, n, fields) float
+# array. Each window is the one check_signal would see for that symbol (its own latest
+# bar last, whatever the other symbols' times), right-aligned by position. A symbol
+# without a window gets NaN and therefore no signal; shorter histories are left-padded
+# with NaN.
+def stack_windows(windows, symbols, n):
+    out = np.full((len(symbols), n, len(FIELDS)), np.nan)
+    for i, symbol in enumerate(symbols):
+        bars = windows.get(symbol)
+        if bars is None or len(bars) == 0:
+            continue
+        bars = bars[-n:]
+        for j, name in enumerate(FIELDS):
+            out[i, n - len(bars):, j] = bars[name]
+    return out
+
+# check_signal, check_reverse_signal and the ATR levels for every symbol in one pass.
+# Only the tail the windows reach is computed, so the cost does not grow with n.
+def batch_evaluate(stacked, sd_fast=20, sd_slow=50, liq_window=30, liq_lookback=20, atr_window=6, tp=1.5, sl=2.2):
+    tail = max(sd_fast, sd_slow, liq_window + liq_lookback, atr_window + 1) + 3
+    o, h, l, c, v = np.moveaxis(stacked[:, -tail:, :], -1, 0)
+    return {
+        'signal': signals(o, h, l, c, v, sd_fast, sd_slow, liq_window, liq_lookback)[:, -1],
+        'reverse': reverse_signals(h, l, sd_fast, sd_slow)[:, -1],
+        'levels': atr_levels(h, l, c, atr_window, tp, sl), # (symbols, 4): TP_buy, SL_buy, TP_sell, SL_sell
+    }
@@ -0,0 +1,85 @@
+import hashlib
+import io
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+from bars import BAR_DTYPE
+
+
+# ~~~~~~~ WARM-START SNAPSHOT ~~~~~~~~
+# Per-symbol bar buffers and indicator state saved to one binary file, so a restart
+# only fetches the bars since the snapshot instead of rebuilding every window.
+#
+# Layout: MAGIC | header (version, timeframe seconds, created, payload size) | sha256 of payload | payload
+# The payload is an .npz with one bar array per symbol plus the state as json.
+# A snapshot is ignored when the magic, version, checksum, timeframe or strategy
+# parameters do not match, or when it is older than max_age.
+
+MAGIC = b'ALFSNAP\x00'
+VERSION = 1
+HEADER = struct.Struct('<HIdQ')
+
+
+def params_fingerprint(params):
+    return hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+def save_snapshot(path, buffers, state, timeframe_seconds, params):
+    arrays = {f'bars_{symbol}': np.asarray(bars, dtype=BAR_DTYPE) for symbol, bars in buffers.items()}
+    meta = {'symbols': list(buffers), 'state': state, 'params': params_fingerprint(params)}
+    arrays['meta'] = np.frombuffer(json.dumps(meta, default=str).encode(), dtype=np.uint8)
+
+    payload = io.BytesIO()
+    np.savez(payload, **arrays)
+    payload = payload.getvalue()
+
+    # write next to the target and swap, so a crash never leaves half a snapshot
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER.pack(VERSION, timeframe_seconds, time.time(), len(payload)))
+        f.write(hashlib.sha256(payload).digest())
+        f.write(payload)
+    os.replace(tmp, path)
+    return len(payload)
+
+# Returns (buffers, state) or None when there is no snapshot that can be trusted
+def load_snapshot(path, timeframe_seconds, params, max_age=6 * 3600):
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+
+    def reject(reason):
+        print(f'Snapshot {path} ignored: {reason}')
+        return None
+
+    start = len(MAGIC) + HEADER.size + 32
+    if len(data) < start or data[:len(MAGIC)] != MAGIC:
+        return reject('not a snapshot file')
+    version, tf_seconds, created, size = HEADER.unpack_from(data, len(MAGIC))
+    if version != VERSION:
+        return reject(f'version {version}, expected {VERSION}')
+    if tf_seconds != timeframe_seconds:
+        return reject(f'timeframe {tf_seconds}s, expected {timeframe_seconds}s')
+    if time.time() - created > max_age:
+        return reject(f'{(time.time() - created) / 3600:.1f}h old')
+    payload = data[start:start + size]
+    if len(payload) != size or hashlib.sha256(payload).digest() != data[start - 32:start]:
+        return reject('checksum mismatch')
+
+    with np.load(io.BytesIO(payload), allow_pickle=False) as npz:
+        meta = json.loads(npz['meta'].tobytes().decode())
+        if meta['params'] != params_fingerprint(params):
+            return reject('strategy parameters changed')
+        buffers = {}
+        for symbol in meta['symbols']:
+            bars = npz[f'bars_{symbol}']
+            if bars.dtype != BAR_DTYPE or (len(bars) > 1 and np.any(np.diff(bars['time']) <= 0)):
+                return reject(f'bad bars for {symbol}')
+            buffers[symbol] = bars
+    return buffers, meta['state']
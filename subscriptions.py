@@ -0,0 +1,119 @@
+import queue
+import sqlite3
+import threading
+
+
+# ~~~~~~~ SUBSCRIPTIONS ~~~~~~~~
+# One trading engine runs per account; chats subscribe to it instead of starting
+# their own. The registry maps each chat to the symbols it follows and the kinds of
+# events it wants, and is kept in SQLite so subscribers survive a restart.
+# The Notifier sends every event only to the chats interested in it, from a background
+# thread so a slow or failing chat never holds up the scan loop.
+
+EVENTS = ('open', 'close', 'error', 'status')
+ALL = '*' # every symbol the engine scans
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS subscriptions (
+    chat_id INTEGER PRIMARY KEY,
+    symbols TEXT,
+    events TEXT
+)
+'''
+
+
+class SubscriptionRegistry:
+    def __init__(self, path='subscriptions.db'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.chats = {} # chat_id -> {'symbols': set, 'events': set}
+        with sqlite3.connect(self.path) as conn:
+            conn.execute(SCHEMA)
+            for chat_id, symbols, events in conn.execute('SELECT chat_id, symbols, events FROM subscriptions'):
+                self.chats[chat_id] = {'symbols': set(filter(None, symbols.split(','))),
+                                       'events': set(filter(None, events.split(',')))}
+
+    def _save(self, chat_id):
+        with sqlite3.connect(self.path) as conn:
+            sub = self.chats.get(chat_id)
+            if sub is None:
+                conn.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+            else:
+                conn.execute('INSERT OR REPLACE INTO subscriptions (chat_id, symbols, events) VALUES (?, ?, ?)',
+                             (chat_id, ','.join(sorted(sub['symbols'])), ','.join(sorted(sub['events']))))
+
+    # Follow `symbols` (default every symbol); a new chat gets every event kind
+    def subscribe(self, chat_id, symbols=None):
+        with self.lock:
+            sub = self.chats.setdefault(chat_id, {'symbols': set(), 'events': set(EVENTS)})
+            sub['symbols'].update(symbols or [ALL])
+            self._save(chat_id)
+            return sub
+
+    # Stop following `symbols`, or drop the chat entirely when none are given. A chat
+    # following every symbol has ALL replaced by `all_symbols` (the engine's list) first,
+    # so it can drop single symbols. Returns True if the chat no longer follows anything.
+    def unsubscribe(self, chat_id, symbols=None, all_symbols=()):
+        with self.lock:
+            sub = self.chats.get(chat_id)
+            if sub is not None and symbols:
+                if ALL in sub['symbols']:
+                    sub['symbols'].discard(ALL)
+                    sub['symbols'].update(all_symbols)
+                sub['symbols'].difference_update(symbols)
+            if sub is not None and (not symbols or not sub['symbols']):
+                del self.chats[chat_id]
+            self._save(chat_id)
+            return chat_id not in self.chats
+
+    def set_event(self, chat_id, event, on=True):
+        if event not in EVENTS:
+            raise ValueError(f'Unknown event {event}, expected one of {EVENTS}')
+        with self.lock:
+            sub = self.chats.get(chat_id)
+            if sub is None:
+                return None
+            (sub['events'].add if on else sub['events'].discard)(event)
+            self._save(chat_id)
+            return sub
+
+    def get(self, chat_id):
+        with self.lock:
+            sub = self.chats.get(chat_id)
+            return None if sub is None else {'symbols': set(sub['symbols']), 'events': set(sub['events'])}
+
+    # Chats that want `event` for `symbol` (symbol None: events about the engine itself)
+    def interested(self, event, symbol=None):
+        with self.lock:
+            return [chat_id for chat_id, sub in self.chats.items()
+                    if event in sub['events'] and (symbol is None or ALL in sub['symbols'] or symbol in sub['symbols'])]
+
+    def __len__(self):
+        return len(self.chats)
+
+
+class Notifier:
+    # send(chat_id, text) delivers one message; on_error(chat_id, error) is told about failed sends
+    def __init__(self, registry, send, on_error=None):
+        self.registry = registry
+        self.send = send
+        self.on_error = on_error
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name='notifier', daemon=True)
+        self.thread.start()
+
+    # Queue `text` for every chat interested in the event; returns how many chats it goes to
+    def publish(self, event, text, symbol=None):
+        chats = self.registry.interested(event, symbol)
+        for chat_id in chats:
+            self.queue.put((chat_id, text))
+        return len(chats)
+
+    def _run(self):
+        while True:
+            chat_id, text = self.queue.get()
+            try:
+                self.send(chat_id, text)
+            except Exception as e:
+                if self.on_error is not None:
+                    self.on_error(chat_id, e)
@@ -0,0 +1,204 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from bars import as_bars
+import patterns
+import signals
+
+
+# ~~~~~~~ PARAMETER SWEEP ~~~~~~~~
+# Evaluates the check_signal rules over a grid of the strategy knobs on stored bars.
+# Signal parameters (supply/demand and liquidity windows) are looped, the exit
+# parameters (ATR window, TP and SL multipliers) are broadcast as array axes, and
+# symbols run in a process pool.
+#
+# Each signal is scored on its own: entry at the open of the bar it fires on (the
+# forming bar in check_signal), exit at TP or SL (SL first when both are touched in
+# the same bar) or at the close after `horizon` bars. Returns are in basis points of
+# the entry price, so symbols with different price scales can be summed.
+
+DEFAULT_GRID = {
+    'sd_fast': [10, 20, 30],
+    'sd_slow': [40, 50, 70],
+    'liq_window': [20, 30, 40],
+    'atr_window': [6, 10, 14],
+    'tp': [1.0, 1.5, 2.0, 2.5, 3.0],
+    'sl': [1.5, 2.2, 3.0],
+}
+
+SIGNAL_PARAMS = ('sd_fast', 'sd_slow', 'liq_window')
+EXIT_PARAMS = ('atr_window', 'tp', 'sl')
+STATS = ('trades', 'wins', 'gross_win', 'gross_loss', 'net_bps')
+
+CHUNK = 256 # signals scored per broadcast, bounds memory to CHUNK * atr * tp * horizon
+
+
+''' D A T A '''
+
+# Stored bars: <directory>/<SYMBOL>.npy in the mt5 rates layout (or .csv with the same columns)
+def load_bars(path):
+    if path.endswith('.npy'):
+        return as_bars(np.load(path))
+    df = pd.read_csv(path)
+    if not np.issubdtype(df['time'].dtype, np.number):
+        df['time'] = pd.to_datetime(df['time'])
+    return as_bars(df)
+
+def symbol_files(directory):
+    files = {}
+    for name in sorted(os.listdir(directory)):
+        symbol, ext = os.path.splitext(name)
+        if ext in ('.npy', '.csv'):
+            files[symbol] = os.path.join(directory, name)
+    return files
+
+# Save a year (or any range) of bars per symbol from the terminal
+def download(symbols, directory, date_from, date_to, timeframe='M5'):
+    import MetaTrader5 as mt5
+    mt5.initialize()
+    os.makedirs(directory, exist_ok=True)
+    for symbol in symbols:
+        rates = mt5.copy_rates_range(symbol, getattr(mt5, f'TIMEFRAME_{timeframe}'), date_from, date_to)
+        if rates is None or len(rates) == 0:
+            print(f'No data for {symbol}: {mt5.last_error()}')
+            continue
+        np.save(os.path.join(directory, f'{symbol}.npy'), as_bars(rates))
+        print(f'{symbol}: {len(rates)} bars')
+
+
+''' E V A L U A T I O N '''
+
+# Stats for every combination of one symbol, shape (signal combos, atr, tp, sl) per stat
+# pattern: optional patterns bits the last closed candle must have for a signal to count
+def evaluate_bars(bars, grid, horizon=288, pattern=None):
+    o, h, l, c, v = (bars[f].astype(float) for f in ('open', 'high', 'low', 'close', 'tick_volume'))
+    n = len(bars)
+    signal_combos = list(itertools.product(*(grid[p] for p in SIGNAL_PARAMS)))
+    atr_windows = np.asarray(grid['atr_window'])
+    tps = np.asarray(grid['tp'], dtype=float)
+    sls = np.asarray(grid['sl'], dtype=float)
+    shape = (len(signal_combos), len(atr_windows), len(tps), len(sls))
+    stats = {name: np.zeros(shape) for name in STATS}
+    if n < horizon + 3:
+        return stats
+
+    # ATR of the last closed candle for every bar and ATR window: (atr, bars)
+    atr_prev = np.stack([np.r_[np.nan, signals.atr(h, l, c, w)[:-1]] for w in atr_windows])
+    close_prev = np.r_[np.nan, c[:-1]]
+
+    # forward paths from each bar: entry bar t up to t+horizon-1
+    fwd_high = sliding_window_view(h, horizon)
+    fwd_low = sliding_window_view(l, horizon)
+    exit_close = c[horizon - 1:]
+    if pattern:
+        # mask of the last closed candle (t-1) seen from each bar t
+        allowed = np.r_[False, (patterns.bar_patterns(bars)[:-1] & pattern) != 0]
+
+    for k, combo in enumerate(signal_combos):
+        sig = signals.signals(o, h, l, c, v, **dict(zip(SIGNAL_PARAMS, combo)))
+        if pattern:
+            sig = np.where(allowed, sig, 0)
+        idx = np.flatnonzero(sig[:n - horizon + 1])
+        idx = idx[~np.isnan(atr_prev[:, idx]).any(axis=0)]
+        for start in range(0, len(idx), CHUNK):
+            t = idx[start:start + CHUNK]
+            side = sig[t].astype(float)[:, None, None]                      # (sig, 1, 1)
+            entry = o[t][:, None, None]
+            base = close_prev[t][:, None, None]
+            a = atr_prev[:, t].T[:, :, None]                                 # (sig, atr, 1)
+            tp_price = base + side * a * tps                                 # (sig, atr, tp)
+            sl_price = base - side * a * sls                                 # (sig, atr, sl)
+
+            up = fwd_high[t][:, None, None, :]                               # (sig, 1, 1, horizon)
+            down = fwd_low[t][:, None, None, :]
+            is_long = (side > 0)[..., None]
+            tp_hit = np.where(is_long, up >= tp_price[..., None], down <= tp_price[..., None])
+            sl_hit = np.where(is_long, down <= sl_price[..., None], up >= sl_price[..., None])
+            tp_at = np.where(tp_hit.any(-1), tp_hit.argmax(-1), horizon)    # (sig, atr, tp)
+            sl_at = np.where(sl_hit.any(-1), sl_hit.argmax(-1), horizon)    # (sig, atr, sl)
+
+            tp_at = tp_at[..., :, None]                                       # (sig, atr, tp, 1)
+            sl_at = sl_at[..., None, :]                                       # (sig, atr, 1, sl)
+            exit_price = np.where(
+                (sl_at <= tp_at) & (sl_at < horizon), sl_price[..., None, :],
+                np.where(tp_at < horizon, tp_price[..., :, None], exit_close[t][:, None, None, None]))
+            pnl = side[..., None] * (exit_price - entry[..., None]) / entry[..., None] * 1e4
+
+            stats['trades'][k] += len(t)
+            stats['wins'][k] += (pnl > 0).sum(0)
+            stats['gross_win'][k] += np.where(pnl > 0, pnl, 0).sum(0)
+            stats['gross_loss'][k] -= np.where(pnl < 0, pnl, 0).sum(0)
+            stats['net_bps'][k] += pnl.sum(0)
+    return stats
+
+def evaluate_file(symbol, path, grid, horizon, pattern=None):
+    start = time.perf_counter()
+    stats = evaluate_bars(load_bars(path), grid, horizon, pattern)
+    print(f'{symbol}: {time.perf_counter() - start:.1f}s')
+    return symbol, stats
+
+
+''' R E S U L T S '''
+
+def results_table(stats, grid):
+    signal_combos = list(itertools.product(*(grid[p] for p in SIGNAL_PARAMS)))
+    exit_combos = list(itertools.product(*(grid[p] for p in EXIT_PARAMS)))
+    rows = [s + e for s in signal_combos for e in exit_combos]
+    df = pd.DataFrame(rows, columns=SIGNAL_PARAMS + EXIT_PARAMS)
+    for name in STATS:
+        df[name] = stats[name].reshape(-1)
+    df['trades'] = df['trades'].astype(int)
+    df['wins'] = df['wins'].astype(int)
+    df['win_rate'] = df['wins'] / df['trades'].where(df['trades'] > 0)
+    df['avg_bps'] = df['net_bps'] / df['trades'].where(df['trades'] > 0)
+    df['profit_factor'] = df['gross_win'] / df['gross_loss'].where(df['gross_loss'] > 0)
+    return df.drop(columns=['gross_win', 'gross_loss'])
+
+# Run the grid over every stored symbol and return the combinations ranked
+def sweep(directory, grid=None, horizon=288, workers=None, rank_by='net_bps', min_trades=1, pattern=None):
+    grid = grid or DEFAULT_GRID
+    files = symbol_files(directory)
+    total = None
+    per_symbol = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate_file, symbol, path, grid, horizon, pattern) for symbol, path in files.items()]
+        for future in futures:
+            symbol, stats = future.result()
+            per_symbol[symbol] = stats
+            total = stats if total is None else {k: total[k] + stats[k] for k in STATS}
+    if total is None:
+        raise ValueError(f'No .npy or .csv bar files in {directory}')
+
+    table = results_table(total, grid)
+    table = table[table['trades'] >= min_trades]
+    return table.sort_values(rank_by, ascending=False).reset_index(drop=True), per_symbol
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rank Alfris strategy parameters on stored bars')
+    parser.add_argument('directory', help='folder with one <SYMBOL>.npy or .csv of M5 bars per symbol')
+    parser.add_argument('--horizon', type=int, default=288, help='bars before a trade is closed at market')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--rank-by', default='net_bps', choices=['net_bps', 'avg_bps', 'win_rate', 'profit_factor'])
+    parser.add_argument('--min-trades', type=int, default=30)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--out', help='write the full table to this csv')
+    parser.add_argument('--pattern', action='append', choices=sorted(patterns.PATTERNS),
+                        help='only count signals whose last closed candle has this pattern (repeatable)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    pattern = sum(patterns.PATTERNS[name] for name in args.pattern) if args.pattern else None
+    table, _ = sweep(args.directory, horizon=args.horizon, workers=args.workers, rank_by=args.rank_by,
+                     min_trades=args.min_trades, pattern=pattern)
+    print(table.head(args.top).to_string())
+    print(f'{len(table)} combinations in {time.perf_counter() - start:.1f}s')
+    if args.out:
+        table.to_csv(args.out, index=False)
@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import charts
+import signals
+from bars import BAR_DTYPE
+
+
+def make_bars(n=60, start=1_700_000_000, seed=1):
+    rng = np.random.default_rng(seed)
+    close = 1.1 + np.cumsum(rng.normal(0, 1e-3, n))
+    bars = np.zeros(n, dtype=BAR_DTYPE)
+    bars['time'] = start + 300 * np.arange(n)
+    bars['open'] = np.concatenate([[close[0]], close[:-1]])
+    bars['close'] = close
+    bars['high'] = np.maximum(bars['open'], close) + np.abs(rng.normal(0, 5e-4, n))
+    bars['low'] = np.minimum(bars['open'], close) - np.abs(rng.normal(0, 5e-4, n))
+    bars['tick_volume'] = rng.integers(50, 500, n)
+    return bars
+
+
+@pytest.fixture
+def renderer(monkeypatch):
+    monkeypatch.setattr(charts, 'render_png', lambda symbol, timeframe, bars, levels, zones: f'{symbol} {bars["time"][-1]}'.encode())
+    renderer = charts.ChartRenderer()
+    renderer.pool = ThreadPoolExecutor(max_workers=1)
+    yield renderer
+    renderer.close()
+
+
+def test_same_last_closed_bar_is_a_cache_hit(renderer):
+    bars = make_bars()
+    first = renderer.render('EURUSD', 'M5', bars).result(5)
+    again = renderer.render('EURUSD', 'M5', bars.copy()).result(5)
+    assert first == again
+    assert (renderer.renders, renderer.hits) == (1, 1)
+
+    # other overlays are another image
+    renderer.render('EURUSD', 'M5', bars, levels=True).result(5)
+    assert renderer.renders == 2
+
+
+def test_new_closed_bar_renders_again(renderer):
+    bars = make_bars(61)
+    first = renderer.render('EURUSD', 'M5', bars[:-1]).result(5)
+    second = renderer.render('EURUSD', 'M5', bars[1:]).result(5)
+    assert first != second
+    assert (renderer.renders, renderer.hits) == (2, 0)
+
+
+def test_levels_match_the_engine_window():
+    bars = make_bars()
+    # the engine's window ends with the forming candle, whatever its prices
+    forming = np.zeros(1, dtype=BAR_DTYPE)
+    forming['high'], forming['low'], forming['close'] = 9.0, 0.1, 5.0
+    window = np.concatenate([bars, forming])
+    expected = signals.atr_levels(window['high'], window['low'], window['close'])
+    assert np.allclose(charts.atr_levels(bars), expected)
+
+
+def test_render_png_draws_overlays():
+    pytest.importorskip('matplotlib')
+    png = charts.render_png('EURUSD', 'M5', make_bars(), levels=True, zones=True)
+    assert png.startswith(b'\x89PNG')
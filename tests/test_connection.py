@@ -0,0 +1,150 @@
+import threading
+import types
+
+import pytest
+
+import connection
+from connection import BrokerConnection, BrokerUnavailable
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Broker:
+    def __init__(self):
+        self.up = True
+        self.initialized = 0
+        self.shutdowns = 0
+
+    def initialize(self, **settings):
+        self.initialized += 1
+        return self.up
+
+    def shutdown(self):
+        self.shutdowns += 1
+        return True
+
+    def last_error(self):
+        return (1, 'test')
+
+    def terminal_info(self):
+        return types.SimpleNamespace(connected=self.up)
+
+    def symbol_info_tick(self, symbol):
+        return symbol
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(connection, 'time', types.SimpleNamespace(monotonic=clock))
+    return clock
+
+
+def test_failed_initialize_backs_off_exponentially(clock):
+    broker = Broker()
+    broker.up = False
+    conn = BrokerConnection(broker, backoff=1.0, max_backoff=5.0)
+    assert not conn.connect()
+
+    delays = []
+    for _ in range(4):
+        delays.append(conn.next_attempt - clock.now)
+        # no attempt before the delay is up
+        with pytest.raises(BrokerUnavailable, match='down'):
+            conn.symbol_info_tick('EURUSD')
+        clock.now = conn.next_attempt
+        with pytest.raises(BrokerUnavailable):
+            conn.symbol_info_tick('EURUSD')
+    assert delays == [1.0, 2.0, 4.0, 5.0]
+    assert broker.initialized == 5
+
+
+def test_lost_session_reconnects_and_is_timed(clock):
+    broker = Broker()
+    conn = BrokerConnection(broker, probe_interval=10, backoff=1.0)
+    assert conn.connect()
+    assert conn.symbol_info_tick('EURUSD') == 'EURUSD'
+
+    # the next probe fails and the immediate reconnect does too
+    broker.up = False
+    clock.now += 10
+    with pytest.raises(BrokerUnavailable):
+        conn.symbol_info_tick('EURUSD')
+    assert not conn.connected and broker.shutdowns == 1
+
+    broker.up = True
+    clock.now += 3
+    assert conn.symbol_info_tick('EURUSD') == 'EURUSD'
+    assert conn.stats()['reconnects'] == 1
+    assert conn.recover_times == [3.0]
+
+
+def test_shutdown_blocks_calls_until_connect(clock):
+    conn = BrokerConnection(Broker())
+    conn.connect()
+    conn.shutdown()
+    with pytest.raises(BrokerUnavailable, match='closed'):
+        conn.symbol_info_tick('EURUSD')
+    assert conn.connect()
+    assert conn.symbol_info_tick('EURUSD') == 'EURUSD'
+
+
+def test_call_overlapping_a_reset_is_rejected():
+    broker = Broker()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_tick(symbol):
+        started.set()
+        release.wait(5)
+        return symbol
+    broker.symbol_info_tick = slow_tick
+
+    conn = BrokerConnection(broker, probe_interval=None)
+    conn.connect()
+    conn.drain_timeout = 0.05
+    outcome = []
+
+    def call():
+        try:
+            outcome.append(conn.symbol_info_tick('EURUSD'))
+        except BrokerUnavailable as e:
+            outcome.append(e)
+    worker = threading.Thread(target=call)
+    worker.start()
+    started.wait(5)
+    conn.shutdown() # gives up waiting after drain_timeout
+    release.set()
+    worker.join(5)
+    assert isinstance(outcome[0], BrokerUnavailable) and 'reset' in str(outcome[0])
+
+
+def test_reset_waits_for_a_call_in_progress():
+    broker = Broker()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_tick(symbol):
+        started.set()
+        release.wait(5)
+        return symbol
+    broker.symbol_info_tick = slow_tick
+
+    conn = BrokerConnection(broker, probe_interval=None)
+    conn.connect()
+    outcome = []
+    worker = threading.Thread(target=lambda: outcome.append(conn.symbol_info_tick('EURUSD')))
+    worker.start()
+    started.wait(5)
+    stopper = threading.Thread(target=conn.shutdown)
+    stopper.start()
+    stopper.join(0.1)
+    assert stopper.is_alive() and broker.shutdowns == 0
+    release.set()
+    worker.join(5)
+    stopper.join(5)
+    assert outcome == ['EURUSD'] and broker.shutdowns == 1
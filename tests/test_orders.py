@@ -0,0 +1,86 @@
+import collections
+import threading
+
+from orders import OrderGuard
+
+Result = collections.namedtuple('Result', 'retcode')
+Position = collections.namedtuple('Position', 'symbol magic comment')
+
+
+class Broker:
+    def __init__(self, retcode=10009):
+        self.retcode = retcode
+        self.positions = []
+        self.sent = []
+
+    def send(self, comment):
+        self.sent.append(comment)
+        return Result(self.retcode)
+
+    def positions_get(self, symbol=None):
+        return tuple(p for p in self.positions if p.symbol == symbol)
+
+    def fill(self, symbol, magic=2022):
+        self.positions.append(Position(symbol, magic, self.sent[-1]))
+
+
+def test_same_signal_is_sent_once():
+    guard, broker = OrderGuard(magic=2022), Broker()
+    response, reason = guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert response.retcode == 10009 and reason is None
+
+    # filled but not yet visible in positions_get: the symbol stays pending
+    assert not guard.can_enter('EURUSD', broker.positions_get)
+    _, reason = guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert reason == 'previous order still pending fill'
+
+    # once visible the pending entry clears, and the key still blocks the same signal
+    broker.fill('EURUSD')
+    assert not guard.can_enter('EURUSD', broker.positions_get)
+    assert 'EURUSD' not in guard.in_flight()
+    _, reason = guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert reason.endswith('already sent')
+    assert len(broker.sent) == 1
+
+def test_signal_already_on_the_broker_is_not_resent():
+    guard, broker = OrderGuard(magic=2022), Broker()
+    # e.g. sent before a restart: the comment carries the key
+    broker.positions.append(Position('EURUSD', 2022, guard.comment(guard.key('EURUSD', -1, 'bar-1'))))
+    _, reason = guard.submit('EURUSD', -1, 'bar-1', broker.send, broker.positions_get)
+    assert reason.endswith('already on the broker')
+    assert broker.sent == []
+
+def test_rejected_order_can_be_retried():
+    guard, broker = OrderGuard(magic=2022), Broker(retcode=10006)
+    guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert guard.can_enter('EURUSD', broker.positions_get)
+
+    broker.retcode = 10009
+    response, reason = guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert reason is None and len(broker.sent) == 2
+
+def test_pending_expires_after_the_fill_timeout():
+    guard, broker = OrderGuard(magic=2022, fill_timeout=-1), Broker()
+    guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    assert guard.can_enter('EURUSD', broker.positions_get)
+    # a new signal bar gets a new key
+    _, reason = guard.submit('EURUSD', 1, 'bar-2', broker.send, broker.positions_get)
+    assert reason is None and len(broker.sent) == 2
+
+def test_concurrent_submit_is_refused():
+    guard, broker = OrderGuard(magic=2022), Broker()
+    inside, release = threading.Event(), threading.Event()
+
+    def slow_send(comment):
+        inside.set()
+        release.wait(5)
+        return broker.send(comment)
+
+    first = threading.Thread(target=guard.submit, args=('EURUSD', 1, 'bar-1', slow_send, broker.positions_get))
+    first.start()
+    inside.wait(5)
+    _, reason = guard.submit('EURUSD', 1, 'bar-1', broker.send, broker.positions_get)
+    release.set()
+    first.join(5)
+    assert reason == 'another order for the symbol is being submitted'
+    assert len(broker.sent) == 1
@@ -0,0 +1,33 @@
+import numpy as np
+
+from patterns import BEAR_PIN, BULL_ENGULFING, BULL_PIN, DOJI, pattern_mask
+
+
+# One candle per row of (open, high, low, close); the mask of the last one
+def last_mask(*candles):
+    o, h, l, c = np.array(candles, dtype=float).T
+    return int(pattern_mask(o, h, l, c)[-1])
+
+
+def test_hammer():
+    assert last_mask((1.00, 1.01, 0.95, 1.008)) & BULL_PIN
+
+def test_hammer_with_a_tiny_body():
+    mask = last_mask((1.0000, 1.0010, 0.9900, 1.0005))
+    assert mask & BULL_PIN and mask & DOJI
+    assert not mask & BEAR_PIN
+
+def test_shooting_star_with_a_tiny_body():
+    mask = last_mask((1.0000, 1.0100, 0.9990, 0.9995))
+    assert mask & BEAR_PIN and not mask & BULL_PIN
+
+def test_doji_with_even_wicks_is_not_a_pin():
+    mask = last_mask((1.0000, 1.0050, 0.9950, 1.0001))
+    assert mask & DOJI
+    assert not mask & (BULL_PIN | BEAR_PIN)
+
+def test_long_body_is_not_a_pin():
+    assert not last_mask((1.00, 1.05, 0.97, 1.05)) & BULL_PIN
+
+def test_bull_engulfing():
+    assert last_mask((1.02, 1.025, 1.00, 1.005), (1.004, 1.03, 1.00, 1.025)) & BULL_ENGULFING
@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+import fake_broker
+from recorder import RecordingBroker, ReplayBroker
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = tmp_path / 'session.rec'
+    broker = RecordingBroker(fake_broker, path)
+    calls = {
+        'eurusd': broker.copy_rates_from_pos('EURUSD', broker.TIMEFRAME_M5, 0, 100),
+        'gbpusd': broker.copy_rates_from_pos('GBPUSD', broker.TIMEFRAME_M5, 0, 100),
+        'tick': broker.symbol_info_tick('EURUSD'),
+        'tick_later': broker.symbol_info_tick('EURUSD'),
+    }
+    with pytest.raises(KeyError):
+        broker.order_send({'action': fake_broker.TRADE_ACTION_DEAL})
+    broker.close()
+    return path, calls
+
+
+def test_replay_returns_what_was_recorded(recording):
+    path, calls = recording
+    replay = ReplayBroker(path)
+
+    assert replay.TIMEFRAME_M5 == fake_broker.TIMEFRAME_M5
+    # out of order: calls are matched on their arguments
+    assert np.array_equal(replay.copy_rates_from_pos('GBPUSD', 5, 0, 100), calls['gbpusd'])
+    assert np.array_equal(replay.copy_rates_from_pos('EURUSD', 5, 0, 100), calls['eurusd'])
+    # repeated calls come back in the recorded order, as namedtuples with the same fields
+    tick = replay.symbol_info_tick('EURUSD')
+    assert tick == tuple(calls['tick']) and tick.time_msc == calls['tick'].time_msc
+    assert replay.symbol_info_tick('EURUSD').time_msc == calls['tick_later'].time_msc
+    assert replay.stats['matched'] == 4 and replay.stats['mismatched'] == 0
+
+def test_unmatched_arguments_fall_back_to_the_same_function(recording):
+    path, calls = recording
+    replay = ReplayBroker(path)
+
+    assert np.array_equal(replay.copy_rates_from_pos('USDJPY', 5, 0, 100), calls['eurusd'])
+    assert np.array_equal(replay.copy_rates_from_pos('GBPUSD', 5, 0, 100), calls['gbpusd'])
+    assert replay.stats['mismatched'] == 1 and replay.stats['matched'] == 1
+    assert replay.remaining() == 3
+
+def test_recorded_errors_and_missing_calls(recording):
+    path, _ = recording
+    replay = ReplayBroker(path)
+
+    with pytest.raises(RuntimeError, match='recorded order_send failed'):
+        replay.order_send({'action': fake_broker.TRADE_ACTION_DEAL})
+    with pytest.raises(LookupError):
+        replay.positions_get()
+    assert replay.stats['missing'] == 1
@@ -0,0 +1,81 @@
+import queue
+import time
+
+import pytest
+
+import fake_broker
+from shard import Coordinator
+
+SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD', 'USDCAD', 'NZDUSD']
+SETTINGS = {'interval': 0.5, 'approval_timeout': 1}
+
+
+# Run the coordinator's side of the queue until `until(events)` holds or `seconds` pass
+def pump(coordinator, events, seconds, until):
+    end = time.monotonic() + seconds
+    while time.monotonic() < end and not until(events):
+        try:
+            coordinator.handle(*coordinator.outbox.get(timeout=0.2))
+        except queue.Empty:
+            pass
+
+@pytest.fixture
+def run():
+    started = []
+
+    def start(**limits):
+        events = []
+        coordinator = Coordinator('fake_broker', SYMBOLS, workers=2, settings=SETTINGS,
+                                  on_event=lambda kind, wid, payload: events.append((kind, wid, payload)), **limits)
+        coordinator.start()
+        started.append(coordinator)
+        return coordinator, events
+
+    yield start
+    for coordinator in started:
+        coordinator.stop()
+
+
+def fills(events):
+    return [p for k, _, p in events if k == 'fill']
+
+def denials(events):
+    return [p['reason'] for k, _, p in events if k == 'signal' and 'reason' in p]
+
+
+def test_max_positions_approves_then_denies(run):
+    coordinator, events = run(max_positions=3, max_lots=1.0)
+    pump(coordinator, events, 15, lambda e: len(fills(e)) >= 3 and denials(e))
+
+    assert len(fills(events)) == 3
+    assert all(p['retcode'] == fake_broker.TRADE_RETCODE_DONE for p in fills(events))
+    assert denials(events)
+    assert set(denials(events)) <= {'max positions 3 reached', 'position already open or in flight'}
+    assert coordinator.open_positions() <= 3
+
+def test_max_lots(run):
+    coordinator, events = run(max_positions=10, max_lots=0.025)
+    # in-flight orders count towards the limit, so the denial may come before the fills
+    pump(coordinator, events, 15, lambda e: len(fills(e)) >= 2 and any(r.startswith('max lots') for r in denials(e)))
+
+    assert len(fills(events)) == 2
+    assert any(r.startswith('max lots') for r in denials(events))
+    assert coordinator.total_lots() <= 0.025 + 1e-9
+
+def test_dead_worker_is_respawned_and_shards_rebalanced(run):
+    coordinator, events = run(max_positions=3, max_lots=1.0, heartbeat_timeout=30)
+    dead = sorted(coordinator.workers)[0]
+    coordinator.workers[dead]['process'].terminate()
+    coordinator.workers[dead]['process'].join(timeout=5)
+    coordinator.check_workers()
+
+    assert dead not in coordinator.workers
+    assert coordinator.restarts == 1 and len(coordinator.workers) == 2
+    shards = [w['symbols'] for w in coordinator.workers.values()]
+    assert sorted(sum(shards, [])) == sorted(SYMBOLS)
+    assert any(kind == 'worker_died' and wid == dead for kind, wid, _ in events)
+
+    # the replacement scans its shard and reports
+    new = f'0-{coordinator.spawned - 1}'
+    pump(coordinator, events, 10, lambda e: any(k == 'report' and wid == new for k, wid, _ in e))
+    assert any(k == 'report' and wid == new for k, wid, _ in events)
@@ -0,0 +1,43 @@
+import numpy as np
+
+import fake_broker
+import signals
+from bars import TimeframeSet
+
+SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY', 'AUDUSD', 'USDCAD', 'NZDUSD', 'EURGBP']
+
+
+# Seeded bar windows as the broker serves them, each ending on a bar where the strategy fires
+def windows():
+    out = {symbol: fake_broker._window(symbol, 400).copy() for symbol in SYMBOLS}
+    out['NZDUSD']['time'] -= 3 * 300  # quiet symbol: its last bar is older than the others'
+    out['EURGBP'] = out['EURGBP'][-120:]  # short history
+    return out
+
+
+def test_batch_matches_per_symbol():
+    bars = windows()
+    batch = signals.batch_evaluate(signals.stack_windows(bars, SYMBOLS, 400))
+
+    for i, symbol in enumerate(SYMBOLS):
+        b = bars[symbol]
+        assert batch['signal'][i] == signals.last_signal(b) != 0, symbol
+        assert batch['reverse'][i] == signals.reverse_signals(b['high'], b['low'])[-1], symbol
+        assert np.allclose(batch['levels'][i], signals.atr_levels(b['high'], b['low'], b['close'])), symbol
+
+def test_missing_symbol_gets_no_signal():
+    bars = windows()
+    batch = signals.batch_evaluate(signals.stack_windows(bars, SYMBOLS + ['USDCHF'], 400))
+    assert batch['signal'][-1] == 0 and batch['reverse'][-1] == 0
+
+def test_htf_confirmation():
+    frames = TimeframeSet('M5')
+    frames.update(fake_broker._window('EURUSD', 400))
+    htf = frames.bars('H1')
+    bull = htf['close'][-2] > htf['open'][-2]
+
+    assert signals.htf_confirms(1, htf) == bull
+    assert signals.htf_confirms(-1, htf) == (htf['close'][-2] < htf['open'][-2])
+    # the same answer on the DataFrame check_signal works with
+    assert signals.htf_confirms(1, frames.frame('H1')) == bull
+    assert not signals.htf_confirms(1, htf[-1:])
@@ -0,0 +1,47 @@
+import numpy as np
+
+from bars import BAR_DTYPE
+from snapshot import load_snapshot, save_snapshot
+
+PARAMS = {'timeframe': 5, 'Atr_Perc_tp': 1.5, 'Atr_Perc_sl': 2.2}
+
+
+def make_bars(n, start=1_700_000_100):
+    bars = np.zeros(n, dtype=BAR_DTYPE)
+    bars['time'] = start - start % 300 + 300 * np.arange(n)
+    bars['close'] = np.linspace(1.0, 1.1, n)
+    bars['tick_volume'] = np.arange(n)
+    return bars
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'snap.bin'
+    buffers = {'EURUSD': make_bars(400), 'USDJPY': make_bars(10)}
+    state = {'EURUSD': {'bar_time': '2023-11-14 22:15:00', 'signal': 1, 'liquidity': 1.05}}
+    save_snapshot(path, buffers, state, 300, PARAMS)
+
+    restored, restored_state = load_snapshot(path, 300, PARAMS)
+    assert sorted(restored) == ['EURUSD', 'USDJPY']
+    for symbol, bars in buffers.items():
+        assert restored[symbol].dtype == BAR_DTYPE
+        assert np.array_equal(restored[symbol], bars)
+    assert restored_state == state
+
+def test_changed_parameters_are_rejected(tmp_path):
+    path = tmp_path / 'snap.bin'
+    save_snapshot(path, {'EURUSD': make_bars(50)}, {}, 300, PARAMS)
+
+    assert load_snapshot(path, 300, dict(PARAMS, Atr_Perc_sl=2.0)) is None
+    assert load_snapshot(path, 900, PARAMS) is None
+    assert load_snapshot(path, 300, PARAMS) is not None
+
+def test_corrupt_or_old_snapshots_are_rejected(tmp_path):
+    path = tmp_path / 'snap.bin'
+    save_snapshot(path, {'EURUSD': make_bars(50)}, {}, 300, PARAMS)
+    assert load_snapshot(path, 300, PARAMS, max_age=-1) is None
+
+    data = bytearray(path.read_bytes())
+    data[-1] ^= 0xFF
+    path.write_bytes(bytes(data))
+    assert load_snapshot(path, 300, PARAMS) is None
+    assert load_snapshot(tmp_path / 'missing.bin', 300, PARAMS) is None
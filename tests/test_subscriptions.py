@@ -0,0 +1,34 @@
+from subscriptions import ALL, EVENTS, SubscriptionRegistry
+
+ENGINE_SYMBOLS = ['EURUSD', 'GBPUSD', 'USDJPY']
+
+
+def test_chat_following_everything_can_drop_one_symbol(tmp_path):
+    registry = SubscriptionRegistry(tmp_path / 'subs.db')
+    registry.subscribe(1)
+    assert registry.get(1)['symbols'] == {ALL}
+
+    assert not registry.unsubscribe(1, ['EURUSD'], all_symbols=ENGINE_SYMBOLS)
+    assert registry.get(1)['symbols'] == {'GBPUSD', 'USDJPY'}
+    assert registry.interested('open', 'GBPUSD') == [1]
+    assert registry.interested('open', 'EURUSD') == []
+    # kept across a restart
+    assert SubscriptionRegistry(tmp_path / 'subs.db').get(1)['symbols'] == {'GBPUSD', 'USDJPY'}
+
+def test_dropping_the_last_symbol_drops_the_chat(tmp_path):
+    registry = SubscriptionRegistry(tmp_path / 'subs.db')
+    registry.subscribe(1, ['EURUSD'])
+    registry.subscribe(2)
+
+    assert registry.unsubscribe(1, ['EURUSD'], all_symbols=ENGINE_SYMBOLS)
+    assert registry.get(1) is None and len(registry) == 1
+    assert registry.unsubscribe(2)
+    assert len(registry) == 0
+
+def test_events_per_chat(tmp_path):
+    registry = SubscriptionRegistry(tmp_path / 'subs.db')
+    registry.subscribe(1)
+    assert registry.get(1)['events'] == set(EVENTS)
+    registry.set_event(1, 'status', on=False)
+    assert registry.interested('status') == []
+    assert registry.interested('error') == [1]
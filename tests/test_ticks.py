@@ -0,0 +1,63 @@
+import numpy as np
+
+from ticks import TICK_DTYPE, SymbolTicks, TickBuffer
+
+
+def make_ticks(msc, bid=1.0, spread=0.0002):
+    ticks = np.zeros(len(msc), dtype=TICK_DTYPE)
+    ticks['time_msc'] = msc
+    ticks['bid'] = bid
+    ticks['ask'] = np.asarray(bid) + spread
+    return ticks
+
+
+''' T I C K   B U F F E R '''
+
+def test_buffer_keeps_order_across_the_wrap():
+    buffer = TickBuffer(capacity=5)
+    buffer.append(make_ticks([1, 2, 3]))
+    buffer.append(make_ticks([4, 5, 6, 7]))  # wraps: 6 and 7 overwrite 1 and 2
+
+    assert len(buffer) == 5
+    assert buffer.ordered()['time_msc'].tolist() == [3, 4, 5, 6, 7]
+    assert buffer.since(4)['time_msc'].tolist() == [5, 6, 7]
+    assert buffer.since(0)['time_msc'].tolist() == [3, 4, 5, 6, 7]
+
+def test_buffer_batch_larger_than_capacity_keeps_the_newest():
+    buffer = TickBuffer(capacity=3)
+    buffer.append(make_ticks([1]))
+    buffer.append(make_ticks([2, 3, 4, 5]))
+
+    assert buffer.ordered()['time_msc'].tolist() == [3, 4, 5]
+    buffer.append(make_ticks([6]))
+    assert buffer.ordered()['time_msc'].tolist() == [4, 5, 6]
+
+
+''' S Y M B O L   T I C K S '''
+
+def test_add_drops_ticks_already_seen():
+    state = SymbolTicks('EURUSD', bar_seconds=300, capacity=100)
+    state.add(make_ticks([1000, 2000, 2000]))
+    # copy_ticks_from works in seconds, so the next fetch returns the same ticks again
+    state.add(make_ticks([2000, 2000, 2500]))
+
+    assert state.ticks.ordered()['time_msc'].tolist() == [1000, 2000, 2000, 2500]
+
+def test_add_keeps_new_ticks_with_the_last_timestamp():
+    state = SymbolTicks('EURUSD', bar_seconds=300, capacity=100)
+    state.add(make_ticks([1000, 2000]))
+    # one tick at 2000 was stored, the second one at 2000 arrived after the fetch
+    state.add(make_ticks([2000, 2000]))
+    state.add(make_ticks([2000, 2000]))
+
+    assert state.ticks.ordered()['time_msc'].tolist() == [1000, 2000, 2000]
+
+def test_add_returns_the_bars_a_new_tick_closes():
+    state = SymbolTicks('EURUSD', bar_seconds=300, capacity=100)
+    assert len(state.add(make_ticks([0, 60000], bid=[1.0, 1.1]))) == 0
+
+    closed = state.add(make_ticks([300000], bid=1.2))
+    assert closed['time'].tolist() == [0]
+    assert (closed['open'][0], closed['close'][0], closed['tick_volume'][0]) == (1.0, 1.1, 2)
+    # a repeat of the same fetch closes nothing
+    assert len(state.add(make_ticks([300000], bid=1.2))) == 0
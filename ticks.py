@@ -0,0 +1,254 @@
+import time
+
+import numpy as np
+
+from bars import BAR_DTYPE, BarBuffer, as_bars
+
+
+# ~~~~~~~ TICK STREAM ~~~~~~~~
+# Polls copy_ticks_from incrementally per symbol into fixed-size numpy ring buffers,
+# builds bars from the ticks locally and reports a bar as soon as it closes, without
+# waiting for the terminal's bar history. The same buffers give live spread
+# statistics.
+
+TICK_DTYPE = np.dtype([
+    ('time_msc', '<i8'),
+    ('bid', '<f8'),
+    ('ask', '<f8'),
+])
+
+
+class TickBuffer:
+    # Ring buffer of the latest `capacity` ticks of one symbol
+    def __init__(self, capacity=200000):
+        self.data = np.zeros(capacity, dtype=TICK_DTYPE)
+        self.capacity = capacity
+        self.pos = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, ticks):
+        n = len(ticks)
+        if n == 0:
+            return
+        if n >= self.capacity:
+            self.data[:] = ticks[-self.capacity:]
+            self.pos = 0
+            self.count = self.capacity
+            return
+        end = self.pos + n
+        if end <= self.capacity:
+            self.data[self.pos:end] = ticks
+        else:
+            split = self.capacity - self.pos
+            self.data[self.pos:] = ticks[:split]
+            self.data[:n - split] = ticks[split:]
+        self.pos = end % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    # Ticks in time order (a copy)
+    def ordered(self):
+        if self.count < self.capacity:
+            return self.data[:self.count].copy()
+        return np.concatenate([self.data[self.pos:], self.data[:self.pos]])
+
+    # Ticks newer than `since_msc`, in time order (only the tail is copied)
+    def since(self, since_msc):
+        if self.count < self.capacity:
+            segments = [self.data[:self.count]]
+        else:
+            segments = [self.data[self.pos:], self.data[:self.pos]]
+        return np.concatenate([seg[np.searchsorted(seg['time_msc'], since_msc, side='right'):] for seg in segments])
+
+
+# Bid-based bars from time-sorted ticks, like the terminal builds them
+def ticks_to_bars(ticks, seconds, point=None):
+    if len(ticks) == 0:
+        return np.empty(0, dtype=BAR_DTYPE)
+    t = ticks['time_msc'] // 1000
+    bucket = t - t % seconds
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    ends = np.r_[starts[1:], len(ticks)] - 1
+    bid = ticks['bid']
+
+    out = np.zeros(len(starts), dtype=BAR_DTYPE)
+    out['time'] = bucket[starts]
+    out['open'] = bid[starts]
+    out['high'] = np.maximum.reduceat(bid, starts)
+    out['low'] = np.minimum.reduceat(bid, starts)
+    out['close'] = bid[ends]
+    out['tick_volume'] = np.diff(np.r_[starts, len(ticks)])
+    if point:
+        out['spread'] = np.minimum.reduceat(np.rint((ticks['ask'] - bid) / point), starts)
+    return out
+
+
+class SymbolTicks:
+    # Tick buffer, locally built bars and the open bar of one symbol
+    def __init__(self, symbol, bar_seconds, capacity, point=None, bar_capacity=5000):
+        self.symbol = symbol
+        self.bar_seconds = bar_seconds
+        self.point = point
+        self.ticks = TickBuffer(capacity)
+        self.bars = BarBuffer(bar_capacity) # closed bars (seeded from the broker, then built from ticks)
+        self.open_ticks = np.empty(0, dtype=TICK_DTYPE) # ticks of the bar still forming
+        self.last_msc = None
+        self.same_msc = 0 # ticks already stored with time_msc == last_msc
+
+    # Store new ticks, return the bars they closed
+    def add(self, raw):
+        if raw is None or len(raw) == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        msc = raw['time_msc']
+        if self.last_msc is not None:
+            # copy_ticks_from works in seconds, so drop what was already seen
+            keep = msc > self.last_msc
+            at_last = np.flatnonzero(msc == self.last_msc)
+            keep[at_last[self.same_msc:]] = True
+            raw = raw[keep]
+            msc = raw['time_msc']
+            if len(raw) == 0:
+                return np.empty(0, dtype=BAR_DTYPE)
+        ticks = np.empty(len(raw), dtype=TICK_DTYPE)
+        ticks['time_msc'] = msc
+        ticks['bid'] = raw['bid']
+        ticks['ask'] = raw['ask']
+        if self.last_msc is not None and msc[-1] == self.last_msc:
+            self.same_msc += len(ticks)
+        else:
+            self.last_msc = int(msc[-1])
+            self.same_msc = int((msc == self.last_msc).sum())
+        self.ticks.append(ticks)
+
+        pending = np.concatenate([self.open_ticks, ticks])
+        built = ticks_to_bars(pending, self.bar_seconds, self.point)
+        current = built['time'][-1]
+        self.open_ticks = pending[pending['time_msc'] // 1000 >= current]
+        closed = built[:-1]
+        self.bars.update(closed)
+        return closed
+
+    # Close the open bar once the (estimated) server clock has passed its end
+    def close_by_clock(self, server_msc, grace_msc=2000):
+        if len(self.open_ticks) == 0:
+            return np.empty(0, dtype=BAR_DTYPE)
+        built = ticks_to_bars(self.open_ticks, self.bar_seconds, self.point)
+        if server_msc - grace_msc < (built['time'][-1] + self.bar_seconds) * 1000:
+            return np.empty(0, dtype=BAR_DTYPE)
+        self.open_ticks = np.empty(0, dtype=TICK_DTYPE)
+        self.bars.update(built)
+        return built
+
+    # Closed bars plus the forming bar as the last row, the layout check_signal expects.
+    # Without ticks in the new bar yet, the forming row is flat with no volume.
+    def frame_bars(self):
+        if len(self.open_ticks):
+            forming = ticks_to_bars(self.open_ticks, self.bar_seconds, self.point)
+        elif len(self.bars):
+            forming = np.zeros(1, dtype=BAR_DTYPE)
+            last = self.bars.bars[-1]
+            forming['time'] = last['time'] + self.bar_seconds
+            for name in ('open', 'high', 'low', 'close'):
+                forming[name] = last['close']
+        else:
+            return self.bars.bars
+        return np.concatenate([self.bars.bars, forming])
+
+
+class TickStream:
+    def __init__(self, broker, symbols, bar_seconds=300, capacity=200000, on_bar=None, max_ticks=100000):
+        self.broker = broker
+        self.bar_seconds = bar_seconds
+        self.capacity = capacity
+        self.max_ticks = max_ticks
+        self.on_bar = on_bar # called as on_bar(symbol, closed_bars) when bars close
+        self.symbols = {}
+        self.offset_msc = None # server time minus local time
+        self.newest_msc = None # newest tick seen on any symbol, the only one that moves the offset
+        for symbol in symbols:
+            self.add_symbol(symbol)
+
+    def add_symbol(self, symbol):
+        info = self.broker.symbol_info(symbol)
+        self.symbols[symbol] = SymbolTicks(symbol, self.bar_seconds, self.capacity, point=info.point if info else None)
+
+    # Start the bar history from the terminal once; ticks take over from there
+    def seed(self, symbol, rates):
+        rates = as_bars(rates)
+        if len(rates):
+            self.symbols[symbol].bars.update(rates[:-1])
+
+    def server_now_msc(self):
+        return int(time.time() * 1000) + (self.offset_msc or 0)
+
+    # A tick newer than any seen before was just created on the server, so its time
+    # against the local clock at fetch gives the offset. Re-fetched or quiet-symbol
+    # ticks are older and leave it alone.
+    def observe(self, tick_msc, local_msc):
+        if self.newest_msc is None or tick_msc > self.newest_msc:
+            self.newest_msc = tick_msc
+            self.offset_msc = tick_msc - local_msc
+
+    # Fetch new ticks for every symbol; returns {symbol: closed bars}
+    def poll(self):
+        closed = {}
+        for symbol, state in self.symbols.items():
+            if state.last_msc is None:
+                tick = self.broker.symbol_info_tick(symbol)
+                if tick is None:
+                    continue
+                self.observe(int(tick.time_msc), int(time.time() * 1000))
+                now = tick.time_msc // 1000
+                start = now - now % self.bar_seconds # from the start of the current bar
+            else:
+                start = state.last_msc // 1000
+            raw = self.broker.copy_ticks_from(symbol, start, self.max_ticks, self.broker.COPY_TICKS_ALL)
+            if raw is not None and len(raw):
+                self.observe(int(raw['time_msc'].max()), int(time.time() * 1000))
+            bars = state.add(raw)
+            if len(bars) == 0 and self.offset_msc is not None:
+                bars = state.close_by_clock(self.server_now_msc())
+            if len(bars):
+                closed[symbol] = bars
+                if self.on_bar:
+                    self.on_bar(symbol, bars)
+        return closed
+
+    def run(self, interval=0.25, stop_event=None):
+        while stop_event is None or not stop_event.is_set():
+            self.poll()
+            time.sleep(interval)
+
+    def bars(self, symbol):
+        return self.symbols[symbol].frame_bars()
+
+
+    ''' S P R E A D '''
+
+    # Spread statistics in points over the last `seconds` of ticks
+    def spread_stats(self, symbol, seconds=60):
+        state = self.symbols[symbol]
+        if state.last_msc is None:
+            return None
+        ticks = state.ticks.since(state.last_msc - seconds * 1000)
+        if len(ticks) == 0:
+            return None
+        spread = (ticks['ask'] - ticks['bid']) / (state.point or 1.0)
+        return {
+            'current': float(spread[-1]),
+            'mean': float(spread.mean()),
+            'median': float(np.median(spread)),
+            'p95': float(np.percentile(spread, 95)),
+            'max': float(spread.max()),
+            'ticks': len(spread),
+        }
+
+    # True when the recent median spread is `factor` times the longer-run median
+    def spread_is_wide(self, symbol, factor=3.0, recent=60, baseline=3600):
+        now = self.spread_stats(symbol, recent)
+        normal = self.spread_stats(symbol, baseline)
+        if now is None or normal is None or normal['median'] <= 0:
+            return False
+        return now['median'] > factor * normal['median']